@@ -1,52 +1,33 @@
-import psycopg2
 import logging
-from colorama import init, Fore, Back, Style
-import time
+from datetime import date
 
-init(autoreset=True)
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
-
-def connect_to_db():
-    try:
-        connection = psycopg2.connect(
-            dbname="spatialproject",
-            user="mahi",  
-            password="mahi",  
-            host="localhost"
-        )
-        logging.info("Database connection successful.")
-        return connection
-    except Exception as e:
-        logging.error(f"Error connecting to database: {e}")
-        raise
+from cache import cached, skip_caching
+from db import STREAM_CHUNK_SIZE, get_cursor, stream_rows
+from distances import distance_matrix, nearest_per_row
+from names import resolve_id, resolve_ids, resolve_ids_many
+from queries import STATEMENTS, batch_query_params, group_batch_rows
+from spatial_index import get_index, memory_backend_enabled
+from statements import execute
 
 def show_progress(message):
-    print(f"{Fore.CYAN}{message}...", end="", flush=True)
-    for _ in range(3):  
-        time.sleep(1)
-        print(".", end="", flush=True)
-    print(" Done!")
+    from colorama import Fore
+    print(f"{Fore.CYAN}{message}... Done!")
 
 def display_title():
+    from colorama import Fore, Style
     print(Fore.GREEN + Style.BRIGHT + "===========================")
     print(Fore.YELLOW + Style.BRIGHT + "Spatial Database Application")
     print(Fore.GREEN + Style.BRIGHT + "===========================")
 
 def find_landmarks_in_city(city_name):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN cities c ON l.city_id = c.id
-            WHERE c.name = %s;
-        """
-        cursor.execute(query, (city_name,))
-        landmarks = cursor.fetchall()
-        conn.close()
-        return landmarks
+        city_ids = resolve_ids("cities", city_name)
+        if not city_ids:
+            return []
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "landmarks_in_city_ids", (city_ids,))
+            landmarks = cursor.fetchall()
+            return landmarks
     except Exception as e:
         logging.error(f"Error in find_landmarks_in_city: {e}")
         return []
@@ -54,139 +35,194 @@ def find_landmarks_in_city(city_name):
 # Query to find landmarks within a radius
 def find_landmarks_within_radius(city_name, radius_km):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN cities c ON l.city_id = c.id
-            WHERE c.name = %s AND ST_DWithin(c.location, l.location, %s);
-        """
-        cursor.execute(query, (city_name, radius_km * 1000))  
-        landmarks = cursor.fetchall()
-        conn.close()
-        return landmarks
+        if memory_backend_enabled():
+            return get_index().landmarks_within_radius(city_name, radius_km * 1000)
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "landmarks_in_radius", (city_name, radius_km * 1000))
+            landmarks = cursor.fetchall()
+            return landmarks
     except Exception as e:
         logging.error(f"Error in find_landmarks_within_radius: {e}")
         return []
 
 def calculate_distance(landmark1, landmark2):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT ST_Distance(
-                (SELECT location FROM landmarks WHERE name = %s),
-                (SELECT location FROM landmarks WHERE name = %s)
-            ) AS distance_in_meters;
-        """
-        cursor.execute(query, (landmark1, landmark2))
-        result = cursor.fetchone()
+        # Raises ValueError (logged below) if either name is ambiguous
+        landmark_id1 = resolve_id("landmarks", landmark1)
+        landmark_id2 = resolve_id("landmarks", landmark2)
+        if landmark_id1 is None or landmark_id2 is None:
+            return None
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "calculate_distance", (landmark_id1, landmark_id2))
+            result = cursor.fetchone()
 
-        if result is None or result[0] is None:
-            conn.close()
-            return None  
+            if result is None or result[0] is None:
+                return None  
 
-        distance = result[0]
-        conn.close()
-        return distance
+            distance = result[0]
+            return distance
     except Exception as e:
         logging.error(f"Error in calculate_distance: {e}")
         return None
 
-def find_visitors(landmark_name):
+# since/until bound visit and review dates to [since, until); either may be
+# None. With a bound only the monthly partitions in range are read.
+def date_range(since, until):
+    return since or date.min, until or date.max
+
+def find_visitors(landmark_name, since=None, until=None):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT v.name, v.visit_date
-            FROM visitors v
-            JOIN landmarks l ON v.landmark_id = l.id
-            WHERE l.name = %s;
-        """
-        cursor.execute(query, (landmark_name,))
-        visitors = cursor.fetchall()
-        conn.close()
-        return visitors
+        landmark_ids = resolve_ids("landmarks", landmark_name)
+        if not landmark_ids:
+            return []
+        with get_cursor(readonly=True) as cursor:
+            if since or until:
+                execute(cursor, "find_visitors_between", (landmark_ids, *date_range(since, until)))
+            else:
+                execute(cursor, "find_visitors", (landmark_ids,))
+            visitors = cursor.fetchall()
+            return visitors
     except Exception as e:
         logging.error(f"Error in find_visitors: {e}")
         return []
 
-def fetch_reviews(landmark_name):
+def fetch_reviews(landmark_name, since=None, until=None):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT r.review_text, r.rating, r.review_date
-            FROM reviews r
-            JOIN landmarks l ON r.landmark_id = l.id
-            WHERE l.name = %s;
-        """
-        cursor.execute(query, (landmark_name,))
-        reviews = cursor.fetchall()
-        conn.close()
-        return reviews
+        landmark_ids = resolve_ids("landmarks", landmark_name)
+        if not landmark_ids:
+            return []
+        with get_cursor(readonly=True) as cursor:
+            if since or until:
+                execute(cursor, "reviews_for_landmark_ids_between", (landmark_ids, *date_range(since, until)))
+            else:
+                execute(cursor, "reviews_for_landmark_ids", (landmark_ids,))
+            reviews = cursor.fetchall()
+            return reviews
     except Exception as e:
         logging.error(f"Error in fetch_reviews: {e}")
         return []
 
-def top_visited_landmarks():
+@cached(ttl=60, tables=("landmarks", "visitors"))
+def top_visited_landmarks(since=None, until=None):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT l.name, COUNT(v.id) AS visit_count
-            FROM landmarks l
-            LEFT JOIN visitors v ON l.id = v.landmark_id
-            GROUP BY l.id
-            ORDER BY visit_count DESC
-            LIMIT 5;
-        """
-        cursor.execute(query)
-        landmarks = cursor.fetchall()
-        conn.close()
-        return landmarks
+        with get_cursor(readonly=True) as cursor:
+            if since or until:
+                execute(cursor, "top_visited_landmarks_between", date_range(since, until))
+            else:
+                execute(cursor, "top_visited_landmarks")
+            landmarks = cursor.fetchall()
+            return landmarks
     except Exception as e:
         logging.error(f"Error in top_visited_landmarks: {e}")
+        skip_caching()
         return []
 
+@cached(ttl=300, tables=("landmarks", "reviews"))
 def average_rating(landmark_name):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT AVG(r.rating) AS average_rating
-            FROM reviews r
-            JOIN landmarks l ON r.landmark_id = l.id
-            WHERE l.name = %s;
-        """
-        cursor.execute(query, (landmark_name,))
-        avg_rating = cursor.fetchone()[0]
-        conn.close()
-        return avg_rating
+        landmark_ids = resolve_ids("landmarks", landmark_name)
+        if not landmark_ids:
+            return None
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "average_rating", (landmark_ids,))
+            avg_rating = cursor.fetchone()[0]
+            return avg_rating
     except Exception as e:
         logging.error(f"Error in average_rating: {e}")
+        skip_caching()
         return None
 
 def landmarks_no_visitors():
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            LEFT JOIN visitors v ON l.id = v.landmark_id
-            WHERE v.id IS NULL;
-        """
-        cursor.execute(query)
-        landmarks = cursor.fetchall()
-        conn.close()
-        return landmarks
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "landmarks_no_visitors")
+            landmarks = cursor.fetchall()
+            return landmarks
     except Exception as e:
         logging.error(f"Error in landmarks_no_visitors: {e}")
         return []
 
+# Distances between every origin and destination, each a landmark name, a
+# landmark id or a (lat, lon) point. With nearest=j, returns the j closest
+# destinations of each origin as [(column, metres), ...] instead.
+def calculate_distance_matrix(origins, destinations=None, nearest=None):
+    try:
+        matrix = distance_matrix(origins, destinations)
+        if nearest:
+            return nearest_per_row(matrix, nearest, skip_diagonal=destinations is None)
+        return matrix
+    except Exception as e:
+        logging.error(f"Error in calculate_distance_matrix: {e}")
+        return []
+
+# Streaming variants: rows come from a server-side cursor chunk by chunk, so
+# memory stays flat however many rows match. Errors propagate to the caller.
+
+def iter_visitors(landmark_name, chunk_size=STREAM_CHUNK_SIZE):
+    return stream_rows(STATEMENTS["find_visitors"], (resolve_ids("landmarks", landmark_name),), chunk_size,
+                       readonly=True)
+
+def iter_reviews(landmark_name, chunk_size=STREAM_CHUNK_SIZE):
+    return stream_rows(STATEMENTS["reviews_for_landmark_ids"], (resolve_ids("landmarks", landmark_name),),
+                       chunk_size, readonly=True)
+
+def iter_landmarks_no_visitors(chunk_size=STREAM_CHUNK_SIZE):
+    return stream_rows(STATEMENTS["landmarks_no_visitors"], None, chunk_size, readonly=True)
+
+# Batch variants: one round trip for a whole list of names, keyed by input
+
+def find_landmarks_in_city_many(city_names):
+    names = list(dict.fromkeys(city_names))
+    try:
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "landmarks_in_city_many",
+                    batch_query_params("landmarks_in_city", names))
+            return group_batch_rows(names, cursor.fetchall())
+    except Exception as e:
+        logging.error(f"Error in find_landmarks_in_city_many: {e}")
+        return {}
+
+def find_landmarks_within_radius_many(city_names, radius_km):
+    names = list(dict.fromkeys(city_names))
+    try:
+        if memory_backend_enabled():
+            index = get_index()
+            return {name: index.landmarks_within_radius(name, radius_km * 1000) for name in names}
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "landmarks_in_radius_many",
+                    batch_query_params("landmarks_in_radius", names, radius_km))
+            return group_batch_rows(names, cursor.fetchall())
+    except Exception as e:
+        logging.error(f"Error in find_landmarks_within_radius_many: {e}")
+        return {}
+
+def find_visitors_many(landmark_names):
+    names = list(dict.fromkeys(landmark_names))
+    try:
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "find_visitors_many", resolve_ids_many("landmarks", names))
+            return group_batch_rows(names, cursor.fetchall())
+    except Exception as e:
+        logging.error(f"Error in find_visitors_many: {e}")
+        return {}
+
+def average_rating_many(landmark_names):
+    names = list(dict.fromkeys(landmark_names))
+    try:
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "average_rating_many", resolve_ids_many("landmarks", names))
+            ratings = dict(cursor.fetchall())
+            return {name: ratings.get(name) for name in names}
+    except Exception as e:
+        logging.error(f"Error in average_rating_many: {e}")
+        return {}
+
 def main():
+    # colorama and terminal setup are loaded here so importing the module
+    # (batch.py, app.py) is quick and leaves logging and stdout alone.
+    from colorama import init, Fore
+    init(autoreset=True)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
     display_title()  
     
     while True:
@@ -0,0 +1,179 @@
+"""Per-landmark summary of visit counts and ratings, maintained incrementally.
+
+landmark_stats holds one row per landmark. Statement-level triggers on
+visitors, reviews and landmarks fold each batch of changed rows into it, so
+top_visited_landmarks, landmarks_no_visitors and average_rating read a small
+indexed table instead of aggregating the full event history.
+
+Usage: python aggregates.py install   # create the table and triggers, then rebuild
+       python aggregates.py rebuild   # recompute every row from scratch
+"""
+import argparse
+import logging
+
+from db import get_connection
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS landmark_stats (
+    landmark_id integer PRIMARY KEY REFERENCES landmarks(id) ON DELETE CASCADE,
+    visit_count bigint NOT NULL DEFAULT 0,
+    rating_sum bigint NOT NULL DEFAULT 0,
+    rating_count bigint NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS landmark_stats_visit_count_idx
+    ON landmark_stats (visit_count DESC);
+CREATE INDEX IF NOT EXISTS landmark_stats_no_visitors_idx
+    ON landmark_stats (landmark_id) WHERE visit_count = 0;
+
+CREATE OR REPLACE FUNCTION landmark_stats_visitors() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE landmark_stats SET visit_count = 0 WHERE visit_count <> 0;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE landmark_stats s
+        SET visit_count = s.visit_count - d.n
+        FROM (SELECT landmark_id, COUNT(*) AS n
+              FROM old_rows WHERE landmark_id IS NOT NULL
+              GROUP BY landmark_id) d
+        WHERE s.landmark_id = d.landmark_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO landmark_stats AS s (landmark_id, visit_count)
+        SELECT landmark_id, COUNT(*)
+        FROM new_rows WHERE landmark_id IS NOT NULL
+        GROUP BY landmark_id
+        ON CONFLICT (landmark_id)
+        DO UPDATE SET visit_count = s.visit_count + EXCLUDED.visit_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION landmark_stats_reviews() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE landmark_stats SET rating_sum = 0, rating_count = 0 WHERE rating_count <> 0;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE landmark_stats s
+        SET rating_sum = s.rating_sum - d.total, rating_count = s.rating_count - d.n
+        FROM (SELECT landmark_id, COALESCE(SUM(rating), 0) AS total, COUNT(rating) AS n
+              FROM old_rows WHERE landmark_id IS NOT NULL
+              GROUP BY landmark_id) d
+        WHERE s.landmark_id = d.landmark_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO landmark_stats AS s (landmark_id, rating_sum, rating_count)
+        SELECT landmark_id, COALESCE(SUM(rating), 0), COUNT(rating)
+        FROM new_rows WHERE landmark_id IS NOT NULL
+        GROUP BY landmark_id
+        ON CONFLICT (landmark_id)
+        DO UPDATE SET rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+                      rating_count = s.rating_count + EXCLUDED.rating_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION landmark_stats_landmarks() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO landmark_stats (landmark_id)
+    SELECT id FROM new_rows
+    ON CONFLICT (landmark_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS visitors_stats_insert ON visitors;
+DROP TRIGGER IF EXISTS visitors_stats_update ON visitors;
+DROP TRIGGER IF EXISTS visitors_stats_delete ON visitors;
+DROP TRIGGER IF EXISTS visitors_stats_truncate ON visitors;
+CREATE TRIGGER visitors_stats_insert AFTER INSERT ON visitors
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+CREATE TRIGGER visitors_stats_update AFTER UPDATE ON visitors
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+CREATE TRIGGER visitors_stats_delete AFTER DELETE ON visitors
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+CREATE TRIGGER visitors_stats_truncate AFTER TRUNCATE ON visitors
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+
+DROP TRIGGER IF EXISTS reviews_stats_insert ON reviews;
+DROP TRIGGER IF EXISTS reviews_stats_update ON reviews;
+DROP TRIGGER IF EXISTS reviews_stats_delete ON reviews;
+DROP TRIGGER IF EXISTS reviews_stats_truncate ON reviews;
+CREATE TRIGGER reviews_stats_insert AFTER INSERT ON reviews
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+CREATE TRIGGER reviews_stats_update AFTER UPDATE ON reviews
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+CREATE TRIGGER reviews_stats_delete AFTER DELETE ON reviews
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+CREATE TRIGGER reviews_stats_truncate AFTER TRUNCATE ON reviews
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+
+DROP TRIGGER IF EXISTS landmarks_stats_insert ON landmarks;
+CREATE TRIGGER landmarks_stats_insert AFTER INSERT ON landmarks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_landmarks();
+"""
+
+REBUILD_SQL = """
+LOCK TABLE visitors, reviews IN SHARE MODE;
+TRUNCATE landmark_stats;
+INSERT INTO landmark_stats (landmark_id, visit_count, rating_sum, rating_count)
+SELECT l.id, COALESCE(v.n, 0), COALESCE(r.total, 0), COALESCE(r.n, 0)
+FROM landmarks l
+LEFT JOIN (
+    SELECT landmark_id, COUNT(*) AS n
+    FROM visitors
+    GROUP BY landmark_id
+) v ON v.landmark_id = l.id
+LEFT JOIN (
+    SELECT landmark_id, SUM(rating) AS total, COUNT(rating) AS n
+    FROM reviews
+    GROUP BY landmark_id
+) r ON r.landmark_id = l.id;
+"""
+
+
+def install_aggregates():
+    """Create landmark_stats and its triggers, then populate it."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA_SQL)
+            cursor.execute(REBUILD_SQL)
+    logging.info("landmark_stats installed and populated.")
+
+
+def rebuild_aggregates():
+    """Recompute landmark_stats from visitors and reviews, e.g. after a bad load."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(REBUILD_SQL)
+            cursor.execute("SELECT COUNT(*) FROM landmark_stats;")
+            rows = cursor.fetchone()[0]
+    logging.info(f"landmark_stats rebuilt ({rows} landmarks).")
+    return rows
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Maintain the landmark_stats summary table.")
+    parser.add_argument("command", choices=["install", "rebuild"])
+    args = parser.parse_args()
+    if args.command == "install":
+        install_aggregates()
+    else:
+        rebuild_aggregates()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,52 @@
-from flask import Flask, render_template, request, jsonify
-import psycopg2
+from flask import Flask, Response, render_template, request, jsonify
+from werkzeug.http import is_resource_modified
+import hashlib
 import logging
+import threading
+from datetime import datetime, timezone
+
+import metrics
+from cache import cache_stats, cached_call, coalesce, single_flight_stats
+from changes import feed_stats, start_listener, table_versions
+from db import get_cursor, pool_stats, replica_stats, stream_rows
+from distances import distance_matrix, nearest_per_row
+from queries import (BATCH_QUERY_SQL, MAX_PAGE_SIZE, QUERY_CACHE_TTLS, QUERY_KEYS, QUERY_SQL,
+                     QUERY_TABLES, batch_query_params, decode_cursor, group_batch_rows,
+                     paged_query_sql, query_params, split_page)
+from names import warm_names
+from spatial_index import get_index, memory_backend_enabled
+from statements import execute, plan_stats, statement_stats
+from tiles import TILE_MAX_AGE, tile_cells, tile_mvt, valid_tile
 
 app = Flask(__name__)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
+_background_started = False
+_background_lock = threading.Lock()
+
+
+def start_background():
+    """Start this process's background work, once.
+
+    Runs before the first request rather than at import, so importing app
+    (from tests or tooling) opens no connections and starts no threads.
+    """
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    # Load the name directory in the background so later requests find it warm
+    threading.Thread(target=warm_names, daemon=True).start()
+    # Keep the caches, name directory and spatial index current from table triggers
+    start_listener()
 
-def connect_to_db():
-    """Connect to the PostgreSQL database."""
-    try:
-        connection = psycopg2.connect(
-            dbname="spatialproject",
-            user="mahi",
-            password="mahi",
-            host="localhost"
-        )
-        logging.info("Database connection successful.")
-        return connection
-    except Exception as e:
-        logging.error(f"Error connecting to database: {e}")
-        raise
+
+@app.before_request
+def before_first_request():
+    start_background()
 
 
 @app.route('/')
@@ -30,105 +55,261 @@ def index():
     return render_template('buttons.html')
 
 
-@app.route('/query', methods=['POST'])
+@app.route('/query', methods=['GET', 'POST'])
 def query():
-    """Handle queries based on user input."""
-    query_type = request.form.get('query_type')
-    user_input = request.form.get('user_input', '')
-    radius = request.form.get('radius', None)
-    landmark_type = request.form.get('landmark_type', None)
-
-    conn = connect_to_db()
-    cursor = conn.cursor()
-
-    # Queries based on query type
-    if query_type == "landmarks_in_city":
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN cities c ON l.city_id = c.id
-            WHERE c.name = %s;
-        """
-        cursor.execute(query, (user_input,))
-        result = cursor.fetchall()
-
-    elif query_type == "landmarks_in_radius":
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN cities c ON l.city_id = c.id
-            WHERE c.name = %s AND ST_DWithin(c.location, l.location, %s);
-        """
-        cursor.execute(query, (user_input, float(radius) * 1000))
-        result = cursor.fetchall()
-
-    elif query_type == "reviews_for_landmark":
-        query = """
-            SELECT r.review_text, r.rating, r.review_date
-            FROM reviews r
-            JOIN landmarks l ON r.landmark_id = l.id
-            WHERE l.name = %s;
-        """
-        cursor.execute(query, (user_input,))
-        result = cursor.fetchall()
-
-    elif query_type == "landmarks_of_type":
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN cities c ON l.city_id = c.id
-            WHERE c.name = %s AND l.type = %s;
-        """
-        cursor.execute(query, (user_input, landmark_type))
-        result = cursor.fetchall()
-
-    elif query_type == "landmarks_by_rating":
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN reviews r ON l.id = r.landmark_id
-            WHERE r.rating = %s;
-        """
-        cursor.execute(query, (user_input,))
-        result = cursor.fetchall()
-
-    elif query_type == "landmarks_in_country":
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN cities c ON l.city_id = c.id
-            JOIN countries co ON c.country_id = co.id
-            WHERE co.name = %s;
-        """
-        cursor.execute(query, (user_input,))
-        result = cursor.fetchall()
-
-    elif query_type == "nearby_landmarks":
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN landmarks ln ON ST_DWithin(l.location, ln.location, 1000)
-            WHERE ln.name = %s;
-        """
-        cursor.execute(query, (user_input,))
-        result = cursor.fetchall()
-
-    elif query_type == "landmarks_by_keyword":
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN reviews r ON l.id = r.landmark_id
-            WHERE r.review_text ILIKE %s;
-        """
-        cursor.execute(query, ('%' + user_input + '%',))
-        result = cursor.fetchall()
+    """Handle queries based on user input.
+
+    GET takes the same fields in the query string, for the query types that
+    are cached, and answers If-None-Match/If-Modified-Since with 304.
+    """
+    if request.method != 'POST' and request.args.get('query_type') not in QUERY_TABLES:
+        return jsonify({"error": "GET is only supported for cacheable query types"}), 400
+    fields = request.form if request.method == 'POST' else request.args
+    query_type = fields.get('query_type')
+    user_inputs = fields.getlist('user_input')
+    radius = fields.get('radius', None)
+    landmark_type = fields.get('landmark_type', None)
+    limit = fields.get('limit', type=int)
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+    if len(user_inputs) > 1 and query_type not in BATCH_QUERY_SQL:
+        return jsonify({"error": f"{query_type} takes a single user_input"}), 400
+    user_input = user_inputs[0] if user_inputs else ''
+    # Large results: format=ndjson streams rows, limit/cursor pages through them.
+    # Ranked queries (keyword search) have no keyset and take limit directly.
+    keyset = query_type in QUERY_KEYS and len(user_inputs) <= 1
+    stream = keyset and fields.get('format') == 'ndjson'
+    paged = keyset and not stream and limit is not None
+    page_cursor = fields.get('cursor') if paged else None
+
+    # Check the parameters once, before dispatch, so bad input is a 400 on every path
+    try:
+        if len(user_inputs) > 1:
+            batch_query_params(query_type, user_inputs, radius)
+        elif query_type in QUERY_SQL:
+            query_params(query_type, user_input, radius, landmark_type, limit)
+        after = decode_cursor(query_type, page_cursor) if page_cursor else None
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid parameters for {query_type}: {e}"}), 400
+
+    key = ("query", query_type, tuple(user_inputs), radius, landmark_type, limit, page_cursor,
+           'ndjson' if stream else 'json')
+    tables = QUERY_TABLES.get(query_type, ())
+    # Only GETs can be answered with 304, so only they need table versions
+    versioned = request.method != 'POST' and bool(tables)
+
+    if stream:
+        # Streams are not cached, but GETs still get validators. The versions
+        # are read before the rows, so they are never newer than them.
+        versions = None
+        if versioned:
+            with get_cursor(readonly=True) as cursor:
+                versions = table_versions(cursor, tables)
+        if versions is None:
+            return stream_query(query_type, user_input, radius, landmark_type)
+        etag, last_modified = query_validators(key, versions)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            metrics.inc("spatial_query_not_modified_total", query_type)
+            return set_validators(Response(status=304), etag, last_modified)
+        return set_validators(stream_query(query_type, user_input, radius, landmark_type), etag, last_modified)
+
+    def versioned_run():
+        # Versions of the tables read, kept in the database by the change
+        # triggers so every worker derives the same validators. They are read
+        # on the query's own connection just before it runs, so the rows are
+        # at least as new as the versions they are tagged with.
+        with get_cursor(readonly=True) as cursor:
+            versions = table_versions(cursor, tables) if versioned else None
+            if paged:
+                return versions, page_query(query_type, user_input, radius, landmark_type, limit, after, cursor)
+            return versions, run_query(query_type, user_inputs, radius, landmark_type, limit, cursor)
+
+    # The versions are cached with the rows, so a cache hit, conditional or
+    # not, needs no database round trip; the change feed drops the entry
+    # when one of the tables changes. Identical requests arriving together
+    # share one execution.
+    cache_key = key + (versioned,)
+    (versions, result), shared = coalesce(cache_key, lambda: cached_call(
+        cache_key, versioned_run, ttl=QUERY_CACHE_TTLS.get(query_type), tables=tables))
+    if shared:
+        metrics.inc("spatial_query_coalesced_total", query_type)
+
+    if versions is not None:
+        etag, last_modified = query_validators(key, versions)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            metrics.inc("spatial_query_not_modified_total", query_type)
+            return set_validators(Response(status=304), etag, last_modified)
+
+    # Return JSON response; without the change triggers the ETag is a hash of the body
+    response = jsonify(result)
+    if versions is None:
+        etag, last_modified = hashlib.sha1(response.get_data()).hexdigest(), None
+    return set_validators(response, etag, last_modified).make_conditional(request)
+
+
+def query_validators(key, versions):
+    """ETag and Last-Modified of a /query result from its request key and table versions."""
+    token, changed_at = versions
+    etag = hashlib.sha1(repr((key, token)).encode()).hexdigest()
+    return etag, datetime.fromtimestamp(changed_at, timezone.utc)
+
+
+def set_validators(response, etag, last_modified):
+    """Add the ETag, Last-Modified and revalidate-every-time caching headers to a /query response."""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if request.method != 'POST':
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+    return response
+
+
+def stream_query(query_type, user_input, radius, landmark_type):
+    """Send rows as newline-delimited JSON while they are read from a server-side cursor.
+
+    Only the time spent fetching from the database counts as the statement's
+    duration, not the time the client takes to read the response.
+    """
+    name = f"{query_type}:stream"
+    sql = QUERY_SQL[query_type]
+    params = query_params(query_type, user_input, radius, landmark_type)
+    rows = stream_rows(sql, params, readonly=True)
+
+    def generate():
+        try:
+            with metrics.timed(name, sql, params) as timing:
+                timing.rows = 0
+                for row in rows:
+                    timing.rows += 1
+                    with timing.paused():
+                        yield app.json.dumps(list(row)) + "\n"
+        finally:
+            rows.close()
 
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+def page_query(query_type, user_input, radius, landmark_type, limit, after, cursor):
+    """Return the keyset page after the decoded cursor ``after`` and the cursor token for the next one."""
+    params = query_params(query_type, user_input, radius, landmark_type) + tuple(after or ()) + (limit,)
+    name = f"{query_type}:page"
+    sql = paged_query_sql(query_type, after)
+    with metrics.timed(name, sql, params) as timing:
+        cursor.execute(sql, params)
+        timing.rows = cursor.rowcount
+    rows, next_cursor = split_page(query_type, cursor.fetchall(), limit)
+    return {"rows": rows, "next_cursor": next_cursor}
+
+
+@app.route('/distances', methods=['POST'])
+def distances():
+    """Distance matrix between landmark names, ids or [lat, lon] points, posted as JSON."""
+    body = request.get_json(silent=True) or {}
+    origins = body.get('origins')
+    destinations = body.get('destinations')
+    if not isinstance(origins, list) or not isinstance(destinations, (list, type(None))):
+        return jsonify({"error": "origins (and optional destinations) must be lists"}), 400
+    nearest = body.get('nearest')
+    if nearest is not None and (not isinstance(nearest, int) or isinstance(nearest, bool) or nearest < 1):
+        return jsonify({"error": "nearest must be a positive integer"}), 400
+    as_points = lambda items: [tuple(item) if isinstance(item, list) else item for item in items]
+    try:
+        matrix = distance_matrix(as_points(origins),
+                                 as_points(destinations) if destinations is not None else None)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if nearest is not None:
+        return jsonify(nearest_per_row(matrix, nearest, skip_diagonal=destinations is None))
+    return jsonify(matrix)
+
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>')
+def tile(z, x, y):
+    """Landmark, visit and rating aggregates for one map tile, as MVT or (format=json) JSON."""
+    if not valid_tile(z, x, y):
+        return jsonify({"error": "no such tile"}), 404
+    fmt = request.args.get('format', 'mvt')
+    if fmt not in ('mvt', 'json'):
+        return jsonify({"error": "format must be mvt or json"}), 400
+    if fmt == 'mvt':
+        build, mimetype = (lambda: tile_mvt(z, x, y)), 'application/vnd.mapbox-vector-tile'
     else:
-        result = []
+        build, mimetype = (lambda: app.json.dumps(tile_cells(z, x, y)).encode()), 'application/json'
+    try:
+        body = cached_call(("tile", fmt, z, x, y), build, ttl=TILE_MAX_AGE, tables=("tile_stats",))
+    except Exception as e:
+        logging.error(f"Error in tile: {e}")
+        return jsonify({"error": "tile unavailable"}), 503
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(hashlib.sha1(body).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = TILE_MAX_AGE
+    return response.make_conditional(request)
+
+
+@app.route('/cache/stats')
+def cache_statistics():
+    """Expose cache hit/miss counters and executions saved by coalescing, for tuning."""
+    return jsonify({**cache_stats(), "single_flight": single_flight_stats()})
+
+
+@app.route('/statements/stats')
+def statements_statistics():
+    """Expose prepared-statement reuse, plus plan choices on one pooled connection."""
+    with get_cursor() as cursor:
+        plans = plan_stats(cursor)
+    return jsonify({"statements": statement_stats(), "plans": plans})
+
+
+@app.route('/db/replicas')
+def replicas():
+    """Read-replica load, errors, circuit-breaker state and lag."""
+    return jsonify(replica_stats())
+
+
+@app.route('/changes/stats')
+def changes_statistics():
+    """Change feed events applied, resyncs and reconnects."""
+    return jsonify(feed_stats())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Per-query latency, rows, pool wait and errors in the Prometheus text format."""
+    return Response(metrics.render_metrics(pool_stats()), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/slow-queries')
+def slow_queries():
+    """The most recent slow statements and their EXPLAIN (ANALYZE, BUFFERS) plans."""
+    return jsonify(metrics.recent_slow_queries())
+
+
+def run_query(query_type, user_inputs, radius, landmark_type, limit=None, cursor=None):
+    """Run one /query request against the database and return its rows, on ``cursor`` if given."""
+    user_input = user_inputs[0] if user_inputs else ''
+    batch = len(user_inputs) > 1
 
-    # Return JSON response
-    return jsonify(result)
+    # Spatial lookups served from the in-memory index when it is enabled
+    if not batch and memory_backend_enabled() and query_type == "landmarks_in_radius":
+        return get_index().landmarks_within_radius(user_input, float(radius) * 1000)
+    if not batch and memory_backend_enabled() and query_type == "nearby_landmarks":
+        return get_index().nearby_landmarks(user_input, 1000)
 
+    if query_type not in QUERY_SQL:
+        return []
+    if cursor is None:
+        with get_cursor(readonly=True) as cursor:
+            return run_query(query_type, user_inputs, radius, landmark_type, limit, cursor)
+    # A repeated user_input field runs the query for every value in one round
+    # trip; query() only lets several values through for BATCH_QUERY_SQL types
+    if batch:
+        params = batch_query_params(query_type, user_inputs, radius)
+        execute(cursor, f"{query_type}_many", params)
+        return group_batch_rows(params[0], cursor.fetchall())
+    execute(cursor, query_type, query_params(query_type, user_input, radius, landmark_type, limit))
+    return cursor.fetchall()
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,182 @@
+"""Async serving mode for the web app's /query, with the same JSON as app.py.
+
+Serves /, POST /query (including ndjson streaming and keyset pages) and
+/cache/stats; the other app.py routes, GET /query and 304 revalidation are
+only in app.py. Cached results are dropped by the change feed listener when
+a table they read changes, as in app.py.
+
+Built on Quart and asyncpg, so a worker keeps serving other requests while
+PostgreSQL works on a query. Every query runs under SPATIAL_REQUEST_TIMEOUT
+seconds; on timeout or client disconnect the request task is cancelled and
+asyncpg cancels the statement on the server before the connection is reused.
+
+Run with: hypercorn async_app:app --bind 0.0.0.0:8000
+"""
+import asyncio
+import logging
+import os
+
+import asyncpg
+from quart import Quart, jsonify, render_template, request
+
+from cache import async_cached_call, cache_stats
+from changes import start_listener
+from db import DB_CONFIG, POOL_MAX_SIZE, POOL_MIN_SIZE, STREAM_CHUNK_SIZE
+from queries import (BATCH_QUERY_SQL, MAX_PAGE_SIZE, QUERY_CACHE_TTLS, QUERY_KEYS, QUERY_SQL,
+                     QUERY_TABLES, batch_query_params, decode_cursor, group_batch_rows, paged_query_sql,
+                     query_params, split_page, to_dollar_params)
+from spatial_index import get_index, memory_backend_enabled
+
+REQUEST_TIMEOUT = float(os.environ.get("SPATIAL_REQUEST_TIMEOUT", "10"))
+
+app = Quart(__name__)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+_pool = None
+
+
+@app.before_serving
+async def open_pool():
+    """Create the asyncpg pool once the event loop is running."""
+    global _pool
+    _pool = await asyncpg.create_pool(
+        database=DB_CONFIG["dbname"],
+        user=DB_CONFIG["user"],
+        password=DB_CONFIG["password"],
+        host=DB_CONFIG["host"],
+        port=int(DB_CONFIG["port"]),
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+    )
+    logging.info(f"Async connection pool created (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE}).")
+    # Keep the cache, name directory and spatial index current from table triggers
+    start_listener()
+
+
+@app.after_serving
+async def close_pool():
+    await _pool.close()
+    logging.info("Async connection pool closed.")
+
+
+async def fetch(sql, *params):
+    async with _pool.acquire(timeout=REQUEST_TIMEOUT) as conn:
+        rows = await conn.fetch(to_dollar_params(sql), *params, timeout=REQUEST_TIMEOUT)
+    return [tuple(row) for row in rows]
+
+
+@app.route('/')
+async def index():
+    """Display the main page with buttons for each query."""
+    return await render_template('buttons.html')
+
+
+@app.route('/query', methods=['POST'])
+async def query():
+    """Handle queries based on user input."""
+    form = await request.form
+    query_type = form.get('query_type')
+    user_inputs = form.getlist('user_input')
+    radius = form.get('radius', None)
+    landmark_type = form.get('landmark_type', None)
+    limit = form.get('limit', type=int)
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+    if len(user_inputs) > 1 and query_type not in BATCH_QUERY_SQL:
+        return jsonify({"error": f"{query_type} takes a single user_input"}), 400
+
+    user_input = user_inputs[0] if user_inputs else ''
+    # Large results: format=ndjson streams rows, limit/cursor pages through them.
+    # Ranked queries (keyword search) have no keyset and take limit directly.
+    keyset = query_type in QUERY_KEYS and len(user_inputs) <= 1
+    stream = keyset and form.get('format') == 'ndjson'
+    paged = keyset and not stream and limit is not None
+    page_cursor = form.get('cursor') if paged else None
+
+    # Check the parameters once, before dispatch, so bad input is a 400 on every path
+    try:
+        if len(user_inputs) > 1:
+            batch_query_params(query_type, user_inputs, radius)
+        elif query_type in QUERY_SQL:
+            query_params(query_type, user_input, radius, landmark_type, limit)
+        after = decode_cursor(query_type, page_cursor) if page_cursor else None
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid parameters for {query_type}: {e}"}), 400
+
+    if stream:
+        return stream_query(query_type, user_input, radius, landmark_type)
+
+    def run():
+        if paged:
+            return page_query(query_type, user_input, radius, landmark_type, limit, after)
+        return run_query(query_type, user_inputs, radius, landmark_type, limit)
+
+    key = ("query", query_type, tuple(user_inputs), radius, landmark_type, limit, page_cursor)
+    try:
+        result = await async_cached_call(
+            key, lambda: asyncio.wait_for(run(), REQUEST_TIMEOUT),
+            ttl=QUERY_CACHE_TTLS.get(query_type), tables=QUERY_TABLES.get(query_type, ()))
+    except asyncio.TimeoutError:
+        logging.error(f"Query {query_type} timed out after {REQUEST_TIMEOUT}s")
+        return jsonify({"error": "query timed out"}), 504
+
+    # Return JSON response
+    return jsonify(result)
+
+
+def stream_query(query_type, user_input, radius, landmark_type):
+    """Send rows as newline-delimited JSON while they are read from a server-side cursor."""
+    sql = to_dollar_params(QUERY_SQL[query_type])
+    params = query_params(query_type, user_input, radius, landmark_type)
+
+    async def generate():
+        async with _pool.acquire(timeout=REQUEST_TIMEOUT) as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(sql, *params, prefetch=STREAM_CHUNK_SIZE):
+                    yield (app.json.dumps(list(row)) + "\n").encode()
+
+    return generate(), 200, {"Content-Type": "application/x-ndjson"}
+
+
+async def page_query(query_type, user_input, radius, landmark_type, limit, after):
+    """Return the keyset page after the decoded cursor ``after`` and the cursor token for the next one."""
+    params = query_params(query_type, user_input, radius, landmark_type) + tuple(after or ()) + (limit,)
+    rows = await fetch(paged_query_sql(query_type, after), *params)
+    rows, next_cursor = split_page(query_type, rows, limit)
+    return {"rows": rows, "next_cursor": next_cursor}
+
+
+@app.route('/cache/stats')
+async def cache_statistics():
+    """Expose cache hit/miss counters for tuning."""
+    return jsonify(cache_stats())
+
+
+async def run_query(query_type, user_inputs, radius, landmark_type, limit=None):
+    """Async counterpart of app.run_query."""
+    user_input = user_inputs[0] if user_inputs else ''
+
+    # A repeated user_input field runs the query for every value in one round trip
+    if len(user_inputs) > 1 and query_type in BATCH_QUERY_SQL:
+        params = batch_query_params(query_type, user_inputs, radius)
+        rows = await fetch(BATCH_QUERY_SQL[query_type], *params)
+        return group_batch_rows(params[0], rows)
+
+    # Spatial lookups served from the in-memory index when it is enabled; the
+    # first call loads it synchronously, so keep that off the event loop.
+    if memory_backend_enabled() and query_type in ("landmarks_in_radius", "nearby_landmarks"):
+        index = await asyncio.to_thread(get_index)
+        if query_type == "landmarks_in_radius":
+            return index.landmarks_within_radius(user_input, float(radius) * 1000)
+        return index.nearby_landmarks(user_input, 1000)
+
+    if query_type not in QUERY_SQL:
+        return []
+    return await fetch(QUERY_SQL[query_type],
+                       *query_params(query_type, user_input, radius, landmark_type, limit))
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
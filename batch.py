@@ -0,0 +1,137 @@
+"""Run query commands from a file or stdin and write the results as JSONL.
+
+Each input line is a query function name followed by its arguments, split
+like a shell command line, so names with spaces are quoted:
+
+    find_landmarks_in_city "New York"
+    find_landmarks_within_radius Paris 2.5
+    find_nearest_landmarks 48.8584 2.2945 10
+    top_visited_landmarks 2026-10-01 2026-10-08
+    # blank lines and comments are skipped
+
+Commands run concurrently on a bounded thread pool, each on its own pooled
+connection, and one JSON object per command is written in input order:
+{"line", "query", "args", "seconds", "result"} or, for a command that could
+not be run, "error" instead of "result".
+
+Usage: python batch.py queries.txt --workers 8 --output report.jsonl
+       python batch.py < queries.txt
+"""
+import argparse
+import json
+import logging
+import shlex
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import spatial
+from db import POOL_MAX_SIZE
+
+# spatial function name -> (argument converters, number of required arguments)
+COMMANDS = {
+    "find_landmarks_in_city": ((str,), 1),
+    "find_landmarks_within_radius": ((str, float), 2),
+    "calculate_distance": ((str, str), 2),
+    "find_visitors": ((str, date.fromisoformat, date.fromisoformat), 1),
+    "fetch_reviews": ((str, date.fromisoformat, date.fromisoformat), 1),
+    "top_visited_landmarks": ((date.fromisoformat, date.fromisoformat), 0),
+    "average_rating": ((str,), 1),
+    "landmarks_no_visitors": ((), 0),
+    "find_neighboring_cities": ((str, float), 2),
+    "find_landmarks_along_route": ((int, float, float), 1),
+    "calculate_bounding_box": ((str,), 1),
+    "find_closest_landmark": ((float, float), 2),
+    "find_nearest_landmarks": ((float, float, int), 2),
+    "is_landmark_in_region": ((str, int), 2),
+    "find_city_landmark_center": ((str,), 1),
+    "find_intersection_area": ((int, int), 2),
+}
+
+
+def parse_command(text):
+    """(name, converted args) for one input line; ValueError if it is malformed."""
+    words = shlex.split(text)
+    name, raw_args = words[0], words[1:]
+    if name not in COMMANDS:
+        raise ValueError(f"Unknown query {name!r}")
+    converters, required = COMMANDS[name]
+    if not required <= len(raw_args) <= len(converters):
+        expected = required if required == len(converters) else f"{required}-{len(converters)}"
+        raise ValueError(f"{name} takes {expected} argument(s), got {len(raw_args)}")
+    return name, [convert(value) for convert, value in zip(converters, raw_args)]
+
+
+def read_commands(lines):
+    """(line number, text) for every line that is not blank or a comment."""
+    for number, line in enumerate(lines, 1):
+        text = line.strip()
+        if text and not text.startswith("#"):
+            yield number, text
+
+
+def run_command(number, text):
+    """Run one input line and return its output record."""
+    record = {"line": number, "query": text.split(None, 1)[0]}
+    try:
+        name, args = parse_command(text)
+    except ValueError as e:
+        record["error"] = str(e)
+        return record
+    record["args"] = args
+    start = time.perf_counter()
+    try:
+        record["result"] = getattr(spatial, name)(*args)
+    except Exception as e:
+        record["error"] = str(e)
+    record["seconds"] = round(time.perf_counter() - start, 6)
+    return record
+
+
+def run_batch(lines, output, workers=POOL_MAX_SIZE):
+    """Run every command in ``lines`` on ``workers`` threads, writing JSONL to ``output`` in input order.
+
+    At most a few commands per worker are queued ahead of the one being
+    written, so memory stays flat however long the input is.
+    """
+    pending = deque()
+    count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for number, text in read_commands(lines):
+            pending.append(executor.submit(run_command, number, text))
+            if len(pending) >= workers * 4:
+                _write(output, pending.popleft().result())
+                count += 1
+        while pending:
+            _write(output, pending.popleft().result())
+            count += 1
+    return count
+
+
+def _write(output, record):
+    # Decimal, date and tuple results become strings and lists
+    output.write(json.dumps(record, default=str) + "\n")
+    output.flush()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', stream=sys.stderr)
+    parser = argparse.ArgumentParser(description="Run query commands and write the results as JSONL.")
+    parser.add_argument("input", nargs="?", type=argparse.FileType("r"), default=sys.stdin,
+                        help="file of commands, one per line (default: stdin)")
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout,
+                        help="JSONL destination (default: stdout)")
+    parser.add_argument("--workers", type=int, default=POOL_MAX_SIZE,
+                        help="commands run at once; more than the pool size only queues for connections")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    start = time.perf_counter()
+    count = run_batch(args.input, args.output, args.workers)
+    logging.info(f"{count} queries in {time.perf_counter() - start:.2f}s.")
+
+
+if __name__ == "__main__":
+    main()
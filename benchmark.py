@@ -0,0 +1,197 @@
+"""Latency and throughput of every query function at several dataset scales.
+
+Loads a synthetic dataset per scale into a disposable PostGIS database, runs
+each query function with arguments drawn from that dataset, and writes
+p50/p95/p99 latency and queries/sec to a JSON file for comparing runs.
+
+A throwaway database:
+    docker run --rm -d -p 5433:5432 -e POSTGRES_PASSWORD=bench postgis/postgis
+    export SPATIAL_DB_PORT=5433 SPATIAL_DB_USER=postgres SPATIAL_DB_PASSWORD=bench \\
+           SPATIAL_DB_NAME=postgres
+Usage: python benchmark.py --scales 0.1 1 5 --iterations 200 --output results.json
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import cache
+import db
+from ads_project import (average_rating, average_rating_many, calculate_distance, calculate_distance_matrix,
+                         fetch_reviews, find_landmarks_in_city, find_landmarks_in_city_many,
+                         find_landmarks_within_radius, find_landmarks_within_radius_many, find_visitors,
+                         find_visitors_many, landmarks_no_visitors, top_visited_landmarks)
+from new_project import (calculate_bounding_box, find_city_landmark_center, find_closest_landmark,
+                         find_intersection_area, find_landmarks_along_route, find_landmarks_along_routes,
+                         find_nearest_landmarks, find_nearest_landmarks_many, find_neighboring_cities,
+                         find_regions_for_landmarks, find_regions_for_points, is_landmark_in_region,
+                         region_overlap_matrix)
+from queries import query_params
+from statements import execute
+from synthetic_data import DAYS, FIRST_DATE, SyntheticDataset, load_dataset
+
+
+class ErrorCounter(logging.Handler):
+    """Counts logged errors, since the query functions swallow their exceptions."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def run_app_query(query_type, *args):
+    with db.get_cursor() as cursor:
+        execute(cursor, query_type, query_params(query_type, *args))
+        return cursor.fetchall()
+
+
+def workloads(dataset, rng):
+    """(name, function, argument sampler) for every query function."""
+    city = lambda: rng.choice(dataset.cities)[1]
+    landmark = lambda: rng.choice(dataset.landmarks)[1]
+    point = lambda: (rng.uniform(35, 60), rng.uniform(-10, 30))
+    route = lambda: rng.randint(1, dataset.counts["routes"])
+    region = lambda: rng.randint(1, dataset.counts["regions"])
+    cities = lambda n: [city() for _ in range(n)]
+    landmarks = lambda n: [landmark() for _ in range(n)]
+    points = lambda n: [point() for _ in range(n)]
+
+    def month():
+        since = FIRST_DATE + timedelta(days=rng.randrange(DAYS - 30))
+        return since, since + timedelta(days=30)
+
+    return [
+        ("find_landmarks_in_city", find_landmarks_in_city, lambda: (city(),)),
+        ("find_landmarks_within_radius", find_landmarks_within_radius, lambda: (city(), 5)),
+        ("calculate_distance", calculate_distance, lambda: (landmark(), landmark())),
+        ("find_visitors", find_visitors, lambda: (landmark(),)),
+        ("fetch_reviews", fetch_reviews, lambda: (landmark(),)),
+        ("top_visited_landmarks", top_visited_landmarks, lambda: ()),
+        ("average_rating", average_rating, lambda: (landmark(),)),
+        ("landmarks_no_visitors", landmarks_no_visitors, lambda: ()),
+        ("find_neighboring_cities", find_neighboring_cities, lambda: (city(), 200)),
+        ("find_landmarks_along_route", find_landmarks_along_route, lambda: (route(),)),
+        ("calculate_bounding_box", calculate_bounding_box, lambda: (city(),)),
+        ("find_closest_landmark", find_closest_landmark, point),
+        ("find_nearest_landmarks", find_nearest_landmarks, point),
+        ("is_landmark_in_region", is_landmark_in_region, lambda: (landmark(), region())),
+        ("find_city_landmark_center", find_city_landmark_center, lambda: (city(),)),
+        ("find_intersection_area", find_intersection_area, lambda: (region(), region())),
+        ("find_visitors:month", find_visitors, lambda: (landmark(), *month())),
+        ("fetch_reviews:month", fetch_reviews, lambda: (landmark(), *month())),
+        ("top_visited_landmarks:month", top_visited_landmarks, month),
+        ("find_nearest_landmarks:k20", find_nearest_landmarks, lambda: (*point(), 20)),
+        ("find_nearest_landmarks_many", find_nearest_landmarks_many, lambda: (points(50), 5)),
+        ("find_landmarks_along_routes", find_landmarks_along_routes, lambda: ([route() for _ in range(10)],)),
+        ("find_regions_for_landmarks", find_regions_for_landmarks, lambda: (landmarks(50),)),
+        ("find_regions_for_points", find_regions_for_points, lambda: (points(50),)),
+        ("region_overlap_matrix", region_overlap_matrix, lambda: ()),
+        ("calculate_distance_matrix", calculate_distance_matrix, lambda: (landmarks(20), landmarks(20))),
+        ("find_landmarks_in_city_many", find_landmarks_in_city_many, lambda: (cities(20),)),
+        ("find_landmarks_within_radius_many", find_landmarks_within_radius_many, lambda: (cities(20), 5)),
+        ("find_visitors_many", find_visitors_many, lambda: (landmarks(20),)),
+        ("average_rating_many", average_rating_many, lambda: (landmarks(20),)),
+        ("query:landmarks_in_city", run_app_query, lambda: ("landmarks_in_city", city())),
+        ("query:landmarks_in_radius", run_app_query, lambda: ("landmarks_in_radius", city(), 5)),
+        ("query:reviews_for_landmark", run_app_query, lambda: ("reviews_for_landmark", landmark())),
+        ("query:landmarks_of_type", run_app_query, lambda: ("landmarks_of_type", city(), None, "museum")),
+        ("query:landmarks_by_rating", run_app_query, lambda: ("landmarks_by_rating", str(rng.randint(1, 5)))),
+        ("query:landmarks_in_country", run_app_query, lambda: ("landmarks_in_country", "Country 1")),
+        ("query:nearby_landmarks", run_app_query, lambda: ("nearby_landmarks", landmark())),
+        ("query:landmarks_by_keyword", run_app_query, lambda: ("landmarks_by_keyword", "sunset")),
+    ]
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(fn, sampler, iterations, warmup):
+    for _ in range(warmup):
+        fn(*sampler())
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        args = sampler()
+        t0 = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "qps": iterations / elapsed,
+    }
+
+
+def run(scales, iterations, warmup, seed, only=None):
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    results = []
+    for scale in scales:
+        dataset = SyntheticDataset(scale, seed)
+        logging.info(f"Loading scale {scale}: {dataset.counts}")
+        load_dataset(dataset)
+        rng = random.Random(seed)
+        queries = {}
+        for name, fn, sampler in workloads(dataset, rng):
+            if only and name not in only:
+                continue
+            errors.count = 0
+            stats = measure(fn, sampler, iterations, warmup)
+            stats["errors"] = errors.count
+            queries[name] = stats
+            print(f"scale={scale:<6} {name:<32} p50={stats['p50_ms']:8.2f}ms "
+                  f"p95={stats['p95_ms']:8.2f}ms p99={stats['p99_ms']:8.2f}ms "
+                  f"{stats['qps']:9.1f} q/s errors={stats['errors']}")
+        results.append({"scale": scale, "rows": dataset.counts, "queries": queries})
+    logging.getLogger().removeHandler(errors)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.1, 1])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="*", help="run just these query names")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--force", action="store_true",
+                        help=f"allow replacing the data in {db.DB_CONFIG['dbname']!r}")
+    args = parser.parse_args()
+    if db.DB_CONFIG["dbname"] == "spatialproject" and not args.force:
+        parser.error("refusing to overwrite the default database; point SPATIAL_DB_NAME "
+                     "at a disposable database or pass --force")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # Measure the database, not the result cache
+    cache.CACHE_ENABLED = False
+
+    results = run(args.scales, args.iterations, args.warmup, args.seed, args.only)
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": {key: db.DB_CONFIG[key] for key in ("host", "port", "dbname")},
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare queries/sec with a new connection per call against the shared pool.
+
+Usage: python benchmark_pool.py --city Paris --queries 2000 --threads 8
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+QUERY = """
+    SELECT l.name
+    FROM landmarks l
+    JOIN cities c ON l.city_id = c.id
+    WHERE c.name = %s;
+"""
+
+
+def run_direct(city_name):
+    """The old pattern: connect, query, close."""
+    conn = db.connect_to_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(QUERY, (city_name,))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def run_pooled(city_name):
+    with db.get_cursor() as cursor:
+        cursor.execute(QUERY, (city_name,))
+        return cursor.fetchall()
+
+
+def measure(fn, city_name, queries, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: fn(city_name), range(queries)))
+    elapsed = time.perf_counter() - start
+    return queries / elapsed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--city", default="Paris", help="city name passed to the query")
+    parser.add_argument("--queries", type=int, default=1000, help="queries per mode")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent callers")
+    parser.add_argument("--pool-min", type=int, default=db.POOL_MIN_SIZE)
+    parser.add_argument("--pool-max", type=int, default=db.POOL_MAX_SIZE)
+    args = parser.parse_args()
+
+    # Keep per-connection log lines out of the timing loop.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    db.configure_pool(min_size=args.pool_min, max_size=args.pool_max)
+    # Warm the pool so connection setup is not billed to the pooled run.
+    run_pooled(args.city)
+
+    direct_qps, direct_elapsed = measure(run_direct, args.city, args.queries, args.threads)
+    pooled_qps, pooled_elapsed = measure(run_pooled, args.city, args.queries, args.threads)
+
+    print(f"{'mode':<8} {'queries':>8} {'seconds':>9} {'queries/sec':>12}")
+    print(f"{'direct':<8} {args.queries:>8} {direct_elapsed:>9.2f} {direct_qps:>12.1f}")
+    print(f"{'pooled':<8} {args.queries:>8} {pooled_elapsed:>9.2f} {pooled_qps:>12.1f}")
+    print(f"speedup: {pooled_qps / direct_qps:.1f}x")
+
+    stats = db.pool_stats()
+    print(f"pool: checkouts={stats['checkouts']} "
+          f"avg_wait={stats['wait_time_avg'] * 1000:.2f}ms "
+          f"max_wait={stats['wait_time_max'] * 1000:.2f}ms "
+          f"timeouts={stats['timeouts']}")
+
+
+if __name__ == "__main__":
+    main()
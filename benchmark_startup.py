@@ -0,0 +1,90 @@
+"""Cold import time of the entry points, checked against a budget.
+
+Each module is imported in a fresh interpreter several times; the median
+import time must stay within its budget and the module must not have loaded
+any of the LAZY_MODULES (drivers, UI and numeric libraries that are only
+imported on first use). Exits 1 when a check fails, so it can run in CI.
+
+Usage: python benchmark_startup.py --runs 7
+       python benchmark_startup.py --budget-ms 80 --module spatial --module batch
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# module -> milliseconds its import may take
+BUDGETS_MS = {
+    "spatial": 20,
+    "ads_project": 50,
+    "new_project": 50,
+    "batch": 50,
+    "schema": 50,
+}
+LAZY_MODULES = ("psycopg2", "colorama", "numpy", "flask")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed,
+                  "loaded": [name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(module, runs):
+    """(median seconds, lazily loaded modules that were imported anyway) for ``module``."""
+    times, loaded = [], set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", PROBE.format(module=module, lazy=LAZY_MODULES)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        times.append(result["seconds"])
+        loaded.update(result["loaded"])
+    return statistics.median(times), sorted(loaded)
+
+
+def slowest_imports(module, count=5):
+    """The ``count`` imports with the largest cumulative time, from python -X importtime."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the entry points.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", action="append", choices=sorted(BUDGETS_MS),
+                        help="module to check; repeat for several (default: all)")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="one budget for every module instead of BUDGETS_MS")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<12} {'median ms':>10} {'budget ms':>10}  result")
+    for module in args.module or BUDGETS_MS:
+        budget = args.budget_ms if args.budget_ms is not None else BUDGETS_MS[module]
+        seconds, loaded = measure(module, args.runs)
+        problems = []
+        if seconds * 1000 > budget:
+            problems.append("over budget")
+        if loaded:
+            problems.append(f"imported {', '.join(loaded)}")
+        print(f"{module:<12} {seconds * 1000:>10.1f} {budget:>10.0f}  {'; '.join(problems) or 'ok'}")
+        if problems:
+            failed = True
+            for microseconds, name in slowest_imports(module):
+                print(f"{'':<12} {microseconds / 1000:>10.1f} ms  {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
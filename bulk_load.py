@@ -0,0 +1,472 @@
+"""Bulk loader for cities, landmarks, visitors, reviews, routes and regions.
+
+Streams CSV, NDJSON or GeoJSON files into PostgreSQL with COPY (text or
+binary encoding) in configurable batches. Fields are matched to table
+columns by name, plus a few conveniences:
+
+* ``lon``/``lat`` (or ``longitude``/``latitude``) build the point geometry,
+  a GeoJSON feature's ``geometry`` or a ``wkt`` field fill the table's
+  geometry column (location, path or boundary);
+* ``city``, ``landmark`` and ``country`` names are resolved to ``city_id``,
+  ``landmark_id`` and ``country_id`` with one lookup per batch.
+
+Names are matched case-insensitively, as in names.py. Tables load in
+dependency order; tables within a stage load in parallel. Rows loaded with
+explicit ids (an ``id`` field, or an integer GeoJSON feature id) move the
+table's id sequence past them afterwards.
+
+Usage: python bulk_load.py cities=cities.csv landmarks=landmarks.geojson \\
+           visitors=visits.ndjson --batch-size 50000 --jobs 4 --encoding binary
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from db import configure_pool, driver, get_connection
+from names import name_key
+from partitions import PARTITIONED_TABLES, empty_default_partitions
+
+try:
+    import ijson
+except ImportError:  # GeoJSON files are then parsed in one piece
+    ijson = None
+
+BATCH_SIZE = 20000
+PROGRESS_INTERVAL = 5.0
+SRID = 4326
+
+# Load order: every table only references tables from earlier stages.
+# visitors and reviews get a stage each: the triggers of both update the
+# same landmark_stats rows and tile_stats cells, so loading them together
+# would only wait on, or deadlock over, those row locks.
+LOAD_STAGES = [
+    ["countries"],
+    ["cities"],
+    ["landmarks", "routes", "regions"],
+    ["visitors"],
+    ["reviews"],
+]
+
+GEOMETRY_COLUMNS = {
+    "cities": "location",
+    "landmarks": "location",
+    "routes": "path",
+    "regions": "boundary",
+}
+
+# input field -> (id column, table the name is looked up in)
+NAME_REFERENCES = {
+    "country": ("country_id", "countries"),
+    "country_name": ("country_id", "countries"),
+    "city": ("city_id", "cities"),
+    "city_name": ("city_id", "cities"),
+    "landmark": ("landmark_id", "landmarks"),
+    "landmark_name": ("landmark_id", "landmarks"),
+}
+
+LON_FIELDS = ("lon", "lng", "longitude")
+LAT_FIELDS = ("lat", "latitude")
+
+
+class LoadError(Exception):
+    """Raised when an input file cannot be mapped onto its table."""
+
+
+# Readers: each yields one dict per record
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield {key: (value if value != "" else None) for key, value in row.items()}
+
+
+def read_ndjson(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_geojson(path):
+    with open(path, "rb") as f:
+        if ijson is not None:
+            features = ijson.items(f, "features.item", use_float=True)
+        else:
+            features = json.load(f)["features"]
+        for feature in features:
+            record = dict(feature.get("properties") or {})
+            record["geometry"] = feature.get("geometry")
+            # Feature ids may be strings; only integers fit the serial id column
+            feature_id = feature.get("id")
+            if isinstance(feature_id, int) and not isinstance(feature_id, bool) and "id" not in record:
+                record["id"] = feature_id
+            yield record
+
+
+def read_records(path):
+    lower = path.lower()
+    if lower.endswith(".csv"):
+        return read_csv(path)
+    if lower.endswith((".ndjson", ".jsonl")):
+        return read_ndjson(path)
+    if lower.endswith((".geojson", ".json")):
+        return read_geojson(path)
+    raise LoadError(f"Unsupported file type: {path}")
+
+
+# Geometry encoding (EWKB, accepted by both COPY encodings)
+
+WKB_TYPES = {"Point": 1, "LineString": 2, "Polygon": 3,
+             "MultiPoint": 4, "MultiLineString": 5, "MultiPolygon": 6}
+EWKB_SRID_FLAG = 0x20000000
+
+
+def _wkb_body(geom_type, coords):
+    if geom_type == "Point":
+        return struct.pack("<dd", float(coords[0]), float(coords[1]))
+    if geom_type == "LineString":
+        return struct.pack("<I", len(coords)) + b"".join(
+            struct.pack("<dd", float(x), float(y)) for x, y, *_ in coords)
+    if geom_type == "Polygon":
+        return struct.pack("<I", len(coords)) + b"".join(
+            _wkb_body("LineString", ring) for ring in coords)
+    part_type = geom_type[len("Multi"):]
+    return struct.pack("<I", len(coords)) + b"".join(
+        struct.pack("<BI", 1, WKB_TYPES[part_type]) + _wkb_body(part_type, part)
+        for part in coords)
+
+
+def geojson_to_ewkb(geometry, srid=SRID):
+    geom_type = geometry["type"]
+    if geom_type not in WKB_TYPES:
+        raise LoadError(f"Unsupported geometry type: {geom_type}")
+    header = struct.pack("<BII", 1, WKB_TYPES[geom_type] | EWKB_SRID_FLAG, srid)
+    return header + _wkb_body(geom_type, geometry["coordinates"])
+
+
+def point_to_ewkb(lon, lat, srid=SRID):
+    return geojson_to_ewkb({"type": "Point", "coordinates": (lon, lat)}, srid)
+
+
+# COPY encoders
+
+def _text_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        return value.hex()
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def encode_text(rows, column_types):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_text_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+PG_EPOCH_DATE = date(2000, 1, 1)
+PG_EPOCH = datetime(2000, 1, 1)
+PG_MICROSECOND = datetime(2000, 1, 1, 0, 0, 0, 1) - PG_EPOCH
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    return datetime.fromisoformat(str(value)).replace(tzinfo=None)
+
+
+BINARY_ENCODERS = {
+    "int2": lambda v: struct.pack("!h", int(v)),
+    "int4": lambda v: struct.pack("!i", int(v)),
+    "int8": lambda v: struct.pack("!q", int(v)),
+    "float4": lambda v: struct.pack("!f", float(v)),
+    "float8": lambda v: struct.pack("!d", float(v)),
+    "bool": lambda v: b"\x01" if str(v).lower() in ("1", "t", "true", "yes") else b"\x00",
+    "text": lambda v: str(v).encode("utf-8"),
+    "varchar": lambda v: str(v).encode("utf-8"),
+    "bpchar": lambda v: str(v).encode("utf-8"),
+    "date": lambda v: struct.pack("!i", (_as_date(v) - PG_EPOCH_DATE).days),
+    "timestamp": lambda v: struct.pack("!q", (_as_datetime(v) - PG_EPOCH) // PG_MICROSECOND),
+    "timestamptz": lambda v: struct.pack("!q", (_as_datetime(v) - PG_EPOCH) // PG_MICROSECOND),
+    "geometry": bytes,
+    "geography": bytes,
+}
+
+
+def encode_binary(rows, column_types):
+    encoders = [BINARY_ENCODERS[udt] for udt in column_types]
+    buffer = io.BytesIO()
+    buffer.write(b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0))
+    field_count = struct.pack("!h", len(column_types))
+    for row in rows:
+        buffer.write(field_count)
+        for encode, value in zip(encoders, row):
+            if value is None:
+                buffer.write(struct.pack("!i", -1))
+            else:
+                data = encode(value)
+                buffer.write(struct.pack("!i", len(data)))
+                buffer.write(data)
+    buffer.write(struct.pack("!h", -1))
+    buffer.seek(0)
+    return buffer
+
+
+# Name resolution
+
+class NameResolver:
+    """Resolves names to ids with one query per table per batch, caching the names found.
+
+    Names match case-insensitively, like names.resolve_ids(). Names not found
+    are looked up again in later batches, as their rows may be loaded in the
+    meantime.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, cursor, table, names):
+        with self._lock:
+            known = self._ids.setdefault(table, {})
+            missing = [key for key in {name_key(name) for name in names} if key not in known]
+        if missing:
+            sql = driver().sql
+            cursor.execute(sql.SQL("""
+                SELECT lower(btrim(name)), MIN(id), COUNT(*)
+                FROM {}
+                WHERE lower(btrim(name)) = ANY(%s)
+                GROUP BY lower(btrim(name));
+            """).format(sql.Identifier(table)), (missing,))
+            found = {}
+            for key, id_, count in cursor.fetchall():
+                if count > 1:
+                    logging.warning(f"{table}: name {key!r} matches {count} rows, using id {id_}")
+                found[key] = id_
+            with self._lock:
+                known.update(found)
+        with self._lock:
+            return {name: known.get(name_key(name)) for name in names}
+
+
+# Table loader
+
+class TableLoader:
+    def __init__(self, table, path, resolver, batch_size=BATCH_SIZE, encoding="text"):
+        self.table = table
+        self.path = path
+        self.resolver = resolver
+        self.batch_size = batch_size
+        self.encoding = encoding
+        self.loaded = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+        self._derive_geometry = False
+
+    def _table_columns(self, cursor):
+        cursor.execute("""
+            SELECT column_name, udt_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+              AND is_generated = 'NEVER'
+            ORDER BY ordinal_position;
+        """, (self.table,))
+        columns = dict(cursor.fetchall())
+        if not columns:
+            raise LoadError(f"Table {self.table} does not exist")
+        return columns
+
+    def _plan_columns(self, record, table_columns):
+        """Target columns for this file, decided from its first record."""
+        columns = [key for key in record if key in table_columns]
+        for field, (id_column, _) in NAME_REFERENCES.items():
+            if field in record and id_column in table_columns and id_column not in columns:
+                columns.append(id_column)
+        geometry_column = GEOMETRY_COLUMNS.get(self.table)
+        has_geometry = ("geometry" in record or "wkt" in record
+                        or (any(f in record for f in LON_FIELDS) and any(f in record for f in LAT_FIELDS)))
+        if geometry_column and has_geometry and geometry_column not in columns:
+            columns.append(geometry_column)
+            self._derive_geometry = True
+        if not columns:
+            raise LoadError(f"{self.path}: no fields match columns of {self.table}")
+        return columns
+
+    def _geometry_value(self, record):
+        if record.get("geometry"):
+            return geojson_to_ewkb(record["geometry"])
+        if record.get("wkt"):
+            if self.encoding == "binary":
+                raise LoadError("wkt fields need --encoding text")
+            return f"SRID={SRID};{record['wkt']}"
+        lon = next((record[f] for f in LON_FIELDS if record.get(f) is not None), None)
+        lat = next((record[f] for f in LAT_FIELDS if record.get(f) is not None), None)
+        if lon is None or lat is None:
+            return None
+        return point_to_ewkb(float(lon), float(lat))
+
+    def _build_rows(self, cursor, records, columns):
+        lookups = {}
+        for field, (id_column, ref_table) in NAME_REFERENCES.items():
+            if id_column in columns:
+                names = [r[field] for r in records if r.get(field) is not None]
+                if names:
+                    lookups[field] = self.resolver.resolve(cursor, ref_table, names)
+        geometry_column = GEOMETRY_COLUMNS.get(self.table)
+        rows = []
+        for record in records:
+            values = dict(record)
+            for field, resolved in lookups.items():
+                name = record.get(field)
+                if name is None:
+                    continue
+                id_column = NAME_REFERENCES[field][0]
+                values[id_column] = resolved.get(name)
+                if values[id_column] is None:
+                    values = None
+                    break
+            if values is None:
+                self.skipped += 1
+                continue
+            if self._derive_geometry:
+                values[geometry_column] = self._geometry_value(record)
+            rows.append([values.get(column) for column in columns])
+        return rows
+
+    def _copy(self, cursor, columns, column_types, rows):
+        sql = driver().sql
+        statement = sql.SQL("COPY {} ({}) FROM STDIN{}").format(
+            sql.Identifier(self.table),
+            sql.SQL(", ").join(sql.Identifier(c) for c in columns),
+            sql.SQL(" WITH (FORMAT binary)") if self.encoding == "binary" else sql.SQL(""))
+        encode = encode_binary if self.encoding == "binary" else encode_text
+        cursor.copy_expert(statement.as_string(cursor), encode(rows, column_types))
+
+    def run(self):
+        start = last_report = time.monotonic()
+        records = read_records(self.path)
+        first = next(records, None)
+        if first is None:
+            logging.info(f"{self.table}: {self.path} is empty")
+            return self
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                table_columns = self._table_columns(cursor)
+        columns = self._plan_columns(first, table_columns)
+        column_types = [table_columns[c] for c in columns]
+        if self.encoding == "binary" and any(t not in BINARY_ENCODERS for t in column_types):
+            unsupported = sorted({t for t in column_types if t not in BINARY_ENCODERS})
+            logging.warning(f"{self.table}: no binary encoder for {unsupported}, using text COPY")
+            self.encoding = "text"
+
+        batch = [first]
+        try:
+            for record in records:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self._load_batch(batch, columns, column_types)
+                    batch = []
+                    if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                        last_report = time.monotonic()
+                        self._report(last_report - start)
+            if batch:
+                self._load_batch(batch, columns, column_types)
+        finally:
+            if "id" in columns and self.loaded:
+                self._advance_id_sequence()
+        self.elapsed = time.monotonic() - start
+        self._report(self.elapsed, final=True)
+        return self
+
+    def _load_batch(self, records, columns, column_types):
+        # One transaction per batch, so an interrupted load keeps whole batches.
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                rows = self._build_rows(cursor, records, columns)
+                if rows:
+                    self._copy(cursor, columns, column_types, rows)
+        self.loaded += len(rows)
+
+    def _advance_id_sequence(self):
+        """Move the id sequence past the ids loaded, so later INSERTs do not reuse them."""
+        sql = driver().sql
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL("""
+                    SELECT setval(seq, GREATEST(max_id, COALESCE(pg_sequence_last_value(seq), 1)))
+                    FROM (SELECT pg_get_serial_sequence(%s, 'id')::regclass AS seq,
+                                 (SELECT MAX(id) FROM {}) AS max_id) s
+                    WHERE seq IS NOT NULL AND max_id IS NOT NULL;
+                """).format(sql.Identifier(self.table)), (self.table,))
+
+    def _report(self, elapsed, final=False):
+        rate = self.loaded / elapsed if elapsed else 0.0
+        label = "done" if final else "progress"
+        logging.info(f"{self.table} {label}: {self.loaded} rows loaded, {self.skipped} skipped, "
+                     f"{rate:.0f} rows/sec")
+
+
+def load(files, batch_size=BATCH_SIZE, jobs=4, encoding="text"):
+    """Load ``{table: path}`` stage by stage; returns the finished TableLoaders."""
+    unknown = set(files) - {table for stage in LOAD_STAGES for table in stage}
+    if unknown:
+        raise LoadError(f"Unknown tables: {', '.join(sorted(unknown))}")
+    resolver = NameResolver()
+    finished = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for stage in LOAD_STAGES:
+            loaders = [TableLoader(table, files[table], resolver, batch_size, encoding)
+                       for table in stage if table in files]
+            finished.extend(f.result() for f in [executor.submit(l.run) for l in loaders])
+    return finished
+
+
+def parse_file_argument(value):
+    table, _, path = value.partition("=")
+    if not path:
+        raise argparse.ArgumentTypeError("files look like table=path")
+    return table, path
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Bulk load spatial tables with COPY.")
+    parser.add_argument("files", nargs="+", type=parse_file_argument, metavar="table=path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per COPY batch")
+    parser.add_argument("--jobs", type=int, default=4, help="tables loaded in parallel")
+    parser.add_argument("--encoding", choices=["text", "binary"], default="text")
+    args = parser.parse_args()
+
+    configure_pool(min_size=1, max_size=max(args.jobs, 1))
+    start = time.monotonic()
+    loaders = load(dict(args.files), args.batch_size, args.jobs, args.encoding)
+    if any(l.table in PARTITIONED_TABLES for l in loaders):
+        # Rows for months without a partition went to DEFAULT; give them one
+        empty_default_partitions()
+    elapsed = time.monotonic() - start
+
+    total = sum(l.loaded for l in loaders)
+    print(f"{'table':<10} {'loaded':>10} {'skipped':>8} {'seconds':>8} {'rows/sec':>10}")
+    for l in loaders:
+        rate = l.loaded / l.elapsed if l.elapsed else 0.0
+        print(f"{l.table:<10} {l.loaded:>10} {l.skipped:>8} {l.elapsed:>8.1f} {rate:>10.0f}")
+    print(f"{'total':<10} {total:>10} {'':>8} {elapsed:>8.1f} {total / elapsed if elapsed else 0:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
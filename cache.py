@@ -0,0 +1,261 @@
+"""Result cache for read-only queries: per-entry TTLs, LRU eviction and per-table invalidation.
+
+Wrap a query function with ``@cached(ttl=..., tables=(...))``. Call
+``invalidate_table(name)`` after writing to a table to drop every result that
+read from it. The backend is pluggable through ``configure_cache``.
+
+``coalesce(key, fn)`` runs concurrent calls with the same key once.
+``async_cached_call`` is ``cached_call`` for coroutines, for async_app.py.
+"""
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_ENABLED = os.environ.get("SPATIAL_CACHE_ENABLED", "1") != "0"
+CACHE_MAX_ENTRIES = int(os.environ.get("SPATIAL_CACHE_MAX_ENTRIES", "1024"))
+CACHE_DEFAULT_TTL = float(os.environ.get("SPATIAL_CACHE_TTL", "60"))
+
+MISS = object()
+
+
+class QueryCache:
+    """In-process LRU cache. Any object with the same methods can replace it."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, default_ttl=CACHE_DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value, tables)
+        self._keys_by_table = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key):
+        """Return the cached value for ``key``, or ``MISS``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return MISS
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None, tables=()):
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tuple(tables))
+            for table in tables:
+                self._keys_by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        _, _, tables = self._entries.pop(key)
+        for table in tables:
+            keys = self._keys_by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+
+    def invalidate_table(self, table):
+        """Drop every entry that was computed from ``table``."""
+        with self._lock:
+            keys = self._keys_by_table.pop(table, set())
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+            self._stats["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_table.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+class SingleFlight:
+    """Runs concurrent calls with the same key once; every caller gets that call's result or error."""
+
+    def __init__(self):
+        self._calls = {}  # key -> _Call in progress
+        self._lock = threading.Lock()
+        self._stats = {"executions": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        """(fn()'s result, whether it was shared from a call already in flight)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self._stats["executions"] += 1
+                leader = True
+            else:
+                self._stats["coalesced"] += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_cache = QueryCache()
+# [skipped] for the innermost cached_call() in progress in this thread or
+# task; a list so that skip_caching() in a task it spawned still reaches it
+_skip = contextvars.ContextVar("cache_skip", default=None)
+_flights = SingleFlight()
+# Invalidations per table, and clears, so cached_call() can tell that a
+# table changed while its result was being computed
+_invalidations = {}
+_clears = 0
+_invalidations_lock = threading.Lock()
+
+
+def get_cache():
+    return _cache
+
+
+def configure_cache(backend):
+    """Install a different cache backend (e.g. a QueryCache with other limits)."""
+    global _cache
+    _cache = backend
+    return _cache
+
+
+def invalidate_table(table):
+    with _invalidations_lock:
+        _invalidations[table] = _invalidations.get(table, 0) + 1
+    return _cache.invalidate_table(table)
+
+
+def clear_cache():
+    """Drop every entry, e.g. when changes may have been missed."""
+    global _clears
+    with _invalidations_lock:
+        _clears += 1
+    _cache.clear()
+
+
+def _invalidation_state(tables):
+    with _invalidations_lock:
+        return _clears, tuple(_invalidations.get(table, 0) for table in tables)
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+def coalesce(key, fn):
+    """(fn()'s result, whether it was shared), running fn once for concurrent callers with ``key``."""
+    return _flights.do(key, fn)
+
+
+def single_flight_stats():
+    return _flights.stats()
+
+
+def skip_caching():
+    """Called from a query function's error path so its fallback result is not cached."""
+    skipped = _skip.get()
+    if skipped is not None:
+        skipped[0] = True
+
+
+def cached_call(key, fn, ttl=None, tables=()):
+    """Return the cached result for ``key``, computing it with ``fn()`` on a miss."""
+    if not CACHE_ENABLED:
+        return fn()
+    value = _cache.get(key)
+    if value is not MISS:
+        return value
+    skipped = [False]
+    token = _skip.set(skipped)
+    try:
+        before = _invalidation_state(tables)
+        value = fn()
+    finally:
+        _skip.reset(token)
+    _store(key, value, ttl, tables, before, skipped[0])
+    return value
+
+
+async def async_cached_call(key, fn, ttl=None, tables=()):
+    """cached_call() for a coroutine function ``fn``."""
+    if not CACHE_ENABLED:
+        return await fn()
+    value = _cache.get(key)
+    if value is not MISS:
+        return value
+    skipped = [False]
+    token = _skip.set(skipped)
+    try:
+        before = _invalidation_state(tables)
+        value = await fn()
+    finally:
+        _skip.reset(token)
+    _store(key, value, ttl, tables, before, skipped[0])
+    return value
+
+
+def _store(key, value, ttl, tables, before, skipped):
+    # A result computed across an invalidation of its tables may predate it
+    if not skipped and _invalidation_state(tables) == before:
+        _cache.set(key, value, ttl=ttl, tables=tables)
+
+
+def cached(ttl=None, tables=()):
+    """Cache a query function's result keyed on its name and arguments."""
+    def decorator(fn):
+        name = f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            return cached_call(key, lambda: fn(*args, **kwargs), ttl=ttl, tables=tables)
+
+        wrapper.uncached = fn
+        return wrapper
+    return decorator
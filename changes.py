@@ -0,0 +1,403 @@
+"""Change feed from table triggers to in-process caches, via LISTEN/NOTIFY.
+
+Statement-level triggers on the base tables publish one compact event per
+statement on the ``spatial_changes`` channel once its transaction commits:
+
+    {"table": "landmarks", "op": "update", "ids": [12, 40]}
+
+``ids`` is null for TRUNCATE and for statements touching more than MAX_IDS
+rows. The first change to a table in a transaction also bumps the table's
+row in table_versions, from which app.py derives ETag and Last-Modified
+(table_versions()). A ChangeListener thread holds a dedicated connection
+LISTENing on the channel and hands each batch of events to the registered
+consumers:
+
+- the query cache drops results read from the changed table and the summary
+  tables derived from it;
+- the name directory reloads just the changed landmarks and cities;
+- the in-memory spatial index is rebuilt once per batch of landmark or city
+  changes.
+
+Notifications sent while the listener is disconnected are lost, so every
+(re)connect, and any batch larger than MAX_BACKLOG events, triggers a full
+resync instead: every consumer drops or reloads all of its state.
+
+Usage: python changes.py install   # create the triggers
+       python changes.py listen    # print events as they arrive
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import select
+import threading
+import time
+
+CHANNEL = "spatial_changes"
+CHANGE_FEED_ENABLED = os.environ.get("SPATIAL_CHANGE_FEED", "1") != "0"
+# Events in one batch beyond which a full resync is cheaper than applying them
+MAX_BACKLOG = int(os.environ.get("SPATIAL_CHANGE_MAX_BACKLOG", "1000"))
+# Seconds between keepalive queries on an idle listener connection
+POLL_SECONDS = float(os.environ.get("SPATIAL_CHANGE_POLL_SECONDS", "30"))
+MAX_RECONNECT_DELAY = 30.0
+# Row ids listed per event; larger statements are reported without ids
+MAX_IDS = 100
+
+TABLES = ("countries", "cities", "landmarks", "visitors", "reviews", "routes", "regions")
+# Summary tables kept by triggers from each base table, whose cached
+# results go stale with it
+DERIVED_TABLES = {
+    "landmarks": ("landmark_stats", "tile_stats"),
+    "visitors": ("landmark_stats", "tile_stats"),
+    "reviews": ("landmark_stats", "tile_stats"),
+    "regions": ("region_overlaps",),
+}
+
+SCHEMA_SQL = """
+-- One row per base table, bumped by the transactions that change it, so all
+-- app processes derive the same HTTP validators from it. A writer locks its
+-- table's row from its first write to the table until it commits.
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name text PRIMARY KEY,
+    version bigint NOT NULL,
+    changed_at timestamptz NOT NULL
+);
+INSERT INTO table_versions
+SELECT name, 1, now() FROM unnest(ARRAY[{tables}]) AS name
+ON CONFLICT (table_name) DO NOTHING;
+
+-- Publish a change event, and bump the table's version once per transaction:
+-- later statements in the same transaction would only rewrite the row it
+-- already holds locked. The marker is a transaction-local setting.
+CREATE OR REPLACE FUNCTION table_changed(changed_table text, op text, ids integer[]) RETURNS void AS $$
+BEGIN
+    IF current_setting('table_versions.' || changed_table, true) IS DISTINCT FROM txid_current()::text THEN
+        INSERT INTO table_versions VALUES (changed_table, 1, now())
+        ON CONFLICT (table_name) DO UPDATE
+        SET version = table_versions.version + 1, changed_at = now();
+        PERFORM set_config('table_versions.' || changed_table, txid_current()::text, true);
+    END IF;
+    PERFORM pg_notify('{channel}', json_build_object(
+        'table', changed_table, 'op', op, 'ids', ids)::text);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_change() RETURNS trigger AS $$
+DECLARE
+    ids integer[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        ids := ARRAY(SELECT id FROM old_rows LIMIT {max_ids} + 1);
+    ELSIF TG_OP <> 'TRUNCATE' THEN
+        ids := ARRAY(SELECT id FROM new_rows LIMIT {max_ids} + 1);
+    END IF;
+    -- Statements that matched no rows change nothing
+    IF cardinality(ids) = 0 THEN
+        RETURN NULL;
+    END IF;
+    PERFORM table_changed(TG_TABLE_NAME, lower(TG_OP),
+                          CASE WHEN cardinality(ids) <= {max_ids} THEN ids END);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""".format(channel=CHANNEL, max_ids=MAX_IDS, tables=", ".join(f"'{t}'" for t in TABLES)) + "".join("""
+DROP TRIGGER IF EXISTS {table}_changes_insert ON {table};
+DROP TRIGGER IF EXISTS {table}_changes_update ON {table};
+DROP TRIGGER IF EXISTS {table}_changes_delete ON {table};
+DROP TRIGGER IF EXISTS {table}_changes_truncate ON {table};
+CREATE TRIGGER {table}_changes_insert AFTER INSERT ON {table}
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER {table}_changes_update AFTER UPDATE ON {table}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER {table}_changes_delete AFTER DELETE ON {table}
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER {table}_changes_truncate AFTER TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+""".format(table=table) for table in TABLES)
+
+# Announces a change to a whole table, for writes that fire no trigger
+# (e.g. dropping a partition). Sent when the caller's transaction commits.
+TABLE_CHANGED_SQL = "SELECT table_changed(%s, 'delete', NULL);"
+
+# Versions of the given tables that have change triggers installed
+VERSIONS_SQL = """
+    SELECT v.table_name, v.version, extract(epoch FROM v.changed_at)::float8
+    FROM table_versions v
+    WHERE v.table_name = ANY(%s)
+      AND EXISTS (SELECT 1 FROM pg_trigger t
+                  WHERE t.tgrelid = to_regclass(v.table_name)
+                    AND t.tgname = v.table_name || '_changes_update');
+"""
+
+
+def versions_from_rows(tables, rows):
+    """(version token, last-modified Unix time) from VERSIONS_SQL rows for ``tables``.
+
+    None unless every table has a version and its triggers, as without them
+    the versions do not follow the data. The time is rounded up to the
+    second, as HTTP dates are.
+    """
+    found = {name: (version, changed_at) for name, version, changed_at in rows}
+    if not tables or set(found) != set(tables):
+        return None
+    token = tuple((name, found[name][0]) for name in sorted(found))
+    return token, math.ceil(max(changed_at for _, changed_at in found.values()))
+
+
+def table_versions(cursor, tables):
+    """versions_from_rows() for ``tables``, read on ``cursor``; None if the versions table is missing."""
+    if not tables:
+        return None
+    try:
+        cursor.execute("SAVEPOINT table_versions;")
+        cursor.execute(VERSIONS_SQL, (list(tables),))
+        rows = cursor.fetchall()
+        cursor.execute("RELEASE SAVEPOINT table_versions;")
+    except Exception as e:
+        logging.debug(f"No table versions: {e}")
+        cursor.execute("ROLLBACK TO SAVEPOINT table_versions;")
+        return None
+    return versions_from_rows(tables, rows)
+
+
+class Consumer:
+    """In-process state kept current from the feed.
+
+    ``on_changes(events)`` gets each batch of events for ``tables`` (None for
+    every table); ``on_resync()`` is called when events may have been missed.
+    """
+
+    def __init__(self, name, on_changes, on_resync, tables=None):
+        self.name = name
+        self.on_changes = on_changes
+        self.on_resync = on_resync
+        self.tables = frozenset(tables) if tables is not None else None
+
+
+_consumers = []
+_consumers_lock = threading.Lock()
+
+
+def register(name, on_changes, on_resync, tables=None):
+    """Add a consumer; returns it."""
+    consumer = Consumer(name, on_changes, on_resync, tables)
+    with _consumers_lock:
+        _consumers.append(consumer)
+    return consumer
+
+
+def dispatch(events):
+    """Hand a batch of events to every consumer interested in their tables."""
+    with _consumers_lock:
+        consumers = list(_consumers)
+    for consumer in consumers:
+        relevant = [e for e in events if consumer.tables is None or e["table"] in consumer.tables]
+        if not relevant:
+            continue
+        try:
+            consumer.on_changes(relevant)
+        except Exception as e:
+            # Whatever the consumer kept may now be wrong; start it afresh
+            logging.error(f"Error applying changes to {consumer.name}: {e}")
+            _resync_consumer(consumer)
+
+
+def resync(reason):
+    """Make every consumer drop or reload all of its state."""
+    logging.info(f"Change feed resync ({reason}).")
+    with _consumers_lock:
+        consumers = list(_consumers)
+    for consumer in consumers:
+        _resync_consumer(consumer)
+
+
+def _resync_consumer(consumer):
+    try:
+        consumer.on_resync()
+    except Exception as e:
+        logging.error(f"Error resyncing {consumer.name}: {e}")
+
+
+class ChangeListener(threading.Thread):
+    """Background thread that LISTENs on CHANNEL and dispatches what arrives."""
+
+    def __init__(self, channel=CHANNEL, max_backlog=MAX_BACKLOG, poll_seconds=POLL_SECONDS):
+        super().__init__(name="change-listener", daemon=True)
+        self.channel = channel
+        self.max_backlog = max_backlog
+        self.poll_seconds = poll_seconds
+        self.stats = {"events": 0, "batches": 0, "resyncs": 0, "reconnects": 0,
+                      "connected": False, "last_event_at": None}
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        from db import DB_CONFIG, driver
+
+        failures = 0
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = driver().connect(**DB_CONFIG)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel};")
+                self.stats["connected"] = True
+                # Anything sent before LISTEN took effect was missed
+                self._resync("reconnected" if self.stats["reconnects"] else "connected")
+                failures = 0
+                self._listen(conn)
+            except Exception as e:
+                failures += 1
+                self.stats["reconnects"] += 1
+                delay = min(MAX_RECONNECT_DELAY, 2 ** min(failures, 5))
+                logging.warning(f"Change listener disconnected ({e}); retrying in {delay:.0f}s.")
+                self._stop_event.wait(delay)
+            finally:
+                self.stats["connected"] = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _listen(self, conn):
+        while not self._stop_event.is_set():
+            if not select.select([conn], [], [], self.poll_seconds)[0]:
+                # Idle: a query finds a dead connection that select() would not
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1;")
+                continue
+            conn.poll()
+            notifies = list(conn.notifies)
+            conn.notifies.clear()
+            if not notifies:
+                continue
+            if len(notifies) > self.max_backlog:
+                self._resync(f"{len(notifies)} events behind")
+                continue
+            events = []
+            for notify in notifies:
+                try:
+                    events.append(json.loads(notify.payload))
+                except ValueError:
+                    logging.warning(f"Ignoring malformed change event: {notify.payload!r}")
+            self.stats["events"] += len(events)
+            self.stats["batches"] += 1
+            self.stats["last_event_at"] = time.time()
+            dispatch(events)
+
+    def _resync(self, reason):
+        self.stats["resyncs"] += 1
+        resync(reason)
+
+
+def _cache_changes(events):
+    from cache import invalidate_table
+
+    for table in {e["table"] for e in events}:
+        invalidate_table(table)
+        for derived in DERIVED_TABLES.get(table, ()):
+            invalidate_table(derived)
+
+
+def _cache_resync():
+    from cache import clear_cache
+
+    clear_cache()
+
+
+def _names_changes(events):
+    import names
+
+    for table in ("landmarks", "cities"):
+        table_events = [e for e in events if e["table"] == table]
+        if not table_events:
+            continue
+        if any(e["ids"] is None for e in table_events):
+            names.apply_changes(table, None)
+        else:
+            names.apply_changes(table, {i for e in table_events for i in e["ids"]})
+
+
+def _names_resync():
+    import names
+
+    for table in ("landmarks", "cities"):
+        names.apply_changes(table, None)
+
+
+def _index_changes(events):
+    from spatial_index import invalidate_index
+
+    invalidate_index()
+
+
+def register_default_consumers():
+    """Wire the query cache, name directory and spatial index to the feed."""
+    register("query cache", _cache_changes, _cache_resync)
+    register("name directory", _names_changes, _names_resync, tables=("landmarks", "cities"))
+    register("spatial index", _index_changes, lambda: _index_changes(()), tables=("landmarks", "cities"))
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def start_listener():
+    """Start the shared listener with the default consumers, once; None if the feed is disabled."""
+    global _listener
+    if not CHANGE_FEED_ENABLED:
+        return None
+    with _listener_lock:
+        if _listener is None:
+            register_default_consumers()
+            _listener = ChangeListener()
+            _listener.start()
+    return _listener
+
+
+def feed_stats():
+    listener = _listener
+    if listener is None:
+        return {"enabled": CHANGE_FEED_ENABLED, "running": False}
+    return {"enabled": CHANGE_FEED_ENABLED, "running": listener.is_alive(), **listener.stats}
+
+
+def install_changes():
+    """Create the notify triggers on every base table."""
+    from db import get_connection
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA_SQL)
+    logging.info("Change feed triggers installed.")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Install or watch the table change feed.")
+    parser.add_argument("command", choices=["install", "listen"])
+    args = parser.parse_args()
+    if args.command == "install":
+        install_changes()
+        return
+    register("printer", lambda events: [print(json.dumps(e)) for e in events],
+             lambda: print(json.dumps({"resync": True})))
+    listener = ChangeListener()
+    listener.start()
+    try:
+        while listener.is_alive():
+            listener.join(1)
+    except KeyboardInterrupt:
+        listener.stop()
+
+
+if __name__ == "__main__":
+    main()
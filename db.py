@@ -0,0 +1,487 @@
+import atexit
+import functools
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Connection settings shared by ads_project.py, new_project.py and app.py.
+# Every value can be overridden from the environment.
+DB_CONFIG = {
+    "dbname": os.environ.get("SPATIAL_DB_NAME", "spatialproject"),
+    "user": os.environ.get("SPATIAL_DB_USER", "mahi"),
+    "password": os.environ.get("SPATIAL_DB_PASSWORD", "mahi"),
+    "host": os.environ.get("SPATIAL_DB_HOST", "localhost"),
+    "port": os.environ.get("SPATIAL_DB_PORT", "5432"),
+}
+
+POOL_MIN_SIZE = int(os.environ.get("SPATIAL_DB_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.environ.get("SPATIAL_DB_POOL_MAX", "10"))
+# Seconds a caller waits for a free connection before giving up.
+POOL_TIMEOUT = float(os.environ.get("SPATIAL_DB_POOL_TIMEOUT", "30"))
+# Connections idle for longer than this are pinged before being handed out.
+HEALTH_CHECK_INTERVAL = float(os.environ.get("SPATIAL_DB_HEALTH_CHECK_INTERVAL", "30"))
+# Rows fetched per round trip by server-side (streaming) cursors.
+STREAM_CHUNK_SIZE = int(os.environ.get("SPATIAL_DB_STREAM_CHUNK_SIZE", "2000"))
+
+# Read replicas as comma-separated host[:port] entries. They share the
+# database name and credentials of DB_CONFIG; writes always use the primary.
+REPLICA_HOSTS = [host.strip() for host in os.environ.get("SPATIAL_DB_REPLICAS", "").split(",")
+                 if host.strip()]
+# Seconds of replay lag beyond which a replica is skipped; 0 accepts any lag.
+MAX_REPLICA_LAG = float(os.environ.get("SPATIAL_DB_MAX_REPLICA_LAG", "0"))
+# A replica's lag is measured at most once per this many seconds.
+LAG_CHECK_INTERVAL = float(os.environ.get("SPATIAL_DB_LAG_CHECK_INTERVAL", "5"))
+# Consecutive failures that open a replica's circuit breaker, and the seconds
+# it stays open before one trial request is let through.
+BREAKER_FAILURES = int(os.environ.get("SPATIAL_DB_BREAKER_FAILURES", "3"))
+BREAKER_RESET = float(os.environ.get("SPATIAL_DB_BREAKER_RESET", "30"))
+
+# Zero when the replica has replayed everything it received (an idle primary
+# writes no WAL, so replay timestamps alone would look ever more stale).
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END;
+"""
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the timeout."""
+
+
+@functools.lru_cache(maxsize=None)
+def driver():
+    """psycopg2, imported on first connection so that importing db stays cheap."""
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.pool
+    import psycopg2.sql
+    return psycopg2
+
+
+@functools.lru_cache(maxsize=None)
+def pooled_connection_class():
+    """The connection class handed to psycopg2, created once the driver is loaded."""
+
+    class PooledConnection(driver().extensions.connection):
+        """psycopg2 connection that remembers which named statements it has PREPAREd."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared_statements = set()
+            # Seconds the current checkout waited for this connection
+            self.acquire_wait = None
+
+    return PooledConnection
+
+
+class ConnectionPool:
+    """Thread-safe, blocking pool of psycopg2 connections with wait-time metrics."""
+
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 timeout=POOL_TIMEOUT, health_check_interval=HEALTH_CHECK_INTERVAL,
+                 **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = connect_kwargs or dict(DB_CONFIG)
+        # psycopg2's pool raises instead of blocking when exhausted, so the
+        # semaphore is what makes callers queue for a free connection.
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._pool = driver().pool.ThreadedConnectionPool(
+            min_size, max_size, **{"connection_factory": pooled_connection_class(), **self.connect_kwargs})
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "discarded": 0,
+            "errors_returned": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+        self._in_use = 0
+        logging.info(f"Connection pool created (min={min_size}, max={max_size}).")
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logging.warning(f"Pooled connection failed health check: {e}")
+            return False
+
+    def getconn(self):
+        """Check out a healthy connection, blocking up to ``timeout`` seconds."""
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        try:
+            while True:
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    break
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+        waited = time.monotonic() - start
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+            self._in_use += 1
+        if isinstance(conn, pooled_connection_class()):
+            conn.acquire_wait = waited
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, closing it if it is broken or ``discard`` is set."""
+        try:
+            if discard or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        with self._lock:
+            self._stats["discarded"] += 1
+        try:
+            self._pool.putconn(conn, close=True)
+        except Exception as e:
+            logging.warning(f"Error discarding pooled connection: {e}")
+
+    @contextmanager
+    def connection(self):
+        """Yield a pooled connection; commit on success, roll back and return it on error."""
+        with self.lease(self.getconn()) as conn:
+            yield conn
+
+    @contextmanager
+    def lease(self, conn):
+        """Yield ``conn``, already checked out with getconn(), and return it as connection() does."""
+        try:
+            yield conn
+            if not conn.closed:
+                conn.commit()
+        except BaseException:
+            # BaseException so that a streaming generator closed early
+            # (GeneratorExit) still hands its connection back.
+            with self._lock:
+                self._stats["errors_returned"] += 1
+            broken = conn.closed
+            if not broken:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            self.putconn(conn, discard=broken)
+            raise
+        else:
+            self.putconn(conn)
+
+    def stats(self):
+        """Return a snapshot of pool usage and wait-time metrics."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_use"] = self._in_use
+        stats["min_size"] = self.min_size
+        stats["max_size"] = self.max_size
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg"] = stats["wait_time_total"] / checkouts if checkouts else 0.0
+        return stats
+
+    def close(self):
+        self._pool.closeall()
+        self._last_used.clear()
+        logging.info("Connection pool closed.")
+
+
+class Replica:
+    """A read replica: its pool, requests in flight, circuit breaker and last measured lag."""
+
+    def __init__(self, host, **connect_kwargs):
+        hostname, _, port = host.partition(":")
+        self.name = host
+        self.connect_kwargs = {**DB_CONFIG, **connect_kwargs, "host": hostname,
+                               "port": port or DB_CONFIG["port"]}
+        self.outstanding = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.lag = None
+        self.lag_checked_at = None
+        self.reads = 0
+        self.errors = 0
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # Created on first use, so an unreachable replica does not stop startup
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(**self.connect_kwargs)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+
+class ReplicaRouter:
+    """Sends read-only work to the replica with the fewest requests in flight.
+
+    A replica whose checkout fails, or whose statement loses its connection,
+    counts a failure; BREAKER_FAILURES in a row open its breaker for
+    BREAKER_RESET seconds. Replicas lagging more than ``max_lag`` seconds are
+    skipped, and when no replica is usable the read runs on the primary.
+    """
+
+    def __init__(self, hosts, max_lag=MAX_REPLICA_LAG, lag_check_interval=LAG_CHECK_INTERVAL,
+                 breaker_failures=BREAKER_FAILURES, breaker_reset=BREAKER_RESET, **connect_kwargs):
+        self.replicas = [Replica(host, **connect_kwargs) for host in hosts]
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.primary_fallbacks = 0
+        self._lock = threading.Lock()
+        logging.info(f"Read replicas configured: {', '.join(hosts)}.")
+
+    def _choose(self, tried):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [r for r in self.replicas if r not in tried and r.open_until <= now
+                          and not (self.max_lag and r.lag is not None and r.lag > self.max_lag
+                                   and now - r.lag_checked_at < self.lag_check_interval)]
+            if not candidates:
+                return None
+            replica = min(candidates, key=lambda r: (r.outstanding, random.random()))
+            replica.outstanding += 1
+            return replica
+
+    def _finish(self, replica, failed):
+        with self._lock:
+            replica.outstanding -= 1
+            if not failed:
+                replica.failures = 0
+                replica.reads += 1
+                return
+            replica.errors += 1
+            replica.failures += 1
+            if replica.failures >= self.breaker_failures:
+                replica.open_until = time.monotonic() + self.breaker_reset
+                logging.warning(f"Replica {replica.name} failed {replica.failures} times in a row; "
+                                f"not used for {self.breaker_reset}s.")
+
+    def _fresh_enough(self, replica, conn):
+        """Whether ``conn``'s replica is within max_lag, measuring it if the last check is old."""
+        if not self.max_lag:
+            return True
+        now = time.monotonic()
+        if replica.lag_checked_at is None or now - replica.lag_checked_at >= self.lag_check_interval:
+            with conn.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+            conn.rollback()
+            with self._lock:
+                replica.lag, replica.lag_checked_at = lag, now
+        return replica.lag <= self.max_lag
+
+    @contextmanager
+    def connection(self):
+        """Yield a connection to a healthy, fresh enough replica, else to the primary."""
+        tried = set()
+        while True:
+            replica = self._choose(tried)
+            if replica is None:
+                break
+            tried.add(replica)
+            try:
+                conn = replica.pool.getconn()
+            except Exception as e:
+                logging.warning(f"Replica {replica.name} unavailable: {e}")
+                self._finish(replica, failed=True)
+                continue
+            try:
+                fresh = self._fresh_enough(replica, conn)
+            except Exception as e:
+                logging.warning(f"Could not measure lag on replica {replica.name}: {e}")
+                replica.pool.putconn(conn, discard=True)
+                self._finish(replica, failed=True)
+                continue
+            if not fresh:
+                replica.pool.putconn(conn)
+                self._finish(replica, failed=False)
+                continue
+            failed = False
+            try:
+                with replica.pool.lease(conn):
+                    yield conn
+            except Exception as e:
+                failed = isinstance(e, (driver().OperationalError, driver().InterfaceError))
+                raise
+            finally:
+                self._finish(replica, failed)
+            return
+        with self._lock:
+            self.primary_fallbacks += 1
+        with get_pool().connection() as conn:
+            yield conn
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "primary_fallbacks": self.primary_fallbacks,
+                "replicas": [{
+                    "name": r.name,
+                    "outstanding": r.outstanding,
+                    "reads": r.reads,
+                    "errors": r.errors,
+                    "breaker_open": r.open_until > now,
+                    "lag": r.lag,
+                } for r in self.replicas],
+            }
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_router = None
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def configure_pool(**kwargs):
+    """Replace the process-wide pool, e.g. to change its size or target database."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(**kwargs)
+    return _pool
+
+
+def get_router():
+    """Return the process-wide replica router, or None when no replicas are configured."""
+    global _router
+    if _router is None and REPLICA_HOSTS:
+        with _pool_lock:
+            if _router is None:
+                _router = ReplicaRouter(REPLICA_HOSTS)
+    return _router
+
+
+def configure_replicas(hosts, **kwargs):
+    """Replace the read replicas, e.g. with several local instances; [] sends reads to the primary."""
+    global _router
+    with _pool_lock:
+        if _router is not None:
+            _router.close()
+        _router = ReplicaRouter(hosts, **kwargs) if hosts else None
+    return _router
+
+
+def close_pool():
+    global _pool, _router
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        if _router is not None:
+            _router.close()
+            _router = None
+
+
+atexit.register(close_pool)
+
+
+@contextmanager
+def get_connection(readonly=False):
+    """Borrow a connection from the shared pool, or from a replica when ``readonly``."""
+    router = get_router() if readonly else None
+    manager = router.connection() if router is not None else get_pool().connection()
+    with manager as conn:
+        yield conn
+
+
+@contextmanager
+def get_cursor(readonly=False):
+    """Borrow a pooled connection and yield a cursor on it."""
+    with get_connection(readonly) as conn:
+        with conn.cursor() as cursor:
+            yield cursor
+
+
+def stream_rows(query, params=None, chunk_size=STREAM_CHUNK_SIZE, readonly=False):
+    """Yield rows from a server-side cursor, holding at most one chunk in memory.
+
+    The pooled connection stays checked out until the generator is exhausted
+    or closed.
+    """
+    with get_connection(readonly) as conn:
+        with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            yield from cursor
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def replica_stats():
+    """Per-replica load, errors, breaker state and lag; None without replicas."""
+    router = get_router()
+    return router.stats() if router is not None else None
+
+
+def connect_to_db():
+    """Open a dedicated, unpooled connection (used for benchmarking the pool)."""
+    try:
+        connection = driver().connect(**DB_CONFIG)
+        logging.info("Database connection successful.")
+        return connection
+    except Exception as e:
+        logging.error(f"Error connecting to database: {e}")
+        raise
@@ -0,0 +1,163 @@
+"""Many-to-many geodesic distances between landmarks and points.
+
+distance_matrix() takes origins and destinations as landmark names (str),
+landmark ids (int) or (lat, lon) tuples and returns an N x M list of lists in
+metres on the WGS84 spheroid, the same values as ST_Distance on geography.
+With NumPy installed the matrix is computed in one vectorized pass over the
+coordinates; otherwise a single set-based statement computes it in PostGIS.
+Unknown landmarks give None entries; ambiguous names raise ValueError.
+"""
+import heapq
+import math
+import os
+
+from db import get_cursor
+from names import resolve_id
+from spatial_index import (WGS84_A, WGS84_B, WGS84_F, geodesic_distance, get_index,
+                           memory_backend_enabled)
+from statements import execute
+
+# NumPy once _numpy() has imported it; it is loaded on the first matrix
+# rather than at import, as it dominates this module's import time.
+np = None
+_numpy_checked = False
+
+VINCENTY_ITERATIONS = 50
+# Largest origins x destinations product one call may ask for
+MAX_MATRIX_CELLS = int(os.environ.get("SPATIAL_MAX_MATRIX_CELLS", "4000000"))
+
+
+def _numpy():
+    """NumPy, or None when it is not installed (matrices are then computed by PostGIS)."""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+        _numpy_checked = True
+    return np
+
+
+def _normalise(items):
+    """(landmark_id, lat, lon) per item; ids None for raw points."""
+    result = []
+    for item in items:
+        if isinstance(item, str):
+            result.append((resolve_id("landmarks", item), None, None))
+        elif isinstance(item, int):
+            result.append((item, None, None))
+        else:
+            lat, lon = item
+            result.append((None, float(lat), float(lon)))
+    return result
+
+
+def _coordinates(points):
+    """Fill in lat/lon for landmark ids, from the spatial index when it is in use."""
+    ids = {landmark_id for landmark_id, _, _ in points if landmark_id is not None}
+    coords = {}
+    if memory_backend_enabled():
+        index = get_index()
+        for landmark_id in ids:
+            row = index.landmarks.get(landmark_id)
+            if row is not None:
+                coords[landmark_id] = (row[4], row[3])
+    missing = [landmark_id for landmark_id in ids if landmark_id not in coords]
+    if missing:
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "landmark_coordinates", (missing,))
+            coords.update((landmark_id, (lat, lon)) for landmark_id, lon, lat in cursor.fetchall())
+    return [coords.get(landmark_id, (None, None)) if landmark_id is not None else (lat, lon)
+            for landmark_id, lat, lon in points]
+
+
+def _vincenty_matrix(lat1, lon1, lat2, lon2):
+    """Vincenty inverse distances between column vectors (n, 1) and row vectors (1, m)."""
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+    lmb = L
+    converged = None
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(VINCENTY_ITERATIONS):
+            sin_lmb, cos_lmb = np.sin(lmb), np.cos(lmb)
+            sin_sigma = np.hypot(cosU2 * sin_lmb, cosU1 * sinU2 - sinU1 * cosU2 * cos_lmb)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lmb
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lmb / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            prev = lmb
+            lmb = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = ~(np.abs(lmb - prev) >= 1e-12)
+            if converged.all():
+                break
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        distances = np.where(sin_sigma == 0, 0.0, WGS84_B * A * (sigma - delta_sigma))
+    # Nearly antipodal pairs do not converge; the scalar version handles them
+    for i, j in zip(*np.nonzero(~converged & ~np.isnan(distances))):
+        distances[i, j] = geodesic_distance(lon1[i, 0], lat1[i, 0], lon2[0, j], lat2[0, j])
+    return distances
+
+
+def _matrix_numpy(origins, destinations):
+    rows = np.array([(math.nan if lat is None else lat, math.nan if lon is None else lon)
+                     for lat, lon in _coordinates(origins)], dtype=float).reshape(-1, 2)
+    cols = np.array([(math.nan if lat is None else lat, math.nan if lon is None else lon)
+                     for lat, lon in _coordinates(destinations)], dtype=float).reshape(-1, 2)
+    distances = _vincenty_matrix(rows[:, :1], rows[:, 1:], cols[:, 0][None, :], cols[:, 1][None, :])
+    return [[None if math.isnan(value) else value for value in row] for row in distances.tolist()]
+
+
+def _matrix_sql(origins, destinations):
+    params = []
+    for points in (origins, destinations):
+        params.extend([[landmark_id for landmark_id, _, _ in points],
+                       [lon for _, _, lon in points],
+                       [lat for _, lat, _ in points]])
+    matrix = [[None] * len(destinations) for _ in origins]
+    with get_cursor(readonly=True) as cursor:
+        execute(cursor, "distance_matrix", params)
+        for i, j, distance in cursor.fetchall():
+            matrix[i - 1][j - 1] = distance
+    return matrix
+
+
+def distance_matrix(origins, destinations=None, method=None):
+    """Metres between every origin (rows) and destination (columns).
+
+    ``destinations`` defaults to ``origins``. ``method`` is "numpy" or "sql";
+    by default NumPy is used when it is installed.
+    """
+    origins = _normalise(origins)
+    destinations = origins if destinations is None else _normalise(destinations)
+    if len(origins) * len(destinations) > MAX_MATRIX_CELLS:
+        raise ValueError(f"Distance matrix larger than {MAX_MATRIX_CELLS} cells")
+    if method is None:
+        method = "numpy" if _numpy() is not None else "sql"
+    if method == "numpy":
+        if _numpy() is None:
+            raise ValueError("method='numpy' needs NumPy installed")
+        return _matrix_numpy(origins, destinations)
+    if method == "sql":
+        return _matrix_sql(origins, destinations)
+    raise ValueError(f"Unknown distance matrix method: {method}")
+
+
+def nearest_per_row(matrix, j, skip_diagonal=False):
+    """The ``j`` closest columns of each row as [(column, metres), ...], nearest first."""
+    return [heapq.nsmallest(j, ((col, distance) for col, distance in enumerate(row)
+                                if distance is not None and not (skip_diagonal and col == i)),
+                            key=lambda item: item[1])
+            for i, row in enumerate(matrix)]
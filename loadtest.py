@@ -0,0 +1,94 @@
+"""Compare requests/sec and latency of the Flask and async servers on /query.
+
+Start both servers first, with SPATIAL_CACHE_ENABLED=0 so every request
+reaches PostgreSQL, e.g.
+    gunicorn -w 4 -b 127.0.0.1:5000 app:app
+    hypercorn -w 4 -b 127.0.0.1:8000 async_app:app
+then run
+    python loadtest.py --target flask=http://127.0.0.1:5000 \\
+                       --target async=http://127.0.0.1:8000 \\
+                       --query-type landmarks_in_city --user-input Paris
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def client(session, url, form, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            async with session.post(url, data=form) as response:
+                await response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+                    continue
+        except aiohttp.ClientError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_level(base_url, form, concurrency, duration):
+    latencies, errors = [], []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session, base_url + "/query", form, deadline, latencies, errors)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def main_async(args):
+    form = {"query_type": args.query_type, "user_input": args.user_input}
+    if args.radius is not None:
+        form["radius"] = str(args.radius)
+    print(f"{'server':<8} {'clients':>7} {'requests':>9} {'errors':>7} {'req/sec':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, base_url in args.target:
+        for concurrency in args.concurrency:
+            r = await run_level(base_url.rstrip("/"), form, concurrency, args.duration)
+            print(f"{name:<8} {concurrency:>7} {r['requests']:>9} {r['errors']:>7} "
+                  f"{r['rps']:>9.1f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+
+
+def parse_target(value):
+    name, _, url = value.partition("=")
+    if not url:
+        raise argparse.ArgumentTypeError("targets look like name=http://host:port")
+    return name, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", type=parse_target, action="append", required=True,
+                        help="name=base_url of a running server; repeat for each server")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--query-type", default="landmarks_in_city")
+    parser.add_argument("--user-input", default="Paris")
+    parser.add_argument("--radius", type=float, default=None)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
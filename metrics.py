@@ -0,0 +1,231 @@
+"""Per-query latency, row-count and error metrics, plus a slow-query log.
+
+statements.execute() records every named statement here, through timed(); render_metrics()
+turns the totals into the Prometheus text format served on /metrics.
+Statements slower than SPATIAL_SLOW_QUERY_SECONDS are logged to the
+``slow_queries`` logger (and SPATIAL_SLOW_QUERY_LOG, if set) with their
+EXPLAIN (ANALYZE, BUFFERS) plan, taken on a background thread.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Seconds; 0 turns slow-query capture off
+SLOW_QUERY_SECONDS = float(os.environ.get("SPATIAL_SLOW_QUERY_SECONDS", "1.0"))
+SLOW_QUERY_EXPLAIN = os.environ.get("SPATIAL_SLOW_QUERY_EXPLAIN", "1") != "0"
+SLOW_QUERY_LOG = os.environ.get("SPATIAL_SLOW_QUERY_LOG")
+# EXPLAIN ANALYZE runs the statement again, so each one is explained at most
+# once per this many seconds.
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get("SPATIAL_SLOW_QUERY_EXPLAIN_INTERVAL", "60"))
+# Slow statements waiting for the background EXPLAIN; more are logged without a plan
+EXPLAIN_QUEUE_SIZE = 32
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+HISTOGRAMS = {
+    "spatial_query_duration_seconds": ("Statement execution time.", LATENCY_BUCKETS),
+    "spatial_query_rows": ("Rows returned per statement.", ROW_BUCKETS),
+    "spatial_db_acquire_seconds": ("Wait for a pooled connection before the statement.", LATENCY_BUCKETS),
+}
+COUNTERS = {
+    "spatial_query_errors_total": "Statements that raised an error.",
+    "spatial_slow_queries_total": "Statements slower than the slow-query threshold.",
+    "spatial_query_coalesced_total": "Requests answered from an identical request already in flight.",
+    "spatial_query_not_modified_total": "Conditional /query requests answered 304.",
+}
+
+slow_query_logger = logging.getLogger("slow_queries")
+if SLOW_QUERY_LOG:
+    slow_query_logger.addHandler(logging.FileHandler(SLOW_QUERY_LOG))
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+_histograms = {}  # (metric, query) -> Histogram
+_counters = {}  # (metric, query) -> int
+_lock = threading.Lock()
+_recent_slow = deque(maxlen=50)
+_last_explained = {}
+
+
+def observe(metric, query, value):
+    with _lock:
+        histogram = _histograms.get((metric, query))
+        if histogram is None:
+            histogram = _histograms[(metric, query)] = Histogram(HISTOGRAMS[metric][1])
+        histogram.observe(value)
+
+
+def inc(metric, query):
+    with _lock:
+        _counters[(metric, query)] = _counters.get((metric, query), 0) + 1
+
+
+def record_query(query, seconds, rows):
+    """Record one completed statement."""
+    observe("spatial_query_duration_seconds", query, seconds)
+    if rows is not None and rows >= 0:
+        observe("spatial_query_rows", query, rows)
+
+
+class Timing:
+    """Yielded by timed(): set ``rows`` once known; time inside ``paused()`` is not counted."""
+
+    def __init__(self):
+        self.rows = None
+        self.excluded = 0.0
+
+    @contextmanager
+    def paused(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.excluded += time.perf_counter() - start
+
+
+@contextmanager
+def timed(query, sql, params):
+    """Record the block as one run of ``query``: its duration, rows and error, and log it if slow."""
+    timing = Timing()
+    start = time.perf_counter()
+    try:
+        yield timing
+    except Exception:
+        inc("spatial_query_errors_total", query)
+        raise
+    elapsed = time.perf_counter() - start - timing.excluded
+    record_query(query, elapsed, timing.rows)
+    if is_slow(elapsed):
+        capture_slow_query(query, sql, params, elapsed)
+
+
+def capture_slow_query(query, sql, params, seconds):
+    """Log a slow statement, with its plan if it has not been explained recently.
+
+    EXPLAIN ANALYZE runs the statement again, so it is queued to a background
+    thread with its own connection rather than run in the slow request. The
+    entry is logged once the plan is in, or straight away without one.
+    """
+    inc("spatial_slow_queries_total", query)
+    entry = {"query": query, "seconds": round(seconds, 4), "at": time.time(), "plan": None}
+    now = time.monotonic()
+    with _lock:
+        explain = (SLOW_QUERY_EXPLAIN
+                   and now - _last_explained.get(query, -SLOW_QUERY_EXPLAIN_INTERVAL) >= SLOW_QUERY_EXPLAIN_INTERVAL)
+        if explain:
+            _last_explained[query] = now
+    if explain:
+        _start_explain_worker()
+        try:
+            _explain_queue.put_nowait((entry, sql, params))
+            return
+        except queue.Full:
+            logging.warning(f"Slow query {query} not explained: explain queue full")
+    _log_slow_query(entry)
+
+
+def _log_slow_query(entry):
+    with _lock:
+        _recent_slow.append(entry)
+    slow_query_logger.warning(f"Slow query {entry['query']} took {entry['seconds']:.3f}s"
+                              + (f"\n{entry['plan']}" if entry["plan"] else ""))
+
+
+_explain_queue = queue.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+_explain_worker = None
+
+
+def _start_explain_worker():
+    global _explain_worker
+    with _lock:
+        if _explain_worker is None:
+            _explain_worker = threading.Thread(target=_explain_loop, name="slow-query-explain", daemon=True)
+            _explain_worker.start()
+
+
+def _explain_loop():
+    from db import get_connection
+
+    while True:
+        entry, sql, params = _explain_queue.get()
+        try:
+            with get_connection(readonly=True) as conn:
+                with conn.cursor() as cursor:
+                    try:
+                        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params or None)
+                        entry["plan"] = "\n".join(row[0] for row in cursor.fetchall())
+                    finally:
+                        # ANALYZE really ran the statement; keep none of its effects
+                        conn.rollback()
+        except Exception as e:
+            logging.warning(f"Could not explain slow query {entry['query']}: {e}")
+        _log_slow_query(entry)
+
+
+def is_slow(seconds):
+    return SLOW_QUERY_SECONDS > 0 and seconds >= SLOW_QUERY_SECONDS
+
+
+def recent_slow_queries():
+    """The latest slow statements, newest first."""
+    with _lock:
+        return list(reversed(_recent_slow))
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics(pool=None):
+    """Prometheus text exposition of every metric, plus pool gauges if ``pool`` stats are given."""
+    lines = []
+    with _lock:
+        histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in _histograms.items()}
+        counters = dict(_counters)
+    for metric, (help_text, _) in HISTOGRAMS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for (name, query), (counts, total, count, buckets) in sorted(histograms.items()):
+            if name != metric:
+                continue
+            label = f'query="{_label(query)}"'
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {bucket_count}')
+            lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum{{{label}}} {total}")
+            lines.append(f"{metric}_count{{{label}}} {count}")
+    for metric, help_text in COUNTERS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for (name, query), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f'{metric}{{query="{_label(query)}"}} {value}')
+    if pool:
+        for key in ("in_use", "max_size"):
+            lines.append(f"# TYPE spatial_db_pool_{key} gauge")
+            lines.append(f"spatial_db_pool_{key} {pool[key]}")
+        for key in ("checkouts", "timeouts", "health_check_failures", "discarded"):
+            lines.append(f"# TYPE spatial_db_pool_{key}_total counter")
+            lines.append(f"spatial_db_pool_{key}_total {pool[key]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,940 @@
+"""SQL of every schema migration, exactly as it shipped.
+
+MIGRATIONS is an append-only list of (version, description, SQL) that
+schema.migrate() applies in order. Each entry is a literal rather than a
+reference to the owning module's current SQL (aggregates.SCHEMA_SQL and the
+like), so editing those modules cannot change what an old migration runs.
+Never edit a migration that has shipped; append a new one that brings
+existing databases up to date. tests/test_migrations.py checks this.
+"""
+
+MIGRATIONS = [
+    (1, "base tables", """
+CREATE EXTENSION IF NOT EXISTS postgis;
+CREATE TABLE IF NOT EXISTS countries (
+    id serial PRIMARY KEY,
+    name text NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cities (
+    id serial PRIMARY KEY,
+    name text NOT NULL,
+    country_id integer REFERENCES countries(id),
+    location geometry(Point, 4326)
+);
+CREATE TABLE IF NOT EXISTS landmarks (
+    id serial PRIMARY KEY,
+    name text NOT NULL,
+    city_id integer REFERENCES cities(id),
+    type text,
+    location geometry(Point, 4326)
+);
+CREATE TABLE IF NOT EXISTS visitors (
+    id serial PRIMARY KEY,
+    name text,
+    landmark_id integer REFERENCES landmarks(id),
+    visit_date date
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    id serial PRIMARY KEY,
+    landmark_id integer REFERENCES landmarks(id),
+    review_text text,
+    rating integer,
+    review_date date
+);
+CREATE TABLE IF NOT EXISTS routes (
+    id serial PRIMARY KEY,
+    name text,
+    path geometry(LineString, 4326)
+);
+CREATE TABLE IF NOT EXISTS regions (
+    id serial PRIMARY KEY,
+    name text,
+    boundary geometry(Polygon, 4326)
+);
+"""),
+    # The queries cast points to geography for metre distances and the KNN (<->)
+    # ordering, which only an expression index on the cast can serve; the plain
+    # geometry indexes serve the bounding-box and route/region containment tests.
+    (2, "spatial and lookup indexes", """
+CREATE INDEX IF NOT EXISTS landmarks_location_gix ON landmarks USING gist (location);
+CREATE INDEX IF NOT EXISTS landmarks_location_geog_gix ON landmarks USING gist ((location::geography));
+CREATE INDEX IF NOT EXISTS cities_location_gix ON cities USING gist (location);
+CREATE INDEX IF NOT EXISTS cities_location_geog_gix ON cities USING gist ((location::geography));
+CREATE INDEX IF NOT EXISTS routes_path_gix ON routes USING gist (path);
+CREATE INDEX IF NOT EXISTS regions_boundary_gix ON regions USING gist (boundary);
+
+CREATE INDEX IF NOT EXISTS landmarks_name_idx ON landmarks (name);
+CREATE INDEX IF NOT EXISTS cities_name_idx ON cities (name);
+CREATE INDEX IF NOT EXISTS countries_name_idx ON countries (name);
+CREATE INDEX IF NOT EXISTS landmarks_city_id_type_idx ON landmarks (city_id, type);
+CREATE INDEX IF NOT EXISTS cities_country_id_idx ON cities (country_id);
+CREATE INDEX IF NOT EXISTS visitors_landmark_id_idx ON visitors (landmark_id);
+CREATE INDEX IF NOT EXISTS reviews_landmark_id_idx ON reviews (landmark_id);
+CREATE INDEX IF NOT EXISTS reviews_rating_idx ON reviews (rating);
+"""),
+    (3, "landmark_stats summary", """
+CREATE TABLE IF NOT EXISTS landmark_stats (
+    landmark_id integer PRIMARY KEY REFERENCES landmarks(id) ON DELETE CASCADE,
+    visit_count bigint NOT NULL DEFAULT 0,
+    rating_sum bigint NOT NULL DEFAULT 0,
+    rating_count bigint NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS landmark_stats_visit_count_idx
+    ON landmark_stats (visit_count DESC);
+CREATE INDEX IF NOT EXISTS landmark_stats_no_visitors_idx
+    ON landmark_stats (landmark_id) WHERE visit_count = 0;
+
+CREATE OR REPLACE FUNCTION landmark_stats_visitors() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE landmark_stats SET visit_count = 0 WHERE visit_count <> 0;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE landmark_stats s
+        SET visit_count = s.visit_count - d.n
+        FROM (SELECT landmark_id, COUNT(*) AS n
+              FROM old_rows WHERE landmark_id IS NOT NULL
+              GROUP BY landmark_id) d
+        WHERE s.landmark_id = d.landmark_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO landmark_stats AS s (landmark_id, visit_count)
+        SELECT landmark_id, COUNT(*)
+        FROM new_rows WHERE landmark_id IS NOT NULL
+        GROUP BY landmark_id
+        ON CONFLICT (landmark_id)
+        DO UPDATE SET visit_count = s.visit_count + EXCLUDED.visit_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION landmark_stats_reviews() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE landmark_stats SET rating_sum = 0, rating_count = 0 WHERE rating_count <> 0;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE landmark_stats s
+        SET rating_sum = s.rating_sum - d.total, rating_count = s.rating_count - d.n
+        FROM (SELECT landmark_id, COALESCE(SUM(rating), 0) AS total, COUNT(rating) AS n
+              FROM old_rows WHERE landmark_id IS NOT NULL
+              GROUP BY landmark_id) d
+        WHERE s.landmark_id = d.landmark_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO landmark_stats AS s (landmark_id, rating_sum, rating_count)
+        SELECT landmark_id, COALESCE(SUM(rating), 0), COUNT(rating)
+        FROM new_rows WHERE landmark_id IS NOT NULL
+        GROUP BY landmark_id
+        ON CONFLICT (landmark_id)
+        DO UPDATE SET rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+                      rating_count = s.rating_count + EXCLUDED.rating_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION landmark_stats_landmarks() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO landmark_stats (landmark_id)
+    SELECT id FROM new_rows
+    ON CONFLICT (landmark_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS visitors_stats_insert ON visitors;
+DROP TRIGGER IF EXISTS visitors_stats_update ON visitors;
+DROP TRIGGER IF EXISTS visitors_stats_delete ON visitors;
+DROP TRIGGER IF EXISTS visitors_stats_truncate ON visitors;
+CREATE TRIGGER visitors_stats_insert AFTER INSERT ON visitors
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+CREATE TRIGGER visitors_stats_update AFTER UPDATE ON visitors
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+CREATE TRIGGER visitors_stats_delete AFTER DELETE ON visitors
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+CREATE TRIGGER visitors_stats_truncate AFTER TRUNCATE ON visitors
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+
+DROP TRIGGER IF EXISTS reviews_stats_insert ON reviews;
+DROP TRIGGER IF EXISTS reviews_stats_update ON reviews;
+DROP TRIGGER IF EXISTS reviews_stats_delete ON reviews;
+DROP TRIGGER IF EXISTS reviews_stats_truncate ON reviews;
+CREATE TRIGGER reviews_stats_insert AFTER INSERT ON reviews
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+CREATE TRIGGER reviews_stats_update AFTER UPDATE ON reviews
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+CREATE TRIGGER reviews_stats_delete AFTER DELETE ON reviews
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+CREATE TRIGGER reviews_stats_truncate AFTER TRUNCATE ON reviews
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+
+DROP TRIGGER IF EXISTS landmarks_stats_insert ON landmarks;
+CREATE TRIGGER landmarks_stats_insert AFTER INSERT ON landmarks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_landmarks();
+
+LOCK TABLE visitors, reviews IN SHARE MODE;
+TRUNCATE landmark_stats;
+INSERT INTO landmark_stats (landmark_id, visit_count, rating_sum, rating_count)
+SELECT l.id, COALESCE(v.n, 0), COALESCE(r.total, 0), COALESCE(r.n, 0)
+FROM landmarks l
+LEFT JOIN (
+    SELECT landmark_id, COUNT(*) AS n
+    FROM visitors
+    GROUP BY landmark_id
+) v ON v.landmark_id = l.id
+LEFT JOIN (
+    SELECT landmark_id, SUM(rating) AS total, COUNT(rating) AS n
+    FROM reviews
+    GROUP BY landmark_id
+) r ON r.landmark_id = l.id;
+"""),
+    (4, "keyword search columns and indexes", """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE reviews ADD COLUMN IF NOT EXISTS search_document tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', COALESCE(review_text, ''))) STORED;
+ALTER TABLE landmarks ADD COLUMN IF NOT EXISTS search_document tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', COALESCE(name, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS reviews_search_document_idx
+    ON reviews USING gin (search_document);
+CREATE INDEX IF NOT EXISTS landmarks_search_document_idx
+    ON landmarks USING gin (search_document);
+CREATE INDEX IF NOT EXISTS reviews_review_text_trgm_idx
+    ON reviews USING gin (review_text gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS landmarks_name_trgm_idx
+    ON landmarks USING gin (name gin_trgm_ops);
+"""),
+    (5, "case-insensitive name indexes", """
+CREATE INDEX IF NOT EXISTS landmarks_lower_name_idx ON landmarks (lower(name));
+CREATE INDEX IF NOT EXISTS cities_lower_name_idx ON cities (lower(name));
+"""),
+    (6, "region_overlaps summary", """
+CREATE TABLE IF NOT EXISTS region_overlaps (
+    region_id1 integer NOT NULL,
+    region_id2 integer NOT NULL,
+    area_m2 double precision NOT NULL,
+    PRIMARY KEY (region_id1, region_id2),
+    CHECK (region_id1 <= region_id2)
+);
+
+CREATE OR REPLACE FUNCTION region_overlaps_refresh() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE region_overlaps;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM region_overlaps o
+        USING old_rows c
+        WHERE c.id IN (o.region_id1, o.region_id2);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        -- A pair of two changed regions is emitted once, from its lower id
+        INSERT INTO region_overlaps AS o (region_id1, region_id2, area_m2)
+        SELECT LEAST(c.id, r.id), GREATEST(c.id, r.id),
+               ST_Area(ST_Intersection(c.boundary, r.boundary)::geography)
+        FROM new_rows c
+        JOIN regions r ON ST_Intersects(c.boundary, r.boundary)
+        WHERE r.id >= c.id OR r.id NOT IN (SELECT id FROM new_rows)
+        ON CONFLICT (region_id1, region_id2) DO UPDATE SET area_m2 = EXCLUDED.area_m2;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS regions_overlaps_insert ON regions;
+DROP TRIGGER IF EXISTS regions_overlaps_update ON regions;
+DROP TRIGGER IF EXISTS regions_overlaps_delete ON regions;
+DROP TRIGGER IF EXISTS regions_overlaps_truncate ON regions;
+CREATE TRIGGER regions_overlaps_insert AFTER INSERT ON regions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION region_overlaps_refresh();
+CREATE TRIGGER regions_overlaps_update AFTER UPDATE ON regions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION region_overlaps_refresh();
+CREATE TRIGGER regions_overlaps_delete AFTER DELETE ON regions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION region_overlaps_refresh();
+CREATE TRIGGER regions_overlaps_truncate AFTER TRUNCATE ON regions
+    FOR EACH STATEMENT EXECUTE FUNCTION region_overlaps_refresh();
+
+LOCK TABLE regions IN SHARE MODE;
+TRUNCATE region_overlaps;
+INSERT INTO region_overlaps (region_id1, region_id2, area_m2)
+SELECT r1.id, r2.id, ST_Area(ST_Intersection(r1.boundary, r2.boundary)::geography)
+FROM regions r1
+JOIN regions r2 ON r1.id <= r2.id AND ST_Intersects(r1.boundary, r2.boundary);
+"""),
+    (7, "tile_stats grid aggregates", """
+CREATE TABLE IF NOT EXISTS tile_stats (
+    zoom smallint NOT NULL,
+    x integer NOT NULL,
+    y integer NOT NULL,
+    landmark_count bigint NOT NULL DEFAULT 0,
+    visit_count bigint NOT NULL DEFAULT 0,
+    rating_sum bigint NOT NULL DEFAULT 0,
+    rating_count bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (zoom, x, y)
+);
+
+CREATE OR REPLACE FUNCTION tile_x(zoom integer, lon double precision) RETURNS integer AS $$
+    SELECT LEAST(GREATEST(floor((lon + 180) / 360 * (1 << zoom))::integer, 0), (1 << zoom) - 1)
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION tile_y(zoom integer, lat double precision) RETURNS integer AS $$
+    SELECT LEAST(GREATEST(floor(
+        (1 - ln(tan(radians(c.lat)) + 1 / cos(radians(c.lat))) / pi()) / 2 * (1 << zoom))::integer, 0),
+        (1 << zoom) - 1)
+    FROM (SELECT LEAST(GREATEST(lat, -85.0511), 85.0511) AS lat) c
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Recompute the cells containing ``points`` at every zoom, finest first
+CREATE OR REPLACE FUNCTION tile_stats_refresh(points geometry[]) RETURNS void AS $$
+DECLARE
+    z integer;
+    finer integer;
+BEGIN
+    FOREACH z IN ARRAY ARRAY[14, 12, 10, 8, 6, 4, 2] LOOP
+        DELETE FROM tile_stats t
+        USING (SELECT DISTINCT tile_x(z, ST_X(p)) AS x, tile_y(z, ST_Y(p)) AS y
+               FROM unnest(points) AS p WHERE p IS NOT NULL) c
+        WHERE t.zoom = z AND t.x = c.x AND t.y = c.y;
+        IF finer IS NULL THEN
+            INSERT INTO tile_stats (zoom, x, y, landmark_count, visit_count, rating_sum, rating_count)
+            SELECT z, c.x, c.y, COUNT(*), COALESCE(SUM(s.visit_count), 0),
+                   COALESCE(SUM(s.rating_sum), 0), COALESCE(SUM(s.rating_count), 0)
+            FROM (SELECT DISTINCT tile_x(z, ST_X(p)) AS x, tile_y(z, ST_Y(p)) AS y
+                  FROM unnest(points) AS p WHERE p IS NOT NULL) c
+            JOIN landmarks l
+              ON l.location && ST_Transform(ST_TileEnvelope(z, c.x, c.y), 4326)
+             AND tile_x(z, ST_X(l.location)) = c.x AND tile_y(z, ST_Y(l.location)) = c.y
+            LEFT JOIN landmark_stats s ON s.landmark_id = l.id
+            GROUP BY c.x, c.y;
+        ELSE
+            INSERT INTO tile_stats (zoom, x, y, landmark_count, visit_count, rating_sum, rating_count)
+            SELECT z, c.x, c.y, SUM(t.landmark_count), SUM(t.visit_count),
+                   SUM(t.rating_sum), SUM(t.rating_count)
+            FROM (SELECT DISTINCT tile_x(z, ST_X(p)) AS x, tile_y(z, ST_Y(p)) AS y
+                  FROM unnest(points) AS p WHERE p IS NOT NULL) c
+            JOIN tile_stats t
+              ON t.zoom = finer
+             AND t.x BETWEEN c.x << (finer - z) AND ((c.x + 1) << (finer - z)) - 1
+             AND t.y BETWEEN c.y << (finer - z) AND ((c.y + 1) << (finer - z)) - 1
+            GROUP BY c.x, c.y;
+        END IF;
+        finer := z;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION tile_stats_landmarks() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE tile_stats;
+    ELSIF TG_OP = 'INSERT' THEN
+        PERFORM tile_stats_refresh(ARRAY(SELECT location FROM new_rows));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM tile_stats_refresh(ARRAY(SELECT location FROM old_rows
+                                         UNION ALL SELECT location FROM new_rows));
+    ELSE
+        PERFORM tile_stats_refresh(ARRAY(SELECT location FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Visit and rating changes arrive as landmark_stats changes; add the
+-- difference to the landmark's cell at every zoom.
+CREATE OR REPLACE FUNCTION tile_stats_landmark_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE tile_stats SET visit_count = 0, rating_sum = 0, rating_count = 0;
+    ELSIF TG_OP = 'INSERT' THEN
+        INSERT INTO tile_stats AS t (zoom, x, y, visit_count, rating_sum, rating_count)
+        SELECT z.zoom, tile_x(z.zoom, ST_X(l.location)), tile_y(z.zoom, ST_Y(l.location)),
+               SUM(n.visit_count), SUM(n.rating_sum), SUM(n.rating_count)
+        FROM new_rows n
+        JOIN landmarks l ON l.id = n.landmark_id
+        CROSS JOIN unnest(ARRAY[2, 4, 6, 8, 10, 12, 14]) AS z(zoom)
+        WHERE l.location IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (zoom, x, y)
+        DO UPDATE SET visit_count = t.visit_count + EXCLUDED.visit_count,
+                      rating_sum = t.rating_sum + EXCLUDED.rating_sum,
+                      rating_count = t.rating_count + EXCLUDED.rating_count;
+    ELSE
+        INSERT INTO tile_stats AS t (zoom, x, y, visit_count, rating_sum, rating_count)
+        SELECT z.zoom, tile_x(z.zoom, ST_X(l.location)), tile_y(z.zoom, ST_Y(l.location)),
+               SUM(n.visit_count - o.visit_count), SUM(n.rating_sum - o.rating_sum),
+               SUM(n.rating_count - o.rating_count)
+        FROM new_rows n
+        JOIN old_rows o ON o.landmark_id = n.landmark_id
+        JOIN landmarks l ON l.id = n.landmark_id
+        CROSS JOIN unnest(ARRAY[2, 4, 6, 8, 10, 12, 14]) AS z(zoom)
+        WHERE l.location IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (zoom, x, y)
+        DO UPDATE SET visit_count = t.visit_count + EXCLUDED.visit_count,
+                      rating_sum = t.rating_sum + EXCLUDED.rating_sum,
+                      rating_count = t.rating_count + EXCLUDED.rating_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS landmarks_tiles_insert ON landmarks;
+DROP TRIGGER IF EXISTS landmarks_tiles_update ON landmarks;
+DROP TRIGGER IF EXISTS landmarks_tiles_delete ON landmarks;
+DROP TRIGGER IF EXISTS landmarks_tiles_truncate ON landmarks;
+CREATE TRIGGER landmarks_tiles_insert AFTER INSERT ON landmarks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmarks();
+CREATE TRIGGER landmarks_tiles_update AFTER UPDATE ON landmarks
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmarks();
+CREATE TRIGGER landmarks_tiles_delete AFTER DELETE ON landmarks
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmarks();
+CREATE TRIGGER landmarks_tiles_truncate AFTER TRUNCATE ON landmarks
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmarks();
+
+DROP TRIGGER IF EXISTS landmark_stats_tiles_insert ON landmark_stats;
+DROP TRIGGER IF EXISTS landmark_stats_tiles_update ON landmark_stats;
+DROP TRIGGER IF EXISTS landmark_stats_tiles_truncate ON landmark_stats;
+CREATE TRIGGER landmark_stats_tiles_insert AFTER INSERT ON landmark_stats
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmark_stats();
+CREATE TRIGGER landmark_stats_tiles_update AFTER UPDATE ON landmark_stats
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmark_stats();
+CREATE TRIGGER landmark_stats_tiles_truncate AFTER TRUNCATE ON landmark_stats
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmark_stats();
+
+LOCK TABLE landmarks, landmark_stats IN SHARE MODE;
+TRUNCATE tile_stats;
+INSERT INTO tile_stats (zoom, x, y, landmark_count, visit_count, rating_sum, rating_count)
+SELECT z.zoom, tile_x(z.zoom, ST_X(l.location)), tile_y(z.zoom, ST_Y(l.location)),
+       COUNT(*), COALESCE(SUM(s.visit_count), 0),
+       COALESCE(SUM(s.rating_sum), 0), COALESCE(SUM(s.rating_count), 0)
+FROM landmarks l
+LEFT JOIN landmark_stats s ON s.landmark_id = l.id
+CROSS JOIN unnest(ARRAY[2, 4, 6, 8, 10, 12, 14]) AS z(zoom)
+WHERE l.location IS NOT NULL
+GROUP BY 1, 2, 3;
+"""),
+    # The swap drops the old tables' indexes and triggers, so they are
+    # recreated on the partitioned tables from their original migrations.
+    (8, "monthly partitions for visitors and reviews", """
+-- Create the monthly partitions of ``parent`` from first_month to last_month
+-- that do not exist yet, moving any of their rows out of the DEFAULT partition.
+CREATE OR REPLACE FUNCTION ensure_month_partitions(parent text, first_month date, last_month date)
+RETURNS integer AS $$
+DECLARE
+    key text := substring(pg_get_partkeydef(parent::regclass) from 'RANGE \\((\\w+)\\)');
+    columns text;
+    month date;
+    next_month date;
+    partition_name text;
+    created integer := 0;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns
+    FROM pg_attribute
+    WHERE attrelid = parent::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    FOR month IN
+        SELECT generate_series(date_trunc('month', first_month), date_trunc('month', last_month),
+                               interval '1 month')::date
+    LOOP
+        partition_name := format('%s_y%sm%s', parent, to_char(month, 'YYYY'), to_char(month, 'MM'));
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        next_month := (month + interval '1 month')::date;
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED)',
+                       partition_name, parent);
+        EXECUTE format('WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING %s) '
+                       'INSERT INTO %I (%s) SELECT %s FROM moved',
+                       parent || '_default', key, month, key, next_month, columns,
+                       partition_name, columns, columns);
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       parent, partition_name, month, next_month);
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Swap a plain table for a partitioned one with the same columns and rows.
+-- Indexes and triggers are recreated by the caller once the rows are in.
+CREATE OR REPLACE FUNCTION partition_by_month(parent text, key text) RETURNS void AS $$
+DECLARE
+    old_name text := parent || '_unpartitioned';
+    seq text := pg_get_serial_sequence(parent, 'id');
+    columns text;
+    first_month date;
+    last_month date;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(parent)) <> 'r' THEN
+        RETURN;
+    END IF;
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', parent, old_name);
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED) '
+                   'PARTITION BY RANGE (%I)', parent, old_name, key);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', parent || '_default', parent);
+    EXECUTE format('SELECT min(%I), max(%I) FROM %I', key, key, old_name) INTO first_month, last_month;
+    PERFORM ensure_month_partitions(parent, COALESCE(first_month, current_date),
+                                    GREATEST(last_month, current_date));
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns
+    FROM pg_attribute
+    WHERE attrelid = old_name::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM %I', parent, columns, columns, old_name);
+    -- The id sequence belongs to the old table and would be dropped with it
+    IF seq IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', seq);
+    END IF;
+    EXECUTE format('DROP TABLE %I', old_name);
+    IF seq IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.id', seq, parent);
+    END IF;
+    EXECUTE format('ALTER TABLE %I ADD FOREIGN KEY (landmark_id) REFERENCES landmarks(id)', parent);
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT partition_by_month('visitors', 'visit_date');
+SELECT partition_by_month('reviews', 'review_date');
+
+CREATE INDEX IF NOT EXISTS visitors_visit_date_brin ON visitors USING brin (visit_date);
+CREATE INDEX IF NOT EXISTS reviews_review_date_brin ON reviews USING brin (review_date);
+CREATE INDEX IF NOT EXISTS visitors_landmark_id_visit_date_idx ON visitors (landmark_id, visit_date);
+CREATE INDEX IF NOT EXISTS reviews_landmark_id_review_date_idx ON reviews (landmark_id, review_date);
+
+CREATE INDEX IF NOT EXISTS landmarks_location_gix ON landmarks USING gist (location);
+CREATE INDEX IF NOT EXISTS landmarks_location_geog_gix ON landmarks USING gist ((location::geography));
+CREATE INDEX IF NOT EXISTS cities_location_gix ON cities USING gist (location);
+CREATE INDEX IF NOT EXISTS cities_location_geog_gix ON cities USING gist ((location::geography));
+CREATE INDEX IF NOT EXISTS routes_path_gix ON routes USING gist (path);
+CREATE INDEX IF NOT EXISTS regions_boundary_gix ON regions USING gist (boundary);
+
+CREATE INDEX IF NOT EXISTS landmarks_name_idx ON landmarks (name);
+CREATE INDEX IF NOT EXISTS cities_name_idx ON cities (name);
+CREATE INDEX IF NOT EXISTS countries_name_idx ON countries (name);
+CREATE INDEX IF NOT EXISTS landmarks_city_id_type_idx ON landmarks (city_id, type);
+CREATE INDEX IF NOT EXISTS cities_country_id_idx ON cities (country_id);
+CREATE INDEX IF NOT EXISTS visitors_landmark_id_idx ON visitors (landmark_id);
+CREATE INDEX IF NOT EXISTS reviews_landmark_id_idx ON reviews (landmark_id);
+CREATE INDEX IF NOT EXISTS reviews_rating_idx ON reviews (rating);
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE reviews ADD COLUMN IF NOT EXISTS search_document tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', COALESCE(review_text, ''))) STORED;
+ALTER TABLE landmarks ADD COLUMN IF NOT EXISTS search_document tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', COALESCE(name, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS reviews_search_document_idx
+    ON reviews USING gin (search_document);
+CREATE INDEX IF NOT EXISTS landmarks_search_document_idx
+    ON landmarks USING gin (search_document);
+CREATE INDEX IF NOT EXISTS reviews_review_text_trgm_idx
+    ON reviews USING gin (review_text gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS landmarks_name_trgm_idx
+    ON landmarks USING gin (name gin_trgm_ops);
+
+CREATE TABLE IF NOT EXISTS landmark_stats (
+    landmark_id integer PRIMARY KEY REFERENCES landmarks(id) ON DELETE CASCADE,
+    visit_count bigint NOT NULL DEFAULT 0,
+    rating_sum bigint NOT NULL DEFAULT 0,
+    rating_count bigint NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS landmark_stats_visit_count_idx
+    ON landmark_stats (visit_count DESC);
+CREATE INDEX IF NOT EXISTS landmark_stats_no_visitors_idx
+    ON landmark_stats (landmark_id) WHERE visit_count = 0;
+
+CREATE OR REPLACE FUNCTION landmark_stats_visitors() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE landmark_stats SET visit_count = 0 WHERE visit_count <> 0;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE landmark_stats s
+        SET visit_count = s.visit_count - d.n
+        FROM (SELECT landmark_id, COUNT(*) AS n
+              FROM old_rows WHERE landmark_id IS NOT NULL
+              GROUP BY landmark_id) d
+        WHERE s.landmark_id = d.landmark_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO landmark_stats AS s (landmark_id, visit_count)
+        SELECT landmark_id, COUNT(*)
+        FROM new_rows WHERE landmark_id IS NOT NULL
+        GROUP BY landmark_id
+        ON CONFLICT (landmark_id)
+        DO UPDATE SET visit_count = s.visit_count + EXCLUDED.visit_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION landmark_stats_reviews() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE landmark_stats SET rating_sum = 0, rating_count = 0 WHERE rating_count <> 0;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE landmark_stats s
+        SET rating_sum = s.rating_sum - d.total, rating_count = s.rating_count - d.n
+        FROM (SELECT landmark_id, COALESCE(SUM(rating), 0) AS total, COUNT(rating) AS n
+              FROM old_rows WHERE landmark_id IS NOT NULL
+              GROUP BY landmark_id) d
+        WHERE s.landmark_id = d.landmark_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO landmark_stats AS s (landmark_id, rating_sum, rating_count)
+        SELECT landmark_id, COALESCE(SUM(rating), 0), COUNT(rating)
+        FROM new_rows WHERE landmark_id IS NOT NULL
+        GROUP BY landmark_id
+        ON CONFLICT (landmark_id)
+        DO UPDATE SET rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+                      rating_count = s.rating_count + EXCLUDED.rating_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION landmark_stats_landmarks() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO landmark_stats (landmark_id)
+    SELECT id FROM new_rows
+    ON CONFLICT (landmark_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS visitors_stats_insert ON visitors;
+DROP TRIGGER IF EXISTS visitors_stats_update ON visitors;
+DROP TRIGGER IF EXISTS visitors_stats_delete ON visitors;
+DROP TRIGGER IF EXISTS visitors_stats_truncate ON visitors;
+CREATE TRIGGER visitors_stats_insert AFTER INSERT ON visitors
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+CREATE TRIGGER visitors_stats_update AFTER UPDATE ON visitors
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+CREATE TRIGGER visitors_stats_delete AFTER DELETE ON visitors
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+CREATE TRIGGER visitors_stats_truncate AFTER TRUNCATE ON visitors
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_visitors();
+
+DROP TRIGGER IF EXISTS reviews_stats_insert ON reviews;
+DROP TRIGGER IF EXISTS reviews_stats_update ON reviews;
+DROP TRIGGER IF EXISTS reviews_stats_delete ON reviews;
+DROP TRIGGER IF EXISTS reviews_stats_truncate ON reviews;
+CREATE TRIGGER reviews_stats_insert AFTER INSERT ON reviews
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+CREATE TRIGGER reviews_stats_update AFTER UPDATE ON reviews
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+CREATE TRIGGER reviews_stats_delete AFTER DELETE ON reviews
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+CREATE TRIGGER reviews_stats_truncate AFTER TRUNCATE ON reviews
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_reviews();
+
+DROP TRIGGER IF EXISTS landmarks_stats_insert ON landmarks;
+CREATE TRIGGER landmarks_stats_insert AFTER INSERT ON landmarks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION landmark_stats_landmarks();
+"""),
+    (9, "change notification triggers", """
+CREATE OR REPLACE FUNCTION notify_change() RETURNS trigger AS $$
+DECLARE
+    ids integer[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        ids := ARRAY(SELECT id FROM old_rows LIMIT 100 + 1);
+    ELSIF TG_OP <> 'TRUNCATE' THEN
+        ids := ARRAY(SELECT id FROM new_rows LIMIT 100 + 1);
+    END IF;
+    -- Statements that matched no rows change nothing
+    IF cardinality(ids) = 0 THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_notify('spatial_changes', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', lower(TG_OP),
+        'ids', CASE WHEN cardinality(ids) <= 100 THEN ids END)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS countries_changes_insert ON countries;
+DROP TRIGGER IF EXISTS countries_changes_update ON countries;
+DROP TRIGGER IF EXISTS countries_changes_delete ON countries;
+DROP TRIGGER IF EXISTS countries_changes_truncate ON countries;
+CREATE TRIGGER countries_changes_insert AFTER INSERT ON countries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER countries_changes_update AFTER UPDATE ON countries
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER countries_changes_delete AFTER DELETE ON countries
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER countries_changes_truncate AFTER TRUNCATE ON countries
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+DROP TRIGGER IF EXISTS cities_changes_insert ON cities;
+DROP TRIGGER IF EXISTS cities_changes_update ON cities;
+DROP TRIGGER IF EXISTS cities_changes_delete ON cities;
+DROP TRIGGER IF EXISTS cities_changes_truncate ON cities;
+CREATE TRIGGER cities_changes_insert AFTER INSERT ON cities
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER cities_changes_update AFTER UPDATE ON cities
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER cities_changes_delete AFTER DELETE ON cities
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER cities_changes_truncate AFTER TRUNCATE ON cities
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+DROP TRIGGER IF EXISTS landmarks_changes_insert ON landmarks;
+DROP TRIGGER IF EXISTS landmarks_changes_update ON landmarks;
+DROP TRIGGER IF EXISTS landmarks_changes_delete ON landmarks;
+DROP TRIGGER IF EXISTS landmarks_changes_truncate ON landmarks;
+CREATE TRIGGER landmarks_changes_insert AFTER INSERT ON landmarks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER landmarks_changes_update AFTER UPDATE ON landmarks
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER landmarks_changes_delete AFTER DELETE ON landmarks
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER landmarks_changes_truncate AFTER TRUNCATE ON landmarks
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+DROP TRIGGER IF EXISTS visitors_changes_insert ON visitors;
+DROP TRIGGER IF EXISTS visitors_changes_update ON visitors;
+DROP TRIGGER IF EXISTS visitors_changes_delete ON visitors;
+DROP TRIGGER IF EXISTS visitors_changes_truncate ON visitors;
+CREATE TRIGGER visitors_changes_insert AFTER INSERT ON visitors
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER visitors_changes_update AFTER UPDATE ON visitors
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER visitors_changes_delete AFTER DELETE ON visitors
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER visitors_changes_truncate AFTER TRUNCATE ON visitors
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+DROP TRIGGER IF EXISTS reviews_changes_insert ON reviews;
+DROP TRIGGER IF EXISTS reviews_changes_update ON reviews;
+DROP TRIGGER IF EXISTS reviews_changes_delete ON reviews;
+DROP TRIGGER IF EXISTS reviews_changes_truncate ON reviews;
+CREATE TRIGGER reviews_changes_insert AFTER INSERT ON reviews
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER reviews_changes_update AFTER UPDATE ON reviews
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER reviews_changes_delete AFTER DELETE ON reviews
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER reviews_changes_truncate AFTER TRUNCATE ON reviews
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+DROP TRIGGER IF EXISTS routes_changes_insert ON routes;
+DROP TRIGGER IF EXISTS routes_changes_update ON routes;
+DROP TRIGGER IF EXISTS routes_changes_delete ON routes;
+DROP TRIGGER IF EXISTS routes_changes_truncate ON routes;
+CREATE TRIGGER routes_changes_insert AFTER INSERT ON routes
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER routes_changes_update AFTER UPDATE ON routes
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER routes_changes_delete AFTER DELETE ON routes
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER routes_changes_truncate AFTER TRUNCATE ON routes
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+DROP TRIGGER IF EXISTS regions_changes_insert ON regions;
+DROP TRIGGER IF EXISTS regions_changes_update ON regions;
+DROP TRIGGER IF EXISTS regions_changes_delete ON regions;
+DROP TRIGGER IF EXISTS regions_changes_truncate ON regions;
+CREATE TRIGGER regions_changes_insert AFTER INSERT ON regions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER regions_changes_update AFTER UPDATE ON regions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER regions_changes_delete AFTER DELETE ON regions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+CREATE TRIGGER regions_changes_truncate AFTER TRUNCATE ON regions
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+"""),
+    # Replaces the partitioning functions with ones that add the primary keys
+    (10, "primary keys on the visitors and reviews partitions", """
+-- Create the monthly partitions of ``parent`` from first_month to last_month
+-- that do not exist yet, moving any of their rows out of the DEFAULT partition.
+CREATE OR REPLACE FUNCTION ensure_month_partitions(parent text, first_month date, last_month date)
+RETURNS integer AS $$
+DECLARE
+    key text := substring(pg_get_partkeydef(parent::regclass) from 'RANGE \\((\\w+)\\)');
+    columns text;
+    month date;
+    next_month date;
+    partition_name text;
+    created integer := 0;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns
+    FROM pg_attribute
+    WHERE attrelid = parent::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    FOR month IN
+        SELECT generate_series(date_trunc('month', first_month), date_trunc('month', last_month),
+                               interval '1 month')::date
+    LOOP
+        partition_name := format('%s_y%sm%s', parent, to_char(month, 'YYYY'), to_char(month, 'MM'));
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        next_month := (month + interval '1 month')::date;
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED)',
+                       partition_name, parent);
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id)', partition_name);
+        EXECUTE format('WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING %s) '
+                       'INSERT INTO %I (%s) SELECT %s FROM moved',
+                       parent || '_default', key, month, key, next_month, columns,
+                       partition_name, columns, columns);
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       parent, partition_name, month, next_month);
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Swap a plain table for a partitioned one with the same columns and rows.
+-- Indexes and triggers are recreated by the caller once the rows are in.
+CREATE OR REPLACE FUNCTION partition_by_month(parent text, key text) RETURNS void AS $$
+DECLARE
+    old_name text := parent || '_unpartitioned';
+    seq text := pg_get_serial_sequence(parent, 'id');
+    columns text;
+    first_month date;
+    last_month date;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(parent)) <> 'r' THEN
+        RETURN;
+    END IF;
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', parent, old_name);
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED) '
+                   'PARTITION BY RANGE (%I)', parent, old_name, key);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', parent || '_default', parent);
+    EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id)', parent || '_default');
+    EXECUTE format('SELECT min(%I), max(%I) FROM %I', key, key, old_name) INTO first_month, last_month;
+    PERFORM ensure_month_partitions(parent, COALESCE(first_month, current_date),
+                                    GREATEST(last_month, current_date));
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns
+    FROM pg_attribute
+    WHERE attrelid = old_name::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM %I', parent, columns, columns, old_name);
+    -- The id sequence belongs to the old table and would be dropped with it
+    IF seq IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', seq);
+    END IF;
+    EXECUTE format('DROP TABLE %I', old_name);
+    IF seq IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.id', seq, parent);
+    END IF;
+    EXECUTE format('ALTER TABLE %I ADD FOREIGN KEY (landmark_id) REFERENCES landmarks(id)', parent);
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    part regclass;
+BEGIN
+    FOR part IN
+        SELECT i.inhrelid::regclass
+        FROM pg_inherits i
+        WHERE i.inhparent IN ('visitors'::regclass, 'reviews'::regclass)
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c
+                          WHERE c.conrelid = i.inhrelid AND c.contype = 'p')
+    LOOP
+        EXECUTE format('ALTER TABLE %s ADD PRIMARY KEY (id)', part);
+    END LOOP;
+END;
+$$;
+"""),
+    # Replaces the change triggers' function so that it also bumps table_versions
+    (11, "table_versions bumped by the change triggers", """
+-- One row per base table, bumped by the transactions that change it, so all
+-- app processes derive the same HTTP validators from it. A writer locks its
+-- table's row from its first write to the table until it commits.
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name text PRIMARY KEY,
+    version bigint NOT NULL,
+    changed_at timestamptz NOT NULL
+);
+INSERT INTO table_versions
+SELECT name, 1, now()
+FROM unnest(ARRAY['countries', 'cities', 'landmarks', 'visitors',
+                  'reviews', 'routes', 'regions']) AS name
+ON CONFLICT (table_name) DO NOTHING;
+
+-- Publish a change event, and bump the table's version once per transaction:
+-- later statements in the same transaction would only rewrite the row it
+-- already holds locked. The marker is a transaction-local setting.
+CREATE OR REPLACE FUNCTION table_changed(changed_table text, op text, ids integer[]) RETURNS void AS $$
+BEGIN
+    IF current_setting('table_versions.' || changed_table, true) IS DISTINCT FROM txid_current()::text THEN
+        INSERT INTO table_versions VALUES (changed_table, 1, now())
+        ON CONFLICT (table_name) DO UPDATE
+        SET version = table_versions.version + 1, changed_at = now();
+        PERFORM set_config('table_versions.' || changed_table, txid_current()::text, true);
+    END IF;
+    PERFORM pg_notify('spatial_changes', json_build_object(
+        'table', changed_table, 'op', op, 'ids', ids)::text);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_change() RETURNS trigger AS $$
+DECLARE
+    ids integer[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        ids := ARRAY(SELECT id FROM old_rows LIMIT 100 + 1);
+    ELSIF TG_OP <> 'TRUNCATE' THEN
+        ids := ARRAY(SELECT id FROM new_rows LIMIT 100 + 1);
+    END IF;
+    -- Statements that matched no rows change nothing
+    IF cardinality(ids) = 0 THEN
+        RETURN NULL;
+    END IF;
+    PERFORM table_changed(TG_TABLE_NAME, lower(TG_OP),
+                          CASE WHEN cardinality(ids) <= 100 THEN ids END);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""),
+]
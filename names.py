@@ -0,0 +1,186 @@
+"""In-process dictionary from landmark and city names to their ids.
+
+Loaded in one pass over both tables and reloaded once older than
+SPATIAL_NAME_CACHE_MAX_AGE seconds, so the query functions can filter on
+indexed ids instead of joining on names in every statement. Lookups ignore
+case. A name that is not in the dictionary is looked up in the database, so
+rows added since the last load are still found. Names shared by several rows
+resolve to all of their ids and are listed by ambiguous_names().
+
+Usage: python names.py report   # list ambiguous landmark and city names
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+from db import get_cursor
+from statements import execute
+
+NAME_CACHE_ENABLED = os.environ.get("SPATIAL_NAME_CACHE", "1") != "0"
+MAX_AGE = float(os.environ.get("SPATIAL_NAME_CACHE_MAX_AGE", "300"))
+
+TABLES = ("landmarks", "cities")
+
+
+def name_key(name):
+    """Dictionary key for a name; matches lower() in SQL for the common cases."""
+    return name.strip().lower()
+
+
+class NameDirectory:
+    """Ids by lower-cased name for every landmark and city."""
+
+    def __init__(self, rows):
+        # rows: {table: [(id, name), ...]}
+        self.ids = {table: {} for table in TABLES}
+        self.keys_by_id = {table: {} for table in TABLES}
+        for table, table_rows in rows.items():
+            for row_id, name in table_rows:
+                key = name_key(name)
+                self.ids[table].setdefault(key, []).append(row_id)
+                self.keys_by_id[table][row_id] = key
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls):
+        rows = {}
+        with get_cursor(readonly=True) as cursor:
+            for table in TABLES:
+                execute(cursor, f"all_{table}_names")
+                rows[table] = cursor.fetchall()
+        logging.info("Name directory loaded "
+                     + ", ".join(f"{len(table_rows)} {table}" for table, table_rows in rows.items()) + ".")
+        return cls(rows)
+
+    def get(self, table, name):
+        """Ids of ``table`` rows called ``name``, or None if it is not in the directory."""
+        return self.ids[table].get(name_key(name))
+
+    def update(self, table, ids, rows):
+        """Replace the entries for ``ids`` with ``rows`` [(id, name), ...], their current state.
+
+        Lists are replaced rather than mutated, so concurrent get() calls see
+        either the old or the new ids.
+        """
+        by_name, keys_by_id = self.ids[table], self.keys_by_id[table]
+        for row_id in ids:
+            key = keys_by_id.pop(row_id, None)
+            if key is None:
+                continue
+            remaining = [i for i in by_name.get(key, ()) if i != row_id]
+            if remaining:
+                by_name[key] = remaining
+            else:
+                by_name.pop(key, None)
+        for row_id, name in rows:
+            key = name_key(name)
+            by_name[key] = by_name.get(key, []) + [row_id]
+            keys_by_id[row_id] = key
+
+    def ambiguous(self):
+        """{table: {name: [id, ...]}} for names shared by more than one row."""
+        return {table: {name: ids for name, ids in by_name.items() if len(ids) > 1}
+                for table, by_name in self.ids.items()}
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_directory():
+    """Return the shared directory, loading it on first use or once it exceeds MAX_AGE."""
+    global _directory
+    directory = _directory
+    if directory is None or (MAX_AGE and time.monotonic() - directory.loaded_at > MAX_AGE):
+        with _directory_lock:
+            if _directory is None or _directory is directory:
+                _directory = NameDirectory.load()
+            directory = _directory
+    return directory
+
+
+def refresh_names():
+    """Force a reload, e.g. after landmarks or cities were renamed, added or deleted."""
+    global _directory
+    with _directory_lock:
+        _directory = NameDirectory.load()
+    return _directory
+
+
+def apply_changes(table, ids):
+    """Bring ``table``'s entries up to date after the rows ``ids`` changed; None means any row.
+
+    Only a directory that is already loaded is touched; with unknown ids it
+    is dropped and reloaded on next use.
+    """
+    global _directory
+    if _directory is None:
+        return
+    if ids is None:
+        with _directory_lock:
+            _directory = None
+        return
+    # From the primary: a replica may not have replayed the change yet
+    with get_cursor() as cursor:
+        execute(cursor, f"{table}_names_by_ids", (list(ids),))
+        rows = cursor.fetchall()
+    with _directory_lock:
+        if _directory is not None:
+            _directory.update(table, ids, rows)
+
+
+def warm_names():
+    """Load the directory ahead of the first request; failures are only logged."""
+    if not NAME_CACHE_ENABLED:
+        return
+    try:
+        get_directory()
+    except Exception as e:
+        logging.error(f"Error warming the name directory: {e}")
+
+
+def resolve_ids(table, name):
+    """Ids of the ``table`` rows whose name matches ``name`` case-insensitively."""
+    if NAME_CACHE_ENABLED:
+        ids = get_directory().get(table, name)
+        if ids is not None:
+            return ids
+    with get_cursor(readonly=True) as cursor:
+        execute(cursor, f"{table}_ids_by_name", (name,))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def resolve_id(table, name):
+    """The single id called ``name``; None if there is none, ValueError if there are several."""
+    ids = resolve_ids(table, name)
+    if len(ids) > 1:
+        raise ValueError(f"Ambiguous {table} name {name!r} matches ids {sorted(ids)}")
+    return ids[0] if ids else None
+
+
+def resolve_ids_many(table, names):
+    """Parallel (names, ids) lists pairing each of ``names`` with each of its resolve_ids()."""
+    pairs = [(name, row_id) for name in names for row_id in resolve_ids(table, name)]
+    return [name for name, _ in pairs], [row_id for _, row_id in pairs]
+
+
+def ambiguous_names():
+    return get_directory().ambiguous()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Inspect the landmark and city name directory.")
+    parser.add_argument("command", choices=["report"])
+    parser.parse_args()
+    report = ambiguous_names()
+    for table, names in report.items():
+        print(f"{table}: {len(names)} ambiguous name(s)")
+        for name, ids in sorted(names.items()):
+            print(f"  {name!r}: ids {sorted(ids)}")
+
+
+if __name__ == "__main__":
+    main()
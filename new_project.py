@@ -1,156 +1,224 @@
-import psycopg2
-from psycopg2 import sql
 import logging
-from colorama import Fore
+import os
 
-# Database connection
+from cache import cached, skip_caching
+from db import get_cursor
+from names import resolve_ids
+from queries import KNN_CANDIDATE_FACTOR
+from spatial_index import get_index, memory_backend_enabled
+from statements import execute
 
-def connect_to_db():
-    try:
-        conn = psycopg2.connect(
-            dbname="spatialproject",
-            user="mahi",
-            password="mahi",
-            host="localhost",
-            port="5432",
-        )
-        return conn
-    except Exception as e:
-        logging.error(f"Database connection failed: {e}")
-        return None
+# Corridor defaults for the route queries, in metres
+ROUTE_BUFFER_M = float(os.environ.get("SPATIAL_ROUTE_BUFFER_M", "100"))
+# Long routes are split into pieces of segments this long (0 = never)
+ROUTE_SEGMENT_M = float(os.environ.get("SPATIAL_ROUTE_SEGMENT_M", "10000"))
 
 # Query functions
 
 def find_neighboring_cities(city_name, radius_km):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT c2.name
-            FROM cities c1
-            JOIN cities c2 ON c1.id != c2.id
-            WHERE c1.name = %s AND ST_DWithin(c1.location, c2.location, %s);
-        """
-        cursor.execute(query, (city_name, radius_km * 1000))
-        cities = cursor.fetchall()
-        conn.close()
-        return cities
+        if memory_backend_enabled():
+            return get_index().neighboring_cities(city_name, radius_km * 1000)
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "find_neighboring_cities", (city_name, radius_km * 1000))
+            cities = cursor.fetchall()
+            return cities
     except Exception as e:
         logging.error(f"Error in find_neighboring_cities: {e}")
         return []
 
-def find_landmarks_along_route(route_id):
+def find_landmarks_along_route(route_id, buffer_m=ROUTE_BUFFER_M, segment_m=ROUTE_SEGMENT_M):
+    """(name, position along the route 0-1, metres from the route), in route order."""
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT l.name
-            FROM landmarks l
-            JOIN routes r ON ST_Intersects(l.location, r.path)
-            WHERE r.id = %s;
-        """
-        cursor.execute(query, (route_id,))
-        landmarks = cursor.fetchall()
-        conn.close()
-        return landmarks
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "landmarks_along_routes", {
+                "route_ids": [int(route_id)],
+                "buffer_m": buffer_m,
+                "segment_m": segment_m or None,
+            })
+            landmarks = [row[1:] for row in cursor.fetchall()]
+            return landmarks
     except Exception as e:
         logging.error(f"Error in find_landmarks_along_route: {e}")
         return []
 
+def find_landmarks_along_routes(route_ids=None, buffer_m=ROUTE_BUFFER_M, segment_m=ROUTE_SEGMENT_M):
+    """find_landmarks_along_route for many routes (every route by default) in one statement."""
+    try:
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "landmarks_along_routes", {
+                "route_ids": None if route_ids is None else [int(route_id) for route_id in route_ids],
+                "buffer_m": buffer_m,
+                "segment_m": segment_m or None,
+            })
+            routes = {int(route_id): [] for route_id in route_ids or ()}
+            for route_id, *landmark in cursor.fetchall():
+                routes.setdefault(route_id, []).append(tuple(landmark))
+            return routes
+    except Exception as e:
+        logging.error(f"Error in find_landmarks_along_routes: {e}")
+        return {}
+
+@cached(ttl=600, tables=("landmarks", "cities"))
 def calculate_bounding_box(city_name):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT ST_Extent(l.location) AS bounding_box
-            FROM landmarks l
-            JOIN cities c ON l.city_id = c.id
-            WHERE c.name = %s;
-        """
-        cursor.execute(query, (city_name,))
-        bounding_box = cursor.fetchone()
-        conn.close()
-        return bounding_box[0] if bounding_box else None
+        city_ids = resolve_ids("cities", city_name)
+        if not city_ids:
+            return None
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "calculate_bounding_box", (city_ids,))
+            bounding_box = cursor.fetchone()
+            return bounding_box[0] if bounding_box else None
     except Exception as e:
         logging.error(f"Error in calculate_bounding_box: {e}")
+        skip_caching()
         return None
 
 def find_closest_landmark(lat, lon):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT name, ST_Distance(location, ST_SetSRID(ST_Point(%s, %s), 4326)) AS distance
-            FROM landmarks
-            ORDER BY distance ASC
-            LIMIT 1;
-        """
-        cursor.execute(query, (lon, lat))  # Longitude first, latitude second
-        landmark = cursor.fetchone()
-        conn.close()
-        return landmark
+        if memory_backend_enabled():
+            return get_index().closest_landmark(lat, lon)
+        landmarks = find_nearest_landmarks(lat, lon, k=1)
+        return landmarks[0] if landmarks else None
     except Exception as e:
         logging.error(f"Error in find_closest_landmark: {e}")
         return None
 
+def find_nearest_landmarks(lat, lon, k=5, max_distance_m=None, landmark_type=None):
+    try:
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "find_nearest_landmarks", {
+                "lon": lon,
+                "lat": lat,
+                "k": k,
+                "candidates": k * KNN_CANDIDATE_FACTOR,
+                "max_distance": max_distance_m,
+                "landmark_type": landmark_type,
+            })
+            landmarks = cursor.fetchall()
+            return landmarks
+    except Exception as e:
+        logging.error(f"Error in find_nearest_landmarks: {e}")
+        return []
+
+def find_nearest_landmarks_many(points, k=1, max_distance_m=None, landmark_type=None):
+    """Resolve many (lat, lon) points in one statement; returns one list per point, in order."""
+    points = list(points)
+    try:
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "find_nearest_landmarks_many", {
+                "lats": [lat for lat, _ in points],
+                "lons": [lon for _, lon in points],
+                "k": k,
+                "candidates": k * KNN_CANDIDATE_FACTOR,
+                "max_distance": max_distance_m,
+                "landmark_type": landmark_type,
+            })
+            results = [[] for _ in points]
+            for ord_, name, distance in cursor.fetchall():
+                results[ord_ - 1].append((name, distance))
+            return results
+    except Exception as e:
+        logging.error(f"Error in find_nearest_landmarks_many: {e}")
+        return []
+
 def is_landmark_in_region(landmark_name, region_id):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT EXISTS(
-                SELECT 1
-                FROM landmarks l
-                JOIN regions r ON ST_Within(l.location, r.boundary)
-                WHERE l.name = %s AND r.id = %s
-            ) AS is_inside;
-        """
-        cursor.execute(query, (landmark_name, region_id))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0]
+        landmark_ids = resolve_ids("landmarks", landmark_name)
+        if not landmark_ids:
+            return False
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "is_landmark_in_region", (landmark_ids, region_id))
+            result = cursor.fetchone()
+            return result[0]
     except Exception as e:
         logging.error(f"Error in is_landmark_in_region: {e}")
         return False
 
+@cached(ttl=600, tables=("landmarks", "cities"))
 def find_city_landmark_center(city_name):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT ST_Centroid(ST_Collect(l.location)) AS center
-            FROM landmarks l
-            JOIN cities c ON l.city_id = c.id
-            WHERE c.name = %s;
-        """
-        cursor.execute(query, (city_name,))
-        center = cursor.fetchone()
-        conn.close()
-        return center[0] if center else None
+        city_ids = resolve_ids("cities", city_name)
+        if not city_ids:
+            return None
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "find_city_landmark_center", (city_ids,))
+            center = cursor.fetchone()
+            return center[0] if center else None
     except Exception as e:
         logging.error(f"Error in find_city_landmark_center: {e}")
+        skip_caching()
         return None
 
+@cached(ttl=3600, tables=("regions",))
 def find_intersection_area(region_id1, region_id2):
     try:
-        conn = connect_to_db()
-        cursor = conn.cursor()
-        query = """
-            SELECT ST_Area(ST_Intersection(r1.boundary, r2.boundary)) AS intersection_area
-            FROM regions r1, regions r2
-            WHERE r1.id = %s AND r2.id = %s;
-        """
-        cursor.execute(query, (region_id1, region_id2))
-        intersection_area = cursor.fetchone()
-        conn.close()
-        return intersection_area[0] if intersection_area else None
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "find_intersection_area", (region_id1, region_id2))
+            intersection_area = cursor.fetchone()
+            return intersection_area[0] if intersection_area else None
     except Exception as e:
         logging.error(f"Error in find_intersection_area: {e}")
+        skip_caching()
         return None
 
+def find_regions_for_landmarks(landmark_names=None):
+    """{landmark name: [ids of every region containing it]} in one spatial join; all landmarks by default."""
+    try:
+        landmark_ids = None
+        if landmark_names is not None:
+            ids_by_name = {name: resolve_ids("landmarks", name) for name in dict.fromkeys(landmark_names)}
+            landmark_ids = sorted({i for ids in ids_by_name.values() for i in ids})
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "regions_for_landmarks", {"landmark_ids": landmark_ids})
+            regions_by_id = {}
+            regions_by_name = {}
+            for landmark_id, name, region_id in cursor.fetchall():
+                regions_by_id.setdefault(landmark_id, []).append(region_id)
+                regions_by_name.setdefault(name, []).append(region_id)
+        if landmark_names is None:
+            return {name: sorted(set(regions)) for name, regions in regions_by_name.items()}
+        return {name: sorted({r for i in ids for r in regions_by_id.get(i, [])})
+                for name, ids in ids_by_name.items()}
+    except Exception as e:
+        logging.error(f"Error in find_regions_for_landmarks: {e}")
+        return {}
+
+def find_regions_for_points(points):
+    """Ids of the regions containing each (lat, lon) point, one list per point, in order."""
+    points = list(points)
+    try:
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "regions_for_points", ([lat for lat, _ in points], [lon for _, lon in points]))
+            results = [[] for _ in points]
+            for ord_, region_id in cursor.fetchall():
+                results[ord_ - 1].append(region_id)
+            return results
+    except Exception as e:
+        logging.error(f"Error in find_regions_for_points: {e}")
+        return []
+
+@cached(ttl=3600, tables=("regions",))
+def region_overlap_matrix():
+    """{region_id: {region_id: overlap in m²}} for every intersecting pair, both ways round."""
+    try:
+        with get_cursor(readonly=True) as cursor:
+            execute(cursor, "region_overlap_matrix")
+            matrix = {}
+            for region_id1, region_id2, area in cursor.fetchall():
+                matrix.setdefault(region_id1, {})[region_id2] = area
+                matrix.setdefault(region_id2, {})[region_id1] = area
+            return matrix
+    except Exception as e:
+        logging.error(f"Error in region_overlap_matrix: {e}")
+        skip_caching()
+        return {}
+
 # Main menu
 
 def main():
+    from colorama import Fore  # only the interactive menu needs it
+
     while True:
         print(Fore.CYAN + "Spatial Database Application")
         print(Fore.CYAN + "1. Find neighboring cities")
@@ -160,6 +228,7 @@ def main():
         print(Fore.CYAN + "5. Check if a landmark is inside a specific region")
         print(Fore.CYAN + "6. Find the center of all landmarks in a city")
         print(Fore.CYAN + "7. Find the intersection area between two regions")
+        print(Fore.CYAN + "8. Find the k nearest landmarks to a given point")
         print(Fore.CYAN + "0. Exit")
 
         choice = input(Fore.YELLOW + "Enter your choice: ")
@@ -177,13 +246,14 @@ def main():
 
         elif choice == "2":
             route_id = input(Fore.YELLOW + "Enter the route ID: ")
-            landmarks = find_landmarks_along_route(route_id)
+            buffer_m = input(Fore.YELLOW + f"Enter the corridor width in meters [{ROUTE_BUFFER_M:g}]: ")
+            landmarks = find_landmarks_along_route(route_id, float(buffer_m) if buffer_m else ROUTE_BUFFER_M)
             if not landmarks:
                 print(Fore.RED + "No landmarks found along the route.")
             else:
                 print(Fore.GREEN + "Landmarks along the route:")
-                for landmark in landmarks:
-                    print(Fore.GREEN + f"- {landmark[0]}")
+                for name, position, distance in landmarks:
+                    print(Fore.GREEN + f"- {name} ({position:.0%} along, {distance:.0f} m off the route)")
 
         elif choice == "3":
             city_name = input(Fore.YELLOW + "Enter the city name: ")
@@ -223,6 +293,18 @@ def main():
             else:
                 print(Fore.GREEN + f"Intersection area: {intersection_area} square meters")
 
+        elif choice == "8":
+            lat = float(input(Fore.YELLOW + "Enter latitude: "))
+            lon = float(input(Fore.YELLOW + "Enter longitude: "))
+            k = int(input(Fore.YELLOW + "How many landmarks? "))
+            landmarks = find_nearest_landmarks(lat, lon, k=k)
+            if not landmarks:
+                print(Fore.RED + "No landmark found nearby.")
+            else:
+                print(Fore.GREEN + f"{len(landmarks)} nearest landmarks:")
+                for name, distance in landmarks:
+                    print(Fore.GREEN + f"- {name} ({distance:.2f} meters away)")
+
         elif choice == "0":
             print(Fore.CYAN + "Exiting the application. Goodbye!")
             break
@@ -230,4 +312,5 @@ def main():
     else:
         print(Fore.RED + "Invalid choice. Please try again.")
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Monthly range partitions for visitors (visit_date) and reviews (review_date).
+
+Each table has one partition per calendar month, named e.g.
+visitors_y2026m10, plus a DEFAULT partition that catches NULL dates and
+months without a partition yet. Date-range queries (see the *_between
+statements in queries.py) only read the partitions they overlap, so their
+cost follows the size of the range rather than of the whole history.
+
+A primary key on a partitioned table must include the partition key, which
+may be NULL here, so each partition has its own primary key on id instead.
+Ids come from the one shared sequence, so they stay unique across partitions
+unless a row is inserted with an explicit id.
+
+maintain() is meant to run daily, e.g. from cron. It
+- creates partitions for the coming SPATIAL_PARTITION_MONTHS_AHEAD months;
+- moves rows that landed in the DEFAULT partition into new partitions for
+  their months;
+- with SPATIAL_PARTITION_RETENTION_MONTHS set, drops partitions older than
+  that many months. Their rows are first subtracted from landmark_stats,
+  which no DELETE trigger would otherwise do, and a change event without
+  ids is sent for the table so caches drop what they read from it.
+
+Usage: python partitions.py maintain
+       python partitions.py status
+"""
+import argparse
+import logging
+import os
+import re
+from datetime import date
+
+from changes import TABLE_CHANGED_SQL
+from db import get_connection
+
+# table -> partition key
+PARTITIONED_TABLES = {"visitors": "visit_date", "reviews": "review_date"}
+MONTHS_AHEAD = int(os.environ.get("SPATIAL_PARTITION_MONTHS_AHEAD", "3"))
+# Months of history kept; 0 keeps every partition
+RETENTION_MONTHS = int(os.environ.get("SPATIAL_PARTITION_RETENTION_MONTHS", "0"))
+
+PARTITION_NAME = re.compile(r"_y(\d{4})m(\d{2})$")
+
+# Current partitioning functions. Migrations 8 and 10 installed copies of
+# them (see migrations.py); a change here needs a new migration to reach
+# existing databases.
+SCHEMA_SQL = """
+-- Create the monthly partitions of ``parent`` from first_month to last_month
+-- that do not exist yet, moving any of their rows out of the DEFAULT partition.
+CREATE OR REPLACE FUNCTION ensure_month_partitions(parent text, first_month date, last_month date)
+RETURNS integer AS $$
+DECLARE
+    key text := substring(pg_get_partkeydef(parent::regclass) from 'RANGE \\((\\w+)\\)');
+    columns text;
+    month date;
+    next_month date;
+    partition_name text;
+    created integer := 0;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns
+    FROM pg_attribute
+    WHERE attrelid = parent::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    FOR month IN
+        SELECT generate_series(date_trunc('month', first_month), date_trunc('month', last_month),
+                               interval '1 month')::date
+    LOOP
+        partition_name := format('%s_y%sm%s', parent, to_char(month, 'YYYY'), to_char(month, 'MM'));
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        next_month := (month + interval '1 month')::date;
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED)',
+                       partition_name, parent);
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id)', partition_name);
+        EXECUTE format('WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING %s) '
+                       'INSERT INTO %I (%s) SELECT %s FROM moved',
+                       parent || '_default', key, month, key, next_month, columns,
+                       partition_name, columns, columns);
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       parent, partition_name, month, next_month);
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Swap a plain table for a partitioned one with the same columns and rows.
+-- Indexes and triggers are recreated by the caller once the rows are in.
+CREATE OR REPLACE FUNCTION partition_by_month(parent text, key text) RETURNS void AS $$
+DECLARE
+    old_name text := parent || '_unpartitioned';
+    seq text := pg_get_serial_sequence(parent, 'id');
+    columns text;
+    first_month date;
+    last_month date;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(parent)) <> 'r' THEN
+        RETURN;
+    END IF;
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', parent, old_name);
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED) '
+                   'PARTITION BY RANGE (%I)', parent, old_name, key);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', parent || '_default', parent);
+    EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id)', parent || '_default');
+    EXECUTE format('SELECT min(%I), max(%I) FROM %I', key, key, old_name) INTO first_month, last_month;
+    PERFORM ensure_month_partitions(parent, COALESCE(first_month, current_date),
+                                    GREATEST(last_month, current_date));
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns
+    FROM pg_attribute
+    WHERE attrelid = old_name::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM %I', parent, columns, columns, old_name);
+    -- The id sequence belongs to the old table and would be dropped with it
+    IF seq IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', seq);
+    END IF;
+    EXECUTE format('DROP TABLE %I', old_name);
+    IF seq IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.id', seq, parent);
+    END IF;
+    EXECUTE format('ALTER TABLE %I ADD FOREIGN KEY (landmark_id) REFERENCES landmarks(id)', parent);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# Subtract a partition's rows from landmark_stats before it is dropped
+STATS_ADJUST_SQL = {
+    "visitors": """
+        UPDATE landmark_stats s
+        SET visit_count = s.visit_count - d.n
+        FROM (SELECT landmark_id, COUNT(*) AS n
+              FROM {partition} WHERE landmark_id IS NOT NULL
+              GROUP BY landmark_id) d
+        WHERE s.landmark_id = d.landmark_id;
+    """,
+    "reviews": """
+        UPDATE landmark_stats s
+        SET rating_sum = s.rating_sum - d.total, rating_count = s.rating_count - d.n
+        FROM (SELECT landmark_id, COALESCE(SUM(rating), 0) AS total, COUNT(rating) AS n
+              FROM {partition} WHERE landmark_id IS NOT NULL
+              GROUP BY landmark_id) d
+        WHERE s.landmark_id = d.landmark_id;
+    """,
+}
+
+
+def add_months(day, months):
+    """First day of the month ``months`` after ``day``'s month."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partitions(cursor, table):
+    """{month: partition name} of the monthly partitions of ``table``."""
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass;
+    """, (table,))
+    result = {}
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME.search(name)
+        if match:
+            result[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return result
+
+
+def ensure_partitions(first, last, tables=tuple(PARTITIONED_TABLES)):
+    """Create the partitions for every month from ``first`` to ``last``; returns how many were new."""
+    created = 0
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            for table in tables:
+                cursor.execute("SELECT ensure_month_partitions(%s, %s, %s);", (table, first, last))
+                created += cursor.fetchone()[0]
+    return created
+
+
+def empty_default_partitions():
+    """Move dated rows out of the DEFAULT partitions into new monthly ones; returns partitions created."""
+    created = 0
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            for table, key in PARTITIONED_TABLES.items():
+                cursor.execute(f"SELECT DISTINCT date_trunc('month', {key})::date "
+                               f"FROM {table}_default WHERE {key} IS NOT NULL ORDER BY 1;")
+                for (month,) in cursor.fetchall():
+                    cursor.execute("SELECT ensure_month_partitions(%s, %s, %s);", (table, month, month))
+                    created += cursor.fetchone()[0]
+    return created
+
+
+def maintain(today=None, months_ahead=MONTHS_AHEAD, retention_months=RETENTION_MONTHS):
+    """Create upcoming partitions, empty the DEFAULT partitions and apply retention."""
+    today = today or date.today()
+    summary = {"created": 0, "dropped": []}
+    summary["created"] += ensure_partitions(add_months(today, 0), add_months(today, months_ahead))
+    summary["created"] += empty_default_partitions()
+    if retention_months:
+        cutoff = add_months(today, -retention_months)
+        for table in PARTITIONED_TABLES:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    dropped = []
+                    for month, name in sorted(partitions(cursor, table).items()):
+                        if month >= cutoff:
+                            break
+                        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name};")
+                        cursor.execute(STATS_ADJUST_SQL[table].format(partition=name))
+                        cursor.execute(f"DROP TABLE {name};")
+                        dropped.append(name)
+                    if dropped:
+                        # Dropping a partition fires no DELETE trigger
+                        cursor.execute(TABLE_CHANGED_SQL, (table,))
+                    summary["dropped"].extend(dropped)
+    logging.info(f"Partitions: {summary['created']} created, {len(summary['dropped'])} dropped.")
+    return summary
+
+
+def partition_status():
+    """(table, partition, estimated rows) for every partition, oldest first, DEFAULT last."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT p.relname, c.relname, c.reltuples::bigint
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = ANY(%s)
+                ORDER BY p.relname, c.relname LIKE '%%\\_default', c.relname;
+            """, (list(PARTITIONED_TABLES),))
+            return cursor.fetchall()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Maintain the monthly visitors/reviews partitions.")
+    parser.add_argument("command", choices=["maintain", "status"])
+    args = parser.parse_args()
+    if args.command == "maintain":
+        summary = maintain()
+        for name in summary["dropped"]:
+            print(f"dropped {name}")
+    else:
+        for table, name, rows in partition_status():
+            print(f"{table:<10} {name:<24} {max(rows, 0):>12}")
+
+
+if __name__ == "__main__":
+    main()
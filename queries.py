@@ -0,0 +1,484 @@
+"""SQL behind the /query endpoint, shared by app.py and async_app.py."""
+import base64
+import json
+import re
+
+# query_type -> SQL with positional %s parameters
+QUERY_SQL = {
+    "landmarks_in_city": """
+        SELECT l.name
+        FROM landmarks l
+        JOIN cities c ON l.city_id = c.id
+        WHERE c.name = %s;
+    """,
+    "landmarks_in_radius": """
+        SELECT l.name
+        FROM landmarks l
+        JOIN cities c ON l.city_id = c.id
+        WHERE c.name = %s AND ST_DWithin(c.location::geography, l.location::geography, %s);
+    """,
+    "reviews_for_landmark": """
+        SELECT r.review_text, r.rating, r.review_date
+        FROM reviews r
+        JOIN landmarks l ON r.landmark_id = l.id
+        WHERE l.name = %s;
+    """,
+    "landmarks_of_type": """
+        SELECT l.name
+        FROM landmarks l
+        JOIN cities c ON l.city_id = c.id
+        WHERE c.name = %s AND l.type = %s;
+    """,
+    "landmarks_by_rating": """
+        SELECT l.name
+        FROM landmarks l
+        JOIN reviews r ON l.id = r.landmark_id
+        WHERE r.rating = %s;
+    """,
+    "landmarks_in_country": """
+        SELECT l.name
+        FROM landmarks l
+        JOIN cities c ON l.city_id = c.id
+        JOIN countries co ON c.country_id = co.id
+        WHERE co.name = %s;
+    """,
+    "nearby_landmarks": """
+        SELECT l.name
+        FROM landmarks l
+        JOIN landmarks ln ON ST_DWithin(l.location::geography, ln.location::geography, 1000)
+        WHERE ln.name = %s;
+    """,
+    # Distinct landmarks ranked by relevance: full-text matches on landmark
+    # names, then on reviews, then trigram (typo-tolerant) matches. Reads the
+    # columns and indexes created by search.py.
+    "landmarks_by_keyword": """
+        SELECT l.name
+        FROM (
+            SELECT m.landmark_id, MAX(m.rank) AS rank, COUNT(*) AS matches
+            FROM (
+                SELECT l.id AS landmark_id, 2 + ts_rank(l.search_document, to_tsquery('simple', %s)) AS rank
+                FROM landmarks l
+                WHERE l.search_document @@ to_tsquery('simple', %s)
+                UNION ALL
+                SELECT r.landmark_id, 1 + ts_rank(r.search_document, to_tsquery('english', %s))
+                FROM reviews r
+                WHERE r.search_document @@ to_tsquery('english', %s)
+                UNION ALL
+                SELECT l.id, similarity(l.name, %s)
+                FROM landmarks l
+                WHERE l.name %% %s
+                UNION ALL
+                SELECT r.landmark_id, word_similarity(%s, r.review_text) / 2
+                FROM reviews r
+                WHERE %s <%% r.review_text
+            ) m
+            GROUP BY m.landmark_id
+        ) m
+        JOIN landmarks l ON l.id = m.landmark_id
+        ORDER BY m.rank DESC, m.matches DESC, l.id
+        LIMIT %s;
+    """,
+}
+
+# Variants taking every input name as one text[] parameter; rows are (input, ...)
+BATCH_QUERY_SQL = {
+    "landmarks_in_city": """
+        SELECT n.name, l.name
+        FROM unnest(%s::text[]) AS n(name)
+        CROSS JOIN LATERAL (
+            SELECT l.name
+            FROM landmarks l
+            JOIN cities c ON l.city_id = c.id
+            WHERE c.name = n.name
+        ) l;
+    """,
+    "landmarks_in_radius": """
+        SELECT n.name, l.name
+        FROM unnest(%s::text[]) AS n(name)
+        CROSS JOIN LATERAL (
+            SELECT l.name
+            FROM landmarks l
+            JOIN cities c ON l.city_id = c.id
+            WHERE c.name = n.name AND ST_DWithin(c.location::geography, l.location::geography, %s)
+        ) l;
+    """,
+}
+
+# k-nearest-neighbour search. The geography GiST index orders candidates by
+# great-circle distance (<-> on geography, a sphere), which stays correct at
+# high latitudes and across the antimeridian, unlike planar <-> on degrees.
+# KNN_CANDIDATE_FACTOR * k of them are rechecked with the spheroid distance,
+# which differs from the sphere's by well under 1%, for the final order.
+KNN_CANDIDATE_FACTOR = 4
+
+KNN_SUBQUERY = """
+    SELECT c.name, c.distance
+    FROM (
+        SELECT l.id, l.name,
+               ST_Distance(l.location::geography, ST_SetSRID(ST_Point({lon}, {lat}), 4326)::geography) AS distance
+        FROM landmarks l
+        WHERE (%(landmark_type)s::text IS NULL OR l.type = %(landmark_type)s)
+          AND (%(max_distance)s::float8 IS NULL
+               OR ST_DWithin(l.location::geography, ST_SetSRID(ST_Point({lon}, {lat}), 4326)::geography,
+                             %(max_distance)s))
+        ORDER BY l.location::geography <-> ST_SetSRID(ST_Point({lon}, {lat}), 4326)::geography
+        LIMIT %(candidates)s
+    ) c
+    ORDER BY c.distance, c.id
+    LIMIT %(k)s
+"""
+
+# Every named statement used by the CLIs and the web apps. The /query types
+# keep their names, so e.g. fetch_reviews runs "reviews_for_landmark".
+STATEMENTS = dict(QUERY_SQL)
+STATEMENTS.update({
+    "landmarks_in_city_many": BATCH_QUERY_SQL["landmarks_in_city"],
+    "landmarks_in_radius_many": BATCH_QUERY_SQL["landmarks_in_radius"],
+    # Statements taking ids (or id arrays) resolved from names by names.py
+    "landmarks_in_city_ids": """
+        SELECT l.name
+        FROM landmarks l
+        WHERE l.city_id = ANY(%s);
+    """,
+    "reviews_for_landmark_ids": """
+        SELECT r.review_text, r.rating, r.review_date
+        FROM reviews r
+        WHERE r.landmark_id = ANY(%s);
+    """,
+    # Date-range variants read only the monthly partitions (partitions.py)
+    # overlapping [since, until); pass date.min/date.max for an open end.
+    "reviews_for_landmark_ids_between": """
+        SELECT r.review_text, r.rating, r.review_date
+        FROM reviews r
+        WHERE r.landmark_id = ANY(%s) AND r.review_date >= %s AND r.review_date < %s;
+    """,
+    "calculate_distance": """
+        SELECT ST_Distance(l1.location::geography, l2.location::geography) AS distance_in_meters
+        FROM landmarks l1, landmarks l2
+        WHERE l1.id = %s AND l2.id = %s;
+    """,
+    "find_visitors": """
+        SELECT v.name, v.visit_date
+        FROM visitors v
+        WHERE v.landmark_id = ANY(%s);
+    """,
+    "find_visitors_between": """
+        SELECT v.name, v.visit_date
+        FROM visitors v
+        WHERE v.landmark_id = ANY(%s) AND v.visit_date >= %s AND v.visit_date < %s;
+    """,
+    "top_visited_landmarks_between": """
+        SELECT l.name, t.visit_count
+        FROM (
+            SELECT v.landmark_id, COUNT(*) AS visit_count
+            FROM visitors v
+            WHERE v.visit_date >= %s AND v.visit_date < %s AND v.landmark_id IS NOT NULL
+            GROUP BY v.landmark_id
+            ORDER BY visit_count DESC
+            LIMIT 5
+        ) t
+        JOIN landmarks l ON l.id = t.landmark_id
+        ORDER BY t.visit_count DESC;
+    """,
+    "top_visited_landmarks": """
+        SELECT l.name, s.visit_count
+        FROM landmark_stats s
+        JOIN landmarks l ON l.id = s.landmark_id
+        ORDER BY s.visit_count DESC
+        LIMIT 5;
+    """,
+    "average_rating": """
+        SELECT SUM(s.rating_sum)::numeric / NULLIF(SUM(s.rating_count), 0) AS average_rating
+        FROM landmark_stats s
+        WHERE s.landmark_id = ANY(%s);
+    """,
+    "landmarks_no_visitors": """
+        SELECT l.name
+        FROM landmark_stats s
+        JOIN landmarks l ON l.id = s.landmark_id
+        WHERE s.visit_count = 0;
+    """,
+    # Batch statements over parallel (input name, landmark id) arrays from
+    # names.resolve_ids_many, so they match the single-name statements
+    "find_visitors_many": """
+        SELECT n.name, v.name, v.visit_date
+        FROM unnest(%s::text[], %s::int[]) AS n(name, landmark_id)
+        JOIN visitors v ON v.landmark_id = n.landmark_id;
+    """,
+    "average_rating_many": """
+        SELECT n.name, SUM(s.rating_sum)::numeric / NULLIF(SUM(s.rating_count), 0) AS average_rating
+        FROM unnest(%s::text[], %s::int[]) AS n(name, landmark_id)
+        LEFT JOIN landmark_stats s ON s.landmark_id = n.landmark_id
+        GROUP BY n.name;
+    """,
+    "find_neighboring_cities": """
+        SELECT c2.name
+        FROM cities c1
+        JOIN cities c2 ON c1.id != c2.id
+        WHERE c1.name = %s AND ST_DWithin(c1.location::geography, c2.location::geography, %s);
+    """,
+    # Landmarks within buffer_m metres of each route (all routes when
+    # route_ids is NULL), ordered by their position (0-1) along the path.
+    # With segment_m set, long routes are cut into pieces of a few
+    # segment_m-long segments so each index probe has a tight bounding box.
+    "landmarks_along_routes": """
+        WITH pieces AS (
+            SELECT r.id AS route_id, p.piece
+            FROM routes r
+            CROSS JOIN LATERAL (
+                SELECT ST_Subdivide(ST_Segmentize(r.path::geography, %(segment_m)s)::geometry, 8) AS piece
+                WHERE %(segment_m)s::float8 IS NOT NULL
+                UNION ALL
+                SELECT r.path
+                WHERE %(segment_m)s::float8 IS NULL
+            ) p
+            WHERE %(route_ids)s::int[] IS NULL OR r.id = ANY(%(route_ids)s::int[])
+        ), hits AS (
+            SELECT DISTINCT p.route_id, l.id AS landmark_id
+            FROM pieces p
+            JOIN landmarks l ON ST_DWithin(l.location::geography, p.piece::geography, %(buffer_m)s)
+        )
+        SELECT h.route_id, l.name,
+               ST_LineLocatePoint(r.path, l.location) AS position,
+               ST_Distance(l.location::geography, r.path::geography) AS distance_m
+        FROM hits h
+        JOIN routes r ON r.id = h.route_id
+        JOIN landmarks l ON l.id = h.landmark_id
+        ORDER BY h.route_id, position, distance_m, l.id;
+    """,
+    "calculate_bounding_box": """
+        SELECT ST_Extent(l.location) AS bounding_box
+        FROM landmarks l
+        WHERE l.city_id = ANY(%s);
+    """,
+    "find_nearest_landmarks": KNN_SUBQUERY.format(lon="%(lon)s", lat="%(lat)s") + ";",
+    "find_nearest_landmarks_many": """
+        SELECT p.ord, n.name, n.distance
+        FROM unnest(%(lats)s::float8[], %(lons)s::float8[]) WITH ORDINALITY AS p(lat, lon, ord)
+        CROSS JOIN LATERAL ({knn}) n
+        ORDER BY p.ord, n.distance;
+    """.format(knn=KNN_SUBQUERY.format(lon="p.lon", lat="p.lat")),
+    "is_landmark_in_region": """
+        SELECT EXISTS(
+            SELECT 1
+            FROM landmarks l
+            JOIN regions r ON ST_Within(l.location, r.boundary)
+            WHERE l.id = ANY(%s) AND r.id = %s
+        ) AS is_inside;
+    """,
+    "find_city_landmark_center": """
+        SELECT ST_Centroid(ST_Collect(l.location)) AS center
+        FROM landmarks l
+        WHERE l.city_id = ANY(%s);
+    """,
+    # Bulk point-in-region joins. Regions drive the join so each polygon is
+    # tested against its index candidates in a row and PostGIS reuses the
+    # prepared polygon between point tests.
+    "regions_for_landmarks": """
+        SELECT l.id, l.name, r.id
+        FROM regions r
+        JOIN landmarks l ON ST_Within(l.location, r.boundary)
+        WHERE %(landmark_ids)s::int[] IS NULL OR l.id = ANY(%(landmark_ids)s::int[])
+        ORDER BY l.id, r.id;
+    """,
+    "regions_for_points": """
+        SELECT p.ord, r.id
+        FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY AS p(lat, lon, ord)
+        JOIN regions r ON ST_Within(ST_SetSRID(ST_Point(p.lon, p.lat), 4326), r.boundary)
+        ORDER BY p.ord, r.id;
+    """,
+    # Overlap areas in square metres from region_overlaps (region_overlaps.py);
+    # regions that exist but do not intersect overlap by 0.
+    "find_intersection_area": """
+        SELECT COALESCE(o.area_m2, 0) AS intersection_area
+        FROM regions r1
+        CROSS JOIN regions r2
+        LEFT JOIN region_overlaps o
+               ON o.region_id1 = LEAST(r1.id, r2.id) AND o.region_id2 = GREATEST(r1.id, r2.id)
+        WHERE r1.id = %s AND r2.id = %s;
+    """,
+    "region_overlap_matrix": """
+        SELECT region_id1, region_id2, area_m2
+        FROM region_overlaps
+        ORDER BY region_id1, region_id2;
+    """,
+    # Map tiles (tiles.py): the tile_stats cells of one tile, as rows or as
+    # a Mapbox Vector Tile clipped to the tile's envelope.
+    "tile_cells": """
+        SELECT x, y, landmark_count, visit_count, rating_sum::numeric / NULLIF(rating_count, 0)
+        FROM tile_stats
+        WHERE zoom = %s AND x BETWEEN %s AND %s AND y BETWEEN %s AND %s AND landmark_count > 0
+        ORDER BY x, y;
+    """,
+    "tile_mvt": """
+        SELECT ST_AsMVT(cells, 'cells', 4096, 'geom')
+        FROM (
+            SELECT ST_AsMVTGeom(ST_TileEnvelope(zoom, x, y), ST_TileEnvelope(%s, %s, %s)) AS geom,
+                   landmark_count AS landmarks, visit_count AS visits,
+                   rating_sum::float8 / NULLIF(rating_count, 0) AS average_rating
+            FROM tile_stats
+            WHERE zoom = %s AND x BETWEEN %s AND %s AND y BETWEEN %s AND %s AND landmark_count > 0
+        ) cells;
+    """,
+    # Distance matrices (distances.py). Each side is unnest(ids, lons, lats);
+    # rows with an id use that landmark's location, the others the point.
+    "landmark_coordinates": """
+        SELECT id, ST_X(location), ST_Y(location)
+        FROM landmarks
+        WHERE id = ANY(%s) AND location IS NOT NULL;
+    """,
+    "distance_matrix": """
+        WITH o AS (
+            SELECT p.ord, COALESCE(l.location, ST_SetSRID(ST_Point(p.lon, p.lat), 4326))::geography AS geog
+            FROM unnest(%s::int[], %s::float8[], %s::float8[]) WITH ORDINALITY AS p(id, lon, lat, ord)
+            LEFT JOIN landmarks l ON l.id = p.id
+        ), d AS (
+            SELECT p.ord, COALESCE(l.location, ST_SetSRID(ST_Point(p.lon, p.lat), 4326))::geography AS geog
+            FROM unnest(%s::int[], %s::float8[], %s::float8[]) WITH ORDINALITY AS p(id, lon, lat, ord)
+            LEFT JOIN landmarks l ON l.id = p.id
+        )
+        SELECT o.ord, d.ord, ST_Distance(o.geog, d.geog)
+        FROM o CROSS JOIN d;
+    """,
+    # Name directory (names.py)
+    "all_landmarks_names": """
+        SELECT id, name FROM landmarks;
+    """,
+    "all_cities_names": """
+        SELECT id, name FROM cities;
+    """,
+    "landmarks_ids_by_name": """
+        SELECT id FROM landmarks WHERE lower(name) = lower(btrim(%s));
+    """,
+    "cities_ids_by_name": """
+        SELECT id FROM cities WHERE lower(name) = lower(btrim(%s));
+    """,
+    # Rows named in a change notification (changes.py)
+    "landmarks_names_by_ids": """
+        SELECT id, name FROM landmarks WHERE id = ANY(%s);
+    """,
+    "cities_names_by_ids": """
+        SELECT id, name FROM cities WHERE id = ANY(%s);
+    """,
+})
+
+# Unique, indexed ordering key of each query type's rows, for keyset pagination.
+# Every key column is an integer id, which decode_cursor() checks.
+QUERY_KEYS = {
+    "landmarks_in_city": ("l.id",),
+    "landmarks_in_radius": ("l.id",),
+    "reviews_for_landmark": ("r.id",),
+    "landmarks_of_type": ("l.id",),
+    "landmarks_by_rating": ("r.id",),
+    "landmarks_in_country": ("l.id",),
+    "nearby_landmarks": ("ln.id", "l.id"),
+}
+
+# Tables each query type reads, used to invalidate its cached results
+QUERY_TABLES = {
+    "landmarks_in_city": ("landmarks", "cities"),
+    "landmarks_in_radius": ("landmarks", "cities"),
+    "reviews_for_landmark": ("reviews", "landmarks"),
+    "landmarks_of_type": ("landmarks", "cities"),
+    "landmarks_by_rating": ("landmarks", "reviews"),
+    "landmarks_in_country": ("landmarks", "cities", "countries"),
+    "nearby_landmarks": ("landmarks",),
+    "landmarks_by_keyword": ("landmarks", "reviews"),
+}
+
+# Largest page a keyset-paginated /query request may ask for
+MAX_PAGE_SIZE = 10000
+
+# Landmarks returned by a keyword search unless the request sets a limit
+SEARCH_LIMIT = 20
+
+# Seconds a cached /query result stays fresh; other types use the cache default
+QUERY_CACHE_TTLS = {
+    "reviews_for_landmark": 30,
+    "landmarks_by_rating": 30,
+    "landmarks_by_keyword": 30,
+    "landmarks_in_country": 600,
+}
+
+
+def query_params(query_type, user_input, radius=None, landmark_type=None, limit=None):
+    """Positional parameters for QUERY_SQL[query_type]."""
+    if query_type == "landmarks_in_radius":
+        return (user_input, float(radius) * 1000)
+    if query_type == "landmarks_of_type":
+        return (user_input, landmark_type)
+    if query_type == "landmarks_by_rating":
+        return (int(user_input),)
+    if query_type == "landmarks_by_keyword":
+        tsquery = prefix_tsquery(user_input)
+        term = user_input.strip()
+        return (tsquery,) * 4 + (term,) * 4 + (limit or SEARCH_LIMIT,)
+    return (user_input,)
+
+
+def prefix_tsquery(keyword):
+    """to_tsquery() text matching every word of ``keyword`` as a prefix ("eiff tow" -> "eiff:* & tow:*")."""
+    return " & ".join(f"{word}:*" for word in re.findall(r"\w+", keyword))
+
+
+def batch_query_params(query_type, user_inputs, radius=None):
+    """Positional parameters for BATCH_QUERY_SQL[query_type]."""
+    names = list(dict.fromkeys(user_inputs))
+    if query_type == "landmarks_in_radius":
+        return (names, float(radius) * 1000)
+    return (names,)
+
+
+def group_batch_rows(user_inputs, rows):
+    """Turn (input, value, ...) rows into {input: [(value, ...), ...]} in input order."""
+    grouped = {name: [] for name in user_inputs}
+    for key, *values in rows:
+        grouped[key].append(tuple(values))
+    return grouped
+
+
+def to_dollar_params(sql):
+    """Rewrite %s placeholders as $1, $2, ... (and %% as %) for drivers such as asyncpg."""
+    counter = iter(range(1, sql.count("%s") + 1))
+    return re.sub(r"%%|%s", lambda m: "%" if m.group() == "%%" else f"${next(counter)}", sql)
+
+
+def paged_query_sql(query_type, after_cursor):
+    """QUERY_SQL[query_type] ordered by its key, limited, and resumed after a cursor.
+
+    Rows start with the key columns; the parameters are query_params(...),
+    then the cursor's key values (if any), then the page size.
+    """
+    keys = QUERY_KEYS[query_type]
+    sql = QUERY_SQL[query_type].rstrip().rstrip(";")
+    sql = sql.replace("SELECT ", "SELECT " + ", ".join(keys) + ", ", 1)
+    if after_cursor:
+        placeholders = ", ".join(["%s"] * len(keys))
+        sql += f" AND ({', '.join(keys)}) > ({placeholders})"
+    return sql + f" ORDER BY {', '.join(keys)} LIMIT %s;"
+
+
+def split_page(query_type, rows, limit):
+    """Strip key columns from a page of rows and build the next cursor token."""
+    width = len(QUERY_KEYS[query_type])
+    next_cursor = encode_cursor(rows[-1][:width]) if len(rows) == limit else None
+    return [tuple(row[width:]) for row in rows], next_cursor
+
+
+def encode_cursor(key_values):
+    return base64.urlsafe_b64encode(json.dumps(list(key_values)).encode()).decode()
+
+
+def decode_cursor(query_type, token):
+    """Key values stored in a cursor token; raises ValueError if it is malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or len(values) != len(QUERY_KEYS[query_type]):
+        raise ValueError("Invalid cursor")
+    # Ids are serial (integer) columns; bool is an int subclass, but no id
+    if not all(isinstance(value, int) and not isinstance(value, bool) and -2**31 <= value < 2**31
+               for value in values):
+        raise ValueError("Invalid cursor")
+    return values
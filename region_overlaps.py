@@ -0,0 +1,110 @@
+"""Precomputed overlap areas between regions, kept current by triggers.
+
+region_overlaps holds one row per pair of intersecting regions (and one per
+region with itself) with the geodesic area of the intersection in square
+metres. A statement-level trigger on regions recomputes the pairs of every
+inserted, updated or deleted region, so find_intersection_area and
+region_overlap_matrix read a small table instead of intersecting polygons.
+
+Usage: python region_overlaps.py install   # create the table and trigger, then rebuild
+       python region_overlaps.py rebuild   # recompute every pair from scratch
+"""
+import argparse
+import logging
+
+from db import get_connection
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS region_overlaps (
+    region_id1 integer NOT NULL,
+    region_id2 integer NOT NULL,
+    area_m2 double precision NOT NULL,
+    PRIMARY KEY (region_id1, region_id2),
+    CHECK (region_id1 <= region_id2)
+);
+
+CREATE OR REPLACE FUNCTION region_overlaps_refresh() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE region_overlaps;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM region_overlaps o
+        USING old_rows c
+        WHERE c.id IN (o.region_id1, o.region_id2);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        -- A pair of two changed regions is emitted once, from its lower id
+        INSERT INTO region_overlaps AS o (region_id1, region_id2, area_m2)
+        SELECT LEAST(c.id, r.id), GREATEST(c.id, r.id),
+               ST_Area(ST_Intersection(c.boundary, r.boundary)::geography)
+        FROM new_rows c
+        JOIN regions r ON ST_Intersects(c.boundary, r.boundary)
+        WHERE r.id >= c.id OR r.id NOT IN (SELECT id FROM new_rows)
+        ON CONFLICT (region_id1, region_id2) DO UPDATE SET area_m2 = EXCLUDED.area_m2;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS regions_overlaps_insert ON regions;
+DROP TRIGGER IF EXISTS regions_overlaps_update ON regions;
+DROP TRIGGER IF EXISTS regions_overlaps_delete ON regions;
+DROP TRIGGER IF EXISTS regions_overlaps_truncate ON regions;
+CREATE TRIGGER regions_overlaps_insert AFTER INSERT ON regions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION region_overlaps_refresh();
+CREATE TRIGGER regions_overlaps_update AFTER UPDATE ON regions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION region_overlaps_refresh();
+CREATE TRIGGER regions_overlaps_delete AFTER DELETE ON regions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION region_overlaps_refresh();
+CREATE TRIGGER regions_overlaps_truncate AFTER TRUNCATE ON regions
+    FOR EACH STATEMENT EXECUTE FUNCTION region_overlaps_refresh();
+"""
+
+REBUILD_SQL = """
+LOCK TABLE regions IN SHARE MODE;
+TRUNCATE region_overlaps;
+INSERT INTO region_overlaps (region_id1, region_id2, area_m2)
+SELECT r1.id, r2.id, ST_Area(ST_Intersection(r1.boundary, r2.boundary)::geography)
+FROM regions r1
+JOIN regions r2 ON r1.id <= r2.id AND ST_Intersects(r1.boundary, r2.boundary);
+"""
+
+
+def install_region_overlaps():
+    """Create region_overlaps and its trigger, then populate it."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA_SQL)
+            cursor.execute(REBUILD_SQL)
+    logging.info("region_overlaps installed and populated.")
+
+
+def rebuild_region_overlaps():
+    """Recompute every overlap from the current boundaries."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(REBUILD_SQL)
+            cursor.execute("SELECT COUNT(*) FROM region_overlaps;")
+            rows = cursor.fetchone()[0]
+    logging.info(f"region_overlaps rebuilt ({rows} pairs).")
+    return rows
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Maintain the region_overlaps table.")
+    parser.add_argument("command", choices=["install", "rebuild"])
+    args = parser.parse_args()
+    if args.command == "install":
+        install_region_overlaps()
+    else:
+        rebuild_region_overlaps()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Versioned schema migrations and an EXPLAIN-driven index advisor.
+
+migrate() applies the migrations in migrations.MIGRATIONS that are missing
+from schema_migrations, each in its own transaction, under an advisory lock
+so concurrent deploys cannot race. Never edit a migration that has shipped;
+add a new one.
+
+advise() runs EXPLAIN on every statement in queries.STATEMENTS with sample
+arguments drawn from the data. It flags sequential scans over large tables,
+row estimates that are far off the actual counts, and any index a
+migration creates that is missing from the database.
+
+Usage: python schema.py migrate
+       python schema.py status
+       python schema.py advise [--no-analyze]
+"""
+import argparse
+import json
+import logging
+import re
+from datetime import date, timedelta
+
+from db import get_connection
+from migrations import MIGRATIONS
+from queries import KNN_CANDIDATE_FACTOR, STATEMENTS, query_params
+from statements import reset_prepared
+
+MIGRATIONS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version integer PRIMARY KEY,
+    description text NOT NULL,
+    applied_at timestamptz NOT NULL DEFAULT now()
+);
+"""
+
+# Arbitrary key for pg_advisory_xact_lock, shared by every migrate() caller
+MIGRATION_LOCK_ID = 4326001
+
+# Sequential scans over tables with fewer rows than this are not flagged
+ADVISOR_MIN_TABLE_ROWS = 1000
+# Flag plan nodes whose actual rows differ from the estimate by this factor
+ADVISOR_ESTIMATE_FACTOR = 10
+
+
+def expected_indexes():
+    """Names of every index the migrations create."""
+    return [name for _, _, sql in MIGRATIONS
+            for name in re.findall(r"CREATE INDEX IF NOT EXISTS (\w+)", sql)]
+
+
+def applied_versions(cursor):
+    cursor.execute(MIGRATIONS_TABLE_SQL)
+    cursor.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate():
+    """Apply every pending migration; returns the versions applied."""
+    applied = []
+    for version, description, sql in MIGRATIONS:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_ID,))
+                if version in applied_versions(cursor):
+                    continue
+                cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                               (version, description))
+        logging.info(f"Applied migration {version}: {description}.")
+        applied.append(version)
+    if applied:
+        # Statements prepared before may now return columns that changed
+        reset_prepared()
+    return applied
+
+
+def schema_status():
+    """(version, description, applied) for every migration."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            applied = applied_versions(cursor)
+    return [(version, description, version in applied) for version, description, _ in MIGRATIONS]
+
+
+def sample_params(cursor):
+    """Arguments for every statement in STATEMENTS, taken from existing rows."""
+    cursor.execute("""
+        SELECT c.id, c.name, co.name, l1.id, l1.name, l1.type, ST_X(l1.location), ST_Y(l1.location), l2.id,
+               (SELECT MIN(id) FROM routes), (SELECT MIN(id) FROM regions), (SELECT MAX(id) FROM regions),
+               (SELECT substring(review_text from '[[:alpha:]]{4,}') FROM reviews LIMIT 1)
+        FROM landmarks l1
+        JOIN cities c ON c.id = l1.city_id
+        LEFT JOIN countries co ON co.id = c.country_id
+        CROSS JOIN LATERAL (SELECT id FROM landmarks WHERE id <> l1.id LIMIT 1) l2
+        ORDER BY l1.id
+        LIMIT 1;
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        raise ValueError("advise needs some landmarks, cities and reviews to sample from")
+    (city_id, city, country, landmark_id, landmark, landmark_type, lon, lat, other_id,
+     route, region, other_region, word) = row
+    today = date.today()
+    recent = today - timedelta(days=30)
+    knn = {"k": 5, "candidates": 5 * KNN_CANDIDATE_FACTOR, "max_distance": None, "landmark_type": None}
+    return {
+        "landmarks_in_city": (city,),
+        "landmarks_in_radius": (city, 5000),
+        "reviews_for_landmark": (landmark,),
+        "landmarks_of_type": (city, landmark_type),
+        "landmarks_by_rating": (5,),
+        "landmarks_in_country": (country,),
+        "nearby_landmarks": (landmark,),
+        "landmarks_by_keyword": query_params("landmarks_by_keyword", word or ""),
+        "landmarks_in_city_ids": ([city_id],),
+        "reviews_for_landmark_ids": ([landmark_id],),
+        "reviews_for_landmark_ids_between": ([landmark_id], recent, today),
+        "landmarks_in_city_many": ([city],),
+        "landmarks_in_radius_many": ([city], 5000),
+        "calculate_distance": (landmark_id, other_id),
+        "find_visitors": ([landmark_id],),
+        "find_visitors_between": ([landmark_id], recent, today),
+        "top_visited_landmarks": (),
+        "top_visited_landmarks_between": (recent, today),
+        "average_rating": ([landmark_id],),
+        "landmarks_no_visitors": (),
+        "find_visitors_many": ([landmark], [landmark_id]),
+        "average_rating_many": ([landmark], [landmark_id]),
+        "find_neighboring_cities": (city, 50000),
+        "landmarks_along_routes": {"route_ids": [route], "buffer_m": 500, "segment_m": 10000},
+        "calculate_bounding_box": ([city_id],),
+        "find_nearest_landmarks": dict(knn, lon=lon, lat=lat),
+        "find_nearest_landmarks_many": dict(knn, lons=[lon], lats=[lat]),
+        "is_landmark_in_region": ([landmark_id], region),
+        "find_city_landmark_center": ([city_id],),
+        "find_intersection_area": (region, other_region),
+        "regions_for_landmarks": {"landmark_ids": None},
+        "regions_for_points": ([lat], [lon]),
+        "region_overlap_matrix": (),
+        "tile_cells": (10, 0, 1023, 0, 1023),
+        "tile_mvt": (0, 0, 0, 4, 0, 15, 0, 15),
+        "landmark_coordinates": ([landmark_id, other_id],),
+        "distance_matrix": ([landmark_id, None], [None, lon], [None, lat],
+                            [other_id], [None], [None]),
+        "all_landmarks_names": (),
+        "all_cities_names": (),
+        "landmarks_ids_by_name": (landmark,),
+        "cities_ids_by_name": (city,),
+        "landmarks_names_by_ids": ([landmark_id, other_id],),
+        "cities_names_by_ids": ([city_id],),
+    }
+
+
+def table_sizes(cursor):
+    cursor.execute("""
+        SELECT relname, reltuples::bigint
+        FROM pg_class
+        WHERE relkind IN ('r', 'p') AND relnamespace = current_schema()::regnamespace;
+    """)
+    return dict(cursor.fetchall())
+
+
+def plan_findings(plan, sizes, analyzed):
+    """Walk an EXPLAIN (FORMAT JSON) plan tree and describe what looks wrong."""
+    findings = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.get("Plans", []))
+        relation = node.get("Relation Name")
+        if node["Node Type"] == "Seq Scan" and sizes.get(relation, 0) >= ADVISOR_MIN_TABLE_ROWS:
+            condition = node.get("Filter")
+            findings.append(f"sequential scan on {relation} ({sizes[relation]} rows)"
+                            + (f" filtering {condition}" if condition else ""))
+        if analyzed and node.get("Actual Loops"):
+            estimated = max(node["Plan Rows"], 1)
+            actual = max(node["Actual Rows"], 1)
+            if max(estimated, actual) / min(estimated, actual) >= ADVISOR_ESTIMATE_FACTOR:
+                findings.append(f"{node['Node Type']}{' on ' + relation if relation else ''} "
+                                f"estimated {node['Plan Rows']} rows, got {node['Actual Rows']}")
+    return findings
+
+
+def advise(analyze=True):
+    """{statement: [finding, ...]} for every registered statement, plus missing indexes."""
+    report = {}
+    option = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema();")
+            existing = {row[0] for row in cursor.fetchall()}
+            missing = [name for name in dict.fromkeys(expected_indexes()) if name not in existing]
+            if missing:
+                report["(schema)"] = [f"missing index {name}" for name in missing]
+            sizes = table_sizes(cursor)
+            samples = sample_params(cursor)
+            for name in STATEMENTS:
+                if name not in samples:
+                    report[name] = ["no sample arguments in schema.sample_params"]
+                    continue
+                params = samples[name]
+                cursor.execute("SAVEPOINT advise;")
+                try:
+                    cursor.execute(f"EXPLAIN ({option}) {STATEMENTS[name]}", params or None)
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    findings = plan_findings(plan[0]["Plan"], sizes, analyze)
+                except Exception as e:
+                    findings = [f"EXPLAIN failed: {e}"]
+                # EXPLAIN ANALYZE runs the statement; never keep its side effects
+                cursor.execute("ROLLBACK TO SAVEPOINT advise;")
+                if findings:
+                    report[name] = findings
+        conn.rollback()
+    return report
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Manage the database schema and its indexes.")
+    parser.add_argument("command", choices=["migrate", "status", "advise"])
+    parser.add_argument("--no-analyze", action="store_true",
+                        help="advise from estimated plans only, without running the statements")
+    args = parser.parse_args()
+    if args.command == "migrate":
+        applied = migrate()
+        print(f"Applied {len(applied)} migration(s).")
+    elif args.command == "status":
+        for version, description, applied in schema_status():
+            print(f"{version:>4}  {'applied' if applied else 'pending':<8} {description}")
+    else:
+        report = advise(analyze=not args.no_analyze)
+        if not report:
+            print("No problems found.")
+        for name, findings in report.items():
+            print(name)
+            for finding in findings:
+                print(f"  - {finding}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Indexed full-text and fuzzy search over reviews and landmark names.
+
+reviews and landmarks each get a stored, generated tsvector column with a
+GIN index, so PostgreSQL keeps the search documents and their indexes up to
+date as rows are written. Trigram (pg_trgm) indexes on review_text and
+landmarks.name back the fuzzy matching for misspelled keywords. The
+landmarks_by_keyword query in queries.py reads these.
+
+Usage: python search.py install   # add the columns and indexes (rewrites both tables once)
+"""
+import argparse
+import logging
+
+from db import get_connection
+
+SCHEMA_SQL = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE reviews ADD COLUMN IF NOT EXISTS search_document tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', COALESCE(review_text, ''))) STORED;
+ALTER TABLE landmarks ADD COLUMN IF NOT EXISTS search_document tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', COALESCE(name, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS reviews_search_document_idx
+    ON reviews USING gin (search_document);
+CREATE INDEX IF NOT EXISTS landmarks_search_document_idx
+    ON landmarks USING gin (search_document);
+CREATE INDEX IF NOT EXISTS reviews_review_text_trgm_idx
+    ON reviews USING gin (review_text gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS landmarks_name_trgm_idx
+    ON landmarks USING gin (name gin_trgm_ops);
+"""
+
+
+def install_search():
+    """Create the search columns and indexes if they are missing."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA_SQL)
+            cursor.execute("ANALYZE reviews, landmarks;")
+    logging.info("Search columns and indexes installed.")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Maintain the keyword search indexes.")
+    parser.add_argument("command", choices=["install"])
+    parser.parse_args()
+    install_search()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Every query function of ads_project and new_project behind one import.
+
+    import spatial
+    spatial.find_landmarks_in_city("Paris")
+
+Importing this module loads nothing else; each function is imported from its
+defining module on first use, and that module in turn loads psycopg2 only
+when the first connection is opened. batch.py resolves its commands through
+it. app.py does not: it runs the same statements from queries.py itself, as
+it needs control over the connection for keyset pages, streaming and table
+versions.
+"""
+import importlib
+
+_MODULES = {
+    "ads_project": (
+        "find_landmarks_in_city", "find_landmarks_within_radius", "calculate_distance",
+        "find_visitors", "fetch_reviews", "top_visited_landmarks", "average_rating",
+        "landmarks_no_visitors", "calculate_distance_matrix", "iter_visitors", "iter_reviews",
+        "iter_landmarks_no_visitors", "find_landmarks_in_city_many",
+        "find_landmarks_within_radius_many", "find_visitors_many", "average_rating_many",
+    ),
+    "new_project": (
+        "find_neighboring_cities", "find_landmarks_along_route", "find_landmarks_along_routes",
+        "calculate_bounding_box", "find_closest_landmark", "find_nearest_landmarks",
+        "find_nearest_landmarks_many", "is_landmark_in_region", "find_city_landmark_center",
+        "find_intersection_area", "find_regions_for_landmarks", "find_regions_for_points",
+        "region_overlap_matrix",
+    ),
+    "tiles": ("tile_cells", "tile_mvt"),
+}
+_EXPORTS = {name: module for module, names in _MODULES.items() for name in names}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
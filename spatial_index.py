@@ -0,0 +1,275 @@
+"""In-process spatial index over landmark and city coordinates.
+
+Answers the hot radius, nearest-neighbour and neighbouring-city queries without
+a database round trip. Points are indexed in a KD-tree on the unit sphere and
+candidates are confirmed with WGS84 geodesic distances, matching PostGIS
+geography semantics. Select the backend with SPATIAL_BACKEND=memory|postgis.
+"""
+import logging
+import math
+import os
+import threading
+import time
+
+from db import get_cursor
+
+BACKEND = os.environ.get("SPATIAL_BACKEND", "postgis")
+# Reload the in-memory data once it is older than this many seconds (0 = never).
+MAX_AGE = float(os.environ.get("SPATIAL_INDEX_MAX_AGE", "300"))
+
+# WGS84 ellipsoid, as used by PostGIS geography.
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+MEAN_RADIUS = 6371008.8
+# Sphere and spheroid distances differ by well under 1%; candidates are
+# gathered with this margin before the exact geodesic check.
+SPHERE_MARGIN = 1.01
+
+
+def haversine_distance(lon1, lat1, lon2, lat2):
+    """Great-circle distance in metres on the mean-radius sphere."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * MEAN_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def geodesic_distance(lon1, lat1, lon2, lat2):
+    """Distance in metres on the WGS84 spheroid (Vincenty's inverse formula)."""
+    if lon1 == lon2 and lat1 == lat2:
+        return 0.0
+    L = math.radians(lon2 - lon1)
+    U1 = math.atan((1 - WGS84_F) * math.tan(math.radians(lat1)))
+    U2 = math.atan((1 - WGS84_F) * math.tan(math.radians(lat2)))
+    sinU1, cosU1 = math.sin(U1), math.cos(U1)
+    sinU2, cosU2 = math.sin(U2), math.cos(U2)
+    lmb = L
+    for _ in range(200):
+        sin_lmb, cos_lmb = math.sin(lmb), math.cos(lmb)
+        sin_sigma = math.hypot(cosU2 * sin_lmb, cosU1 * sinU2 - sinU1 * cosU2 * cos_lmb)
+        if sin_sigma == 0:
+            return 0.0
+        cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lmb
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cosU1 * cosU2 * sin_lmb / sin_sigma
+        cos2_alpha = 1 - sin_alpha ** 2
+        cos_2sigma_m = cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha if cos2_alpha else 0.0
+        C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        prev = lmb
+        lmb = L + (1 - C) * WGS84_F * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        if abs(lmb - prev) < 1e-12:
+            break
+    else:
+        # Vincenty fails to converge for nearly antipodal points.
+        return haversine_distance(lon1, lat1, lon2, lat2)
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+        - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    return WGS84_B * A * (sigma - delta_sigma)
+
+
+def _to_unit_vector(lon, lat):
+    lmb, phi = math.radians(lon), math.radians(lat)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lmb), cos_phi * math.sin(lmb), math.sin(phi))
+
+
+def _chord_for_distance(metres):
+    """Straight-line distance on the unit sphere for an arc of ``metres``."""
+    angle = metres / MEAN_RADIUS
+    if angle >= math.pi:
+        return 2.0
+    return 2 * math.sin(angle / 2)
+
+
+class KDTree:
+    """Static 3-d tree over unit vectors; each item is ``(vector, payload)``."""
+
+    def __init__(self, items):
+        self._root = self._build(list(items), 0)
+
+    def _build(self, items, depth):
+        if not items:
+            return None
+        axis = depth % 3
+        items.sort(key=lambda item: item[0][axis])
+        mid = len(items) // 2
+        return (items[mid], axis,
+                self._build(items[:mid], depth + 1),
+                self._build(items[mid + 1:], depth + 1))
+
+    def within(self, vector, chord):
+        """Return payloads whose vectors lie within ``chord`` of ``vector``."""
+        found = []
+        limit = chord * chord
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            (point, payload), axis, left, right = node
+            if sum((p - v) ** 2 for p, v in zip(point, vector)) <= limit:
+                found.append(payload)
+            diff = vector[axis] - point[axis]
+            near, far = (left, right) if diff <= 0 else (right, left)
+            stack.append(near)
+            if diff * diff <= limit:
+                stack.append(far)
+        return found
+
+    def nearest(self, vector):
+        """Return the payload closest to ``vector``, or None if the tree is empty."""
+        best = [None, float("inf")]
+
+        def visit(node):
+            if node is None:
+                return
+            (point, payload), axis, left, right = node
+            dist = sum((p - v) ** 2 for p, v in zip(point, vector))
+            if dist < best[1]:
+                best[0], best[1] = payload, dist
+            diff = vector[axis] - point[axis]
+            near, far = (left, right) if diff <= 0 else (right, left)
+            visit(near)
+            if diff * diff < best[1]:
+                visit(far)
+
+        visit(self._root)
+        return best[0]
+
+
+class SpatialIndex:
+    """Snapshot of landmark and city coordinates with KD-tree lookups."""
+
+    def __init__(self, landmarks, cities):
+        # landmarks: (id, name, city_id, lon, lat); cities: (id, name, lon, lat)
+        self.landmarks = {row[0]: row for row in landmarks}
+        self.cities = {row[0]: row for row in cities}
+        self.landmarks_by_name = {}
+        for row in landmarks:
+            self.landmarks_by_name.setdefault(row[1], []).append(row)
+        self.cities_by_name = {}
+        for row in cities:
+            self.cities_by_name.setdefault(row[1], []).append(row)
+        self._landmark_tree = KDTree((_to_unit_vector(r[3], r[4]), r) for r in landmarks)
+        self._city_tree = KDTree((_to_unit_vector(r[2], r[3]), r) for r in cities)
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls):
+        """Read all located landmarks and cities from the database."""
+        with get_cursor(readonly=True) as cursor:
+            cursor.execute("""
+                SELECT l.id, l.name, l.city_id,
+                       ST_X(l.location::geometry), ST_Y(l.location::geometry)
+                FROM landmarks l
+                WHERE l.location IS NOT NULL
+                ORDER BY l.id;
+            """)
+            landmarks = cursor.fetchall()
+            cursor.execute("""
+                SELECT c.id, c.name,
+                       ST_X(c.location::geometry), ST_Y(c.location::geometry)
+                FROM cities c
+                WHERE c.location IS NOT NULL
+                ORDER BY c.id;
+            """)
+            cities = cursor.fetchall()
+        logging.info(f"Spatial index loaded {len(landmarks)} landmarks and {len(cities)} cities.")
+        return cls(landmarks, cities)
+
+    def _landmarks_near(self, lon, lat, radius_m):
+        candidates = self._landmark_tree.within(
+            _to_unit_vector(lon, lat), _chord_for_distance(radius_m * SPHERE_MARGIN))
+        return sorted((row for row in candidates
+                       if geodesic_distance(lon, lat, row[3], row[4]) <= radius_m),
+                      key=lambda row: row[0])
+
+    def landmarks_within_radius(self, city_name, radius_m):
+        """Same rows as find_landmarks_within_radius: the city's own landmarks in range."""
+        result = []
+        for city_id, _, lon, lat in self.cities_by_name.get(city_name, []):
+            result.extend((row[1],) for row in self._landmarks_near(lon, lat, radius_m)
+                          if row[2] == city_id)
+        return result
+
+    def nearby_landmarks(self, landmark_name, radius_m=1000):
+        """Same rows as the nearby_landmarks query in app.py."""
+        result = []
+        for _, _, _, lon, lat in self.landmarks_by_name.get(landmark_name, []):
+            result.extend((row[1],) for row in self._landmarks_near(lon, lat, radius_m))
+        return result
+
+    def neighboring_cities(self, city_name, radius_m):
+        """Same rows as find_neighboring_cities: other cities within range."""
+        result = []
+        for city_id, _, lon, lat in self.cities_by_name.get(city_name, []):
+            candidates = self._city_tree.within(
+                _to_unit_vector(lon, lat), _chord_for_distance(radius_m * SPHERE_MARGIN))
+            result.extend((row[1],) for row in sorted(candidates, key=lambda row: row[0])
+                          if row[0] != city_id
+                          and geodesic_distance(lon, lat, row[2], row[3]) <= radius_m)
+        return result
+
+    def closest_landmark(self, lat, lon):
+        """Return ``(name, distance_m)`` of the nearest landmark, or None."""
+        guess = self._landmark_tree.nearest(_to_unit_vector(lon, lat))
+        if guess is None:
+            return None
+        # The sphere's nearest point is within the margin of the spheroid's,
+        # so recheck every candidate in that band with the exact distance.
+        bound = geodesic_distance(lon, lat, guess[3], guess[4])
+        best = None
+        for row in self._landmarks_near(lon, lat, bound * SPHERE_MARGIN + 1):
+            distance = geodesic_distance(lon, lat, row[3], row[4])
+            if best is None or distance < best[1]:
+                best = (row[1], distance)
+        return best
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def memory_backend_enabled():
+    return BACKEND == "memory"
+
+
+def set_backend(name):
+    """Switch between the ``postgis`` and ``memory`` backends at runtime."""
+    global BACKEND
+    if name not in ("postgis", "memory"):
+        raise ValueError(f"Unknown spatial backend: {name}")
+    BACKEND = name
+
+
+def get_index():
+    """Return the shared index, loading it on first use or once it exceeds MAX_AGE."""
+    global _index
+    index = _index
+    if index is None or (MAX_AGE and time.monotonic() - index.loaded_at > MAX_AGE):
+        with _index_lock:
+            if _index is None or _index is index:
+                _index = SpatialIndex.load()
+            index = _index
+    return index
+
+
+def refresh_index():
+    """Force a reload, e.g. after landmarks or cities were modified."""
+    global _index
+    with _index_lock:
+        _index = SpatialIndex.load()
+    return _index
+
+
+def invalidate_index():
+    """Reload an already loaded index in place; an unloaded one is left to load on first use."""
+    if _index is not None:
+        refresh_index()
@@ -0,0 +1,159 @@
+"""Run the named statements in queries.STATEMENTS as server-side prepared statements.
+
+Each pooled connection PREPAREs a statement the first time it runs it and
+EXECUTEs it by name afterwards, so repeated calls skip parsing and planning.
+After a few executions PostgreSQL may also switch to a cached generic plan.
+Set SPATIAL_PREPARE_STATEMENTS=0 to send the plain SQL instead.
+
+A migration that changes a table's columns invalidates the prepared
+statements reading it ("cached plan must not change result type"). A
+connection that hits this error DEALLOCATEs all its statements, and the
+statement is retried when nothing else had run in its transaction yet.
+reset_prepared() makes every pooled connection start afresh, and migrate()
+calls it after applying migrations.
+"""
+import functools
+import logging
+import os
+import re
+import threading
+
+import metrics
+from db import driver
+from queries import STATEMENTS
+
+PREPARE_ENABLED = os.environ.get("SPATIAL_PREPARE_STATEMENTS", "1") != "0"
+
+_PLACEHOLDER = re.compile(r"%%|%\((\w+)\)s|%s")
+
+# SQLSTATE feature_not_supported, raised among others for a prepared
+# statement whose result columns changed under it
+STALE_PLAN_SQLSTATE = "0A000"
+
+_stats = {}
+_stats_lock = threading.Lock()
+# Bumped by reset_prepared(); connections prepared under an older generation
+# deallocate before their next statement
+_generation = 0
+
+
+@functools.lru_cache(maxsize=None)
+def prepared_sql(name):
+    """STATEMENTS[name] with $n placeholders, and the parameter key behind each $n.
+
+    Keys are positions for %s placeholders and names for %(name)s ones; a
+    name used several times maps to a single $n. Escaped %% become %.
+    """
+    keys = []
+
+    def number(match):
+        if match.group() == "%%":
+            return "%"
+        key = match.group(1)
+        if key is None:
+            key = sum(1 for k in keys if isinstance(k, int))
+        elif key in keys:
+            return f"${keys.index(key) + 1}"
+        keys.append(key)
+        return f"${len(keys)}"
+
+    return _PLACEHOLDER.sub(number, STATEMENTS[name]), tuple(keys)
+
+
+def _record(name, counter):
+    with _stats_lock:
+        stats = _stats.setdefault(name, {"prepares": 0, "executions": 0})
+        stats[counter] += 1
+
+
+def execute(cursor, name, params=()):
+    """Run STATEMENTS[name] on ``cursor``, preparing it on this connection if needed.
+
+    Connections without a ``prepared_statements`` set (i.e. not from the pool)
+    run the plain SQL. Timing, row counts and errors go to ``metrics``.
+    """
+    conn = cursor.connection
+    # Charge the pool wait to the first statement run on the checkout
+    wait = getattr(conn, "acquire_wait", None)
+    if wait is not None:
+        conn.acquire_wait = None
+        metrics.observe("spatial_db_acquire_seconds", name, wait)
+    with metrics.timed(name, STATEMENTS[name], params) as timing:
+        _execute(cursor, name, params)
+        timing.rows = cursor.rowcount
+
+
+def _execute(cursor, name, params):
+    conn = cursor.connection
+    prepared = getattr(conn, "prepared_statements", None)
+    if not PREPARE_ENABLED or prepared is None:
+        cursor.execute(STATEMENTS[name], params or None)
+        _record(name, "executions")
+        return
+    # Only a statement that starts its transaction can be retried after an error
+    first_in_transaction = conn.info.transaction_status == driver().extensions.TRANSACTION_STATUS_IDLE
+    if getattr(conn, "prepared_generation", 0) != _generation:
+        _deallocate(cursor)
+    try:
+        _execute_prepared(cursor, name, params, prepared)
+    except driver().Error as e:
+        if getattr(e, "pgcode", None) != STALE_PLAN_SQLSTATE or name not in prepared:
+            raise
+        logging.warning(f"Prepared statement {name} is stale; deallocating this connection's statements")
+        if not first_in_transaction:
+            # The next statement on this connection starts afresh
+            conn.prepared_generation = None
+            raise
+        conn.rollback()
+        _deallocate(cursor)
+        _execute_prepared(cursor, name, params, prepared)
+    _record(name, "executions")
+
+
+def _execute_prepared(cursor, name, params, prepared):
+    sql, keys = prepared_sql(name)
+    if name not in prepared:
+        cursor.execute(f"PREPARE stmt_{name} AS {sql}")
+        prepared.add(name)
+        _record(name, "prepares")
+    if keys:
+        placeholders = ", ".join(["%s"] * len(keys))
+        cursor.execute(f"EXECUTE stmt_{name} ({placeholders})", [params[key] for key in keys])
+    else:
+        cursor.execute(f"EXECUTE stmt_{name}")
+
+
+def _deallocate(cursor):
+    cursor.execute("DEALLOCATE ALL")
+    cursor.connection.prepared_statements.clear()
+    cursor.connection.prepared_generation = _generation
+
+
+def reset_prepared():
+    """Have every pooled connection deallocate its statements before its next one, e.g. after a migration."""
+    global _generation
+    with _stats_lock:
+        _generation += 1
+
+
+def statement_stats():
+    """Per-statement prepare and execution counts in this process.
+
+    ``reused`` counts executions that ran an already prepared statement.
+    """
+    with _stats_lock:
+        stats = {name: dict(counts) for name, counts in _stats.items()}
+    for counts in stats.values():
+        counts["reused"] = counts["executions"] - counts["prepares"] if PREPARE_ENABLED else 0
+    return stats
+
+
+def plan_stats(cursor):
+    """Generic vs custom plan counts PostgreSQL (14+) reports for this connection's statements."""
+    cursor.execute("""
+        SELECT name, generic_plans, custom_plans
+        FROM pg_prepared_statements
+        ORDER BY name;
+    """)
+    return {name: {"generic_plans": generic, "custom_plans": custom}
+            for name, generic, custom in cursor.fetchall()}
@@ -0,0 +1,166 @@
+"""Reproducible synthetic spatial dataset for benchmarks.
+
+Generates countries, cities, landmarks, visitors, reviews, routes and regions
+with the columns the query functions use, scaled linearly by ``scale`` and
+fully determined by ``seed``. Rows are written with COPY.
+
+Usage: python synthetic_data.py --scale 1 --seed 42
+"""
+import argparse
+import logging
+import math
+import random
+from datetime import date, timedelta
+
+from aggregates import rebuild_aggregates
+from bulk_load import encode_text, geojson_to_ewkb, point_to_ewkb
+from db import DB_CONFIG, get_connection
+from partitions import ensure_partitions
+from schema import migrate
+
+# Rows per unit of scale
+SCALE_ROWS = {
+    "countries": 5,
+    "cities": 50,
+    "landmarks": 2000,
+    "visitors": 50000,
+    "reviews": 20000,
+    "routes": 20,
+    "regions": 10,
+}
+
+# Area the cities are scattered over (lon/lat degrees, roughly Europe)
+EXTENT = (-10.0, 35.0, 30.0, 60.0)
+LANDMARK_TYPES = ["museum", "park", "monument", "church", "castle", "bridge", "market", "gallery"]
+REVIEW_WORDS = ["beautiful", "crowded", "historic", "quiet", "amazing", "expensive", "friendly",
+                "view", "garden", "tour", "guide", "architecture", "sunset", "family", "food",
+                "ticket", "queue", "free", "clean", "old", "modern", "river", "tower", "art"]
+FIRST_DATE = date(2015, 1, 1)
+DAYS = 3650
+
+TABLE_COLUMNS = {
+    "countries": ["id", "name"],
+    "cities": ["id", "name", "country_id", "location"],
+    "landmarks": ["id", "name", "city_id", "type", "location"],
+    "visitors": ["id", "name", "landmark_id", "visit_date"],
+    "reviews": ["id", "landmark_id", "review_text", "rating", "review_date"],
+    "routes": ["id", "name", "path"],
+    "regions": ["id", "name", "boundary"],
+}
+
+
+def offset_point(lon, lat, east_m, north_m):
+    """Move a lon/lat point by metres east and north (small-offset approximation)."""
+    dlat = north_m / 111320.0
+    dlon = east_m / (111320.0 * math.cos(math.radians(lat)))
+    return lon + dlon, lat + dlat
+
+
+class SyntheticDataset:
+    """Deterministic rows for every table at a given scale."""
+
+    def __init__(self, scale=1.0, seed=42):
+        self.scale = scale
+        self.seed = seed
+        self.counts = {table: max(1, int(rows * scale)) for table, rows in SCALE_ROWS.items()}
+        rng = random.Random(seed)
+        self.countries = [(i, f"Country {i}") for i in range(1, self.counts["countries"] + 1)]
+        self.cities = []
+        for i in range(1, self.counts["cities"] + 1):
+            lon = rng.uniform(EXTENT[0], EXTENT[2])
+            lat = rng.uniform(EXTENT[1], EXTENT[3])
+            self.cities.append((i, f"City {i}", rng.randint(1, len(self.countries)), lon, lat))
+        self.landmarks = []
+        for i in range(1, self.counts["landmarks"] + 1):
+            city = self.cities[rng.randrange(len(self.cities))]
+            lon, lat = offset_point(city[3], city[4], rng.gauss(0, 5000), rng.gauss(0, 5000))
+            self.landmarks.append((i, f"Landmark {i}", city[0], rng.choice(LANDMARK_TYPES), lon, lat))
+
+    def _rng(self, salt):
+        return random.Random(f"{self.seed}:{salt}")
+
+    def _landmark_weights(self):
+        # Zipf-like popularity so a few landmarks dominate visits and reviews
+        return [1.0 / rank for rank in range(1, len(self.landmarks) + 1)]
+
+    def rows(self, table):
+        """Yield the COPY rows for ``table`` in TABLE_COLUMNS order."""
+        if table == "countries":
+            yield from ([i, name] for i, name in self.countries)
+        elif table == "cities":
+            for i, name, country_id, lon, lat in self.cities:
+                yield [i, name, country_id, point_to_ewkb(lon, lat)]
+        elif table == "landmarks":
+            for i, name, city_id, type_, lon, lat in self.landmarks:
+                yield [i, name, city_id, type_, point_to_ewkb(lon, lat)]
+        elif table == "visitors":
+            rng = self._rng("visitors")
+            ids = rng.choices([l[0] for l in self.landmarks], self._landmark_weights(),
+                              k=self.counts["visitors"])
+            for i, landmark_id in enumerate(ids, 1):
+                yield [i, f"Visitor {rng.randint(1, 10 ** 6)}", landmark_id,
+                       FIRST_DATE + timedelta(days=rng.randrange(DAYS))]
+        elif table == "reviews":
+            rng = self._rng("reviews")
+            ids = rng.choices([l[0] for l in self.landmarks], self._landmark_weights(),
+                              k=self.counts["reviews"])
+            for i, landmark_id in enumerate(ids, 1):
+                text = " ".join(rng.choices(REVIEW_WORDS, k=rng.randint(5, 25)))
+                yield [i, landmark_id, text.capitalize() + ".", rng.randint(1, 5),
+                       FIRST_DATE + timedelta(days=rng.randrange(DAYS))]
+        elif table == "routes":
+            rng = self._rng("routes")
+            for i in range(1, self.counts["routes"] + 1):
+                stops = rng.sample(self.cities, min(len(self.cities), rng.randint(2, 5)))
+                coords = [(c[3], c[4]) for c in stops]
+                yield [i, f"Route {i}", geojson_to_ewkb({"type": "LineString", "coordinates": coords})]
+        elif table == "regions":
+            rng = self._rng("regions")
+            for i in range(1, self.counts["regions"] + 1):
+                lon = rng.uniform(EXTENT[0], EXTENT[2])
+                lat = rng.uniform(EXTENT[1], EXTENT[3])
+                radius = rng.uniform(50000, 400000)
+                ring = [offset_point(lon, lat, radius * math.cos(a), radius * math.sin(a))
+                        for a in (2 * math.pi * k / 12 for k in range(12))]
+                ring.append(ring[0])
+                yield [i, f"Region {i}", geojson_to_ewkb({"type": "Polygon", "coordinates": [ring]})]
+
+
+def load_dataset(dataset, drop_existing=True):
+    """Replace the contents of every table with ``dataset``."""
+    migrate()
+    # Partitions for every generated date, so COPY never routes to DEFAULT
+    ensure_partitions(FIRST_DATE, FIRST_DATE + timedelta(days=DAYS))
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            if drop_existing:
+                cursor.execute("TRUNCATE countries, cities, landmarks, visitors, reviews, "
+                               "routes, regions RESTART IDENTITY CASCADE;")
+            for table, columns in TABLE_COLUMNS.items():
+                cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN",
+                                   encode_text(dataset.rows(table), None))
+                cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                               f"(SELECT COALESCE(MAX(id), 1) FROM {table}));")
+                logging.info(f"Loaded {table}.")
+            cursor.execute("ANALYZE;")
+    rebuild_aggregates()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Load a synthetic spatial dataset.")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true",
+                        help=f"allow replacing the data in {DB_CONFIG['dbname']!r}")
+    args = parser.parse_args()
+    if DB_CONFIG["dbname"] == "spatialproject" and not args.force:
+        parser.error("refusing to overwrite the default database; point SPATIAL_DB_NAME "
+                     "at a disposable database or pass --force")
+    dataset = SyntheticDataset(args.scale, args.seed)
+    load_dataset(dataset)
+    print(", ".join(f"{table}={count}" for table, count in dataset.counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+
+
+def test_import_starts_no_threads():
+    before = set(threading.enumerate())
+    import app
+    assert set(threading.enumerate()) == before
+    assert not app._background_started
+
+
+def test_validators_follow_the_table_versions():
+    from app import query_validators
+
+    key = ("query", "landmarks_in_city", ("Paris",), None, None, None)
+    token = (("cities", 3), ("landmarks", 7))
+    etag, last_modified = query_validators(key, (token, 1700000000))
+    assert query_validators(key, (token, 1700000000))[0] == etag
+    assert query_validators(key, ((("cities", 3), ("landmarks", 8)), 1700000000))[0] != etag
+    assert query_validators(key[:2] + (("Rome",),) + key[3:], (token, 1700000000))[0] != etag
+    assert last_modified.timestamp() == 1700000000
+
+
+@pytest.mark.parametrize("fields", [
+    {"query_type": "landmarks_by_rating", "user_input": "four"},
+    {"query_type": "landmarks_by_rating", "user_input": "four", "limit": "10"},
+    {"query_type": "landmarks_by_rating", "user_input": "four", "format": "ndjson"},
+    {"query_type": "landmarks_in_radius", "user_input": "Paris"},
+    {"query_type": "landmarks_in_city", "user_input": "Paris", "limit": "10", "cursor": "not a token"},
+])
+def test_invalid_parameters_are_rejected_before_any_query_runs(monkeypatch, fields):
+    import app
+
+    monkeypatch.setattr(app, "start_background", lambda: None)
+    monkeypatch.setattr(app, "get_cursor", lambda **kwargs: pytest.fail("query ran"))
+    response = app.app.test_client().post("/query", data=fields)
+    assert response.status_code == 400
@@ -0,0 +1,30 @@
+from datetime import date
+
+import pytest
+
+from batch import parse_command, read_commands
+
+
+def test_parse_command_converts_arguments_and_keeps_quoted_names():
+    assert parse_command('find_landmarks_within_radius "New York" 2.5') == (
+        "find_landmarks_within_radius", ["New York", 2.5])
+    assert parse_command("top_visited_landmarks 2026-10-01") == (
+        "top_visited_landmarks", [date(2026, 10, 1)])
+
+
+@pytest.mark.parametrize("text", [
+    "drop_tables",
+    "find_landmarks_in_city",
+    "calculate_distance Louvre",
+    "find_closest_landmark 48.8 2.3 extra",
+    "find_closest_landmark north 2.3",
+    "top_visited_landmarks yesterday",
+])
+def test_malformed_commands_raise_value_error(text):
+    with pytest.raises(ValueError):
+        parse_command(text)
+
+
+def test_read_commands_skips_blank_lines_and_comments():
+    lines = ["# header\n", "\n", "  landmarks_no_visitors  \n", "average_rating Louvre\n"]
+    assert list(read_commands(lines)) == [(3, "landmarks_no_visitors"), (4, "average_rating Louvre")]
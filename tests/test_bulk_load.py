@@ -0,0 +1,131 @@
+import io
+import json
+import struct
+from datetime import date
+
+import pytest
+
+import bulk_load
+from bulk_load import (LOAD_STAGES, NameResolver, encode_binary, encode_text, geojson_to_ewkb,
+                       point_to_ewkb, read_geojson)
+
+
+def read_binary_copy(buffer, field_count):
+    """Rows of raw field bytes (None for NULL) from a binary COPY stream."""
+    data = buffer.read()
+    assert data[:11] == b"PGCOPY\n\xff\r\n\x00"
+    stream = io.BytesIO(data[19:])
+    rows = []
+    while True:
+        (count,) = struct.unpack("!h", stream.read(2))
+        if count == -1:
+            assert stream.read() == b""
+            return rows
+        assert count == field_count
+        row = []
+        for _ in range(count):
+            (length,) = struct.unpack("!i", stream.read(4))
+            row.append(None if length == -1 else stream.read(length))
+        rows.append(row)
+
+
+def test_encode_binary_fields():
+    rows = [(7, "Tower", None, date(2000, 1, 3), 1.5),
+            (-1, "Straße", 2, "2026-10-17", None)]
+    decoded = read_binary_copy(encode_binary(rows, ["int4", "text", "int8", "date", "float8"]), 5)
+    assert decoded[0] == [struct.pack("!i", 7), b"Tower", None, struct.pack("!i", 2), struct.pack("!d", 1.5)]
+    assert decoded[1][1] == "Straße".encode("utf-8")
+    assert decoded[1][2] == struct.pack("!q", 2)
+    assert struct.unpack("!i", decoded[1][3])[0] == (date(2026, 10, 17) - date(2000, 1, 1)).days
+    assert decoded[1][4] is None
+
+
+def test_encode_binary_without_rows():
+    assert read_binary_copy(encode_binary([], ["int4"]), 1) == []
+
+
+def test_encode_text_escapes():
+    buffer = encode_text([(1, "a\tb\nc\\d", None, b"\x01\xff")], ["int4", "text", "text", "geometry"])
+    assert buffer.read() == "1\ta\\tb\\nc\\\\d\t\\N\t01ff\n"
+
+
+def test_point_ewkb():
+    ewkb = point_to_ewkb(2.5, -1.0)
+    assert ewkb[0] == 1
+    assert struct.unpack("<II", ewkb[1:9]) == (1 | 0x20000000, 4326)
+    assert struct.unpack("<dd", ewkb[9:]) == (2.5, -1.0)
+
+
+def test_polygon_ewkb():
+    ring = [[0, 0], [1, 0], [1, 1], [0, 0]]
+    ewkb = geojson_to_ewkb({"type": "Polygon", "coordinates": [ring]})
+    assert struct.unpack("<I", ewkb[1:5])[0] == 3 | 0x20000000
+    assert struct.unpack("<II", ewkb[9:17]) == (1, 4)
+    assert len(ewkb) == 17 + 4 * 16
+
+
+class FakeCursor:
+    """Answers NameResolver's lookup from {lower-cased name: id}."""
+
+    def __init__(self, table_rows):
+        self.table_rows = table_rows
+        self.lookups = []
+
+    def execute(self, statement, params):
+        self.lookups.append(sorted(params[0]))
+        self._result = [(key, self.table_rows[key], 1) for key in params[0] if key in self.table_rows]
+
+    def fetchall(self):
+        return self._result
+
+
+@pytest.fixture
+def fake_sql(monkeypatch):
+    class FakeSQL:
+        @staticmethod
+        def SQL(text):
+            return FakeSQL.Composed()
+
+        @staticmethod
+        def Identifier(name):
+            return name
+
+        class Composed:
+            def format(self, *args):
+                return "statement"
+
+    monkeypatch.setattr(bulk_load, "driver", lambda: type("psycopg2", (), {"sql": FakeSQL}))
+
+
+def test_name_resolver_retries_unknown_names(fake_sql):
+    resolver = NameResolver()
+    cursor = FakeCursor({"norway": 1})
+    assert resolver.resolve(cursor, "countries", ["Norway", "Sweden"]) == {"Norway": 1, "Sweden": None}
+    cursor.table_rows["sweden"] = 2
+    assert resolver.resolve(cursor, "countries", ["Norway", "Sweden"]) == {"Norway": 1, "Sweden": 2}
+    assert cursor.lookups == [["norway", "sweden"], ["sweden"]]
+
+
+def test_name_resolver_ignores_case_like_names_py(fake_sql):
+    resolver = NameResolver()
+    cursor = FakeCursor({"paris": 7})
+    assert resolver.resolve(cursor, "cities", ["paris", "Paris", " PARIS "]) == {
+        "paris": 7, "Paris": 7, " PARIS ": 7}
+    assert cursor.lookups == [["paris"]]
+
+
+def test_geojson_feature_ids_are_only_taken_when_integers(tmp_path):
+    path = tmp_path / "landmarks.geojson"
+    point = {"type": "Point", "coordinates": [2.29, 48.86]}
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "id": 5, "geometry": point, "properties": {"name": "a"}},
+        {"type": "Feature", "id": "node/17", "geometry": point, "properties": {"name": "b"}},
+        {"type": "Feature", "id": True, "geometry": point, "properties": {"name": "c"}},
+    ]}))
+    assert [record.get("id") for record in read_geojson(str(path))] == [5, None, None]
+
+
+def test_tables_with_shared_summary_rows_load_in_separate_stages():
+    stage_of = {table: i for i, stage in enumerate(LOAD_STAGES) for table in stage}
+    assert stage_of["visitors"] != stage_of["reviews"]
+    assert stage_of["countries"] < stage_of["cities"] < stage_of["landmarks"] < stage_of["visitors"]
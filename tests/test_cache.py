@@ -0,0 +1,177 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import cache
+from cache import MISS, QueryCache, SingleFlight
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    previous = cache.get_cache()
+    cache.configure_cache(QueryCache(max_entries=3, default_ttl=60))
+    yield
+    cache.configure_cache(previous)
+
+
+def test_lru_eviction():
+    store = QueryCache(max_entries=2)
+    store.set("a", 1)
+    store.set("b", 2)
+    assert store.get("a") == 1
+    store.set("c", 3)
+    assert store.get("b") is MISS
+    assert store.get("a") == 1 and store.get("c") == 3
+    assert store.stats()["evictions"] == 1
+
+
+def test_expired_entries_miss():
+    store = QueryCache()
+    store.set("a", 1, ttl=0)
+    assert store.get("a") is MISS
+    assert store.stats()["expirations"] == 1
+
+
+def test_invalidate_table_drops_only_its_entries():
+    store = QueryCache()
+    store.set("a", 1, tables=("landmarks",))
+    store.set("b", 2, tables=("cities",))
+    assert store.invalidate_table("landmarks") == 1
+    assert store.get("a") is MISS
+    assert store.get("b") == 2
+
+
+def test_cached_call_computes_once():
+    calls = []
+    for _ in range(3):
+        assert cache.cached_call("k", lambda: calls.append(1) or "value") == "value"
+    assert len(calls) == 1
+
+
+def test_cached_call_does_not_store_across_invalidation():
+    def compute():
+        cache.invalidate_table("landmarks")
+        return "stale"
+
+    assert cache.cached_call("k", compute, tables=("landmarks",)) == "stale"
+    assert cache.get_cache().get("k") is MISS
+    assert cache.cached_call("k", lambda: "fresh", tables=("landmarks",)) == "fresh"
+    assert cache.get_cache().get("k") == "fresh"
+
+
+def test_skip_caching_keeps_fallback_out():
+    def failing():
+        cache.skip_caching()
+        return []
+
+    cache.cached_call("k", failing)
+    assert cache.get_cache().get("k") is MISS
+
+
+def run_together(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_single_flight_shares_one_execution():
+    flights = SingleFlight()
+    calls, results = [], []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return "rows"
+
+    def request():
+        results.append(flights.do("k", slow))
+
+    leader = threading.Thread(target=request)
+    leader.start()
+    while not calls:
+        time.sleep(0.001)
+    followers = [threading.Thread(target=request) for _ in range(9)]
+    for thread in followers:
+        thread.start()
+    while flights.stats()["coalesced"] < 9:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(results) == [("rows", False)] + [("rows", True)] * 9
+    assert flights.stats() == {"executions": 1, "coalesced": 9, "in_flight": 0}
+
+
+def test_single_flight_shares_errors_and_then_runs_again():
+    flights = SingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    def request():
+        try:
+            flights.do("k", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=request)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=request)
+    follower.start()
+    while flights.stats()["coalesced"] < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert errors == ["boom", "boom"]
+    assert flights.do("k", lambda: "ok") == ("ok", False)
+
+
+def test_single_flight_keys_are_independent():
+    flights = SingleFlight()
+    results = []
+    run_together(4, lambda: results.append(flights.do(threading.get_ident(), lambda: 1)))
+    assert results == [(1, False)] * 4
+    assert flights.stats()["executions"] == 4
+
+
+def test_async_cached_call_guards_like_cached_call():
+    async def stale():
+        cache.invalidate_table("landmarks")
+        return "stale"
+
+    async def fallback():
+        cache.skip_caching()
+        return []
+
+    async def failing():
+        # In a task of its own, as asyncio.wait_for() may run it
+        return await asyncio.create_task(fallback())
+
+    async def fresh():
+        return "fresh"
+
+    assert asyncio.run(cache.async_cached_call("a", stale, tables=("landmarks",))) == "stale"
+    assert cache.get_cache().get("a") is MISS
+    asyncio.run(cache.async_cached_call("b", failing))
+    assert cache.get_cache().get("b") is MISS
+    assert asyncio.run(cache.async_cached_call("c", fresh)) == "fresh"
+    assert cache.get_cache().get("c") == "fresh"
+
+
+def test_skip_caching_outside_a_cached_call_does_nothing():
+    cache.skip_caching()
+    assert cache.cached_call("k", lambda: "value") == "value"
+    assert cache.get_cache().get("k") == "value"
@@ -0,0 +1,33 @@
+import changes
+from changes import versions_from_rows
+
+
+def test_versions_need_every_table():
+    rows = [("landmarks", 7, 1700000000.2), ("cities", 3, 1600000000.0)]
+    token, changed_at = versions_from_rows(("landmarks", "cities"), rows)
+    assert token == (("cities", 3), ("landmarks", 7))
+    # Rounded up to the second, as HTTP dates are
+    assert changed_at == 1700000001
+    assert versions_from_rows(("landmarks", "cities", "reviews"), rows) is None
+    assert versions_from_rows((), []) is None
+
+
+def test_dispatch_filters_by_table_and_resyncs_a_failing_consumer(monkeypatch):
+    monkeypatch.setattr(changes, "_consumers", [])
+    calls = []
+
+    def broken(events):
+        raise RuntimeError("boom")
+
+    changes.register("names", lambda events: calls.append(("names", events)), lambda: calls.append("names resync"),
+                     tables=("landmarks",))
+    changes.register("broken", broken, lambda: calls.append("broken resync"))
+    changes.register("all", lambda events: calls.append(("all", events)), lambda: calls.append("all resync"))
+    landmark = {"table": "landmarks", "ids": [1]}
+    review = {"table": "reviews", "ids": None}
+    changes.dispatch([landmark, review])
+    assert calls == [("names", [landmark]), "broken resync", ("all", [landmark, review])]
+
+    calls.clear()
+    changes.dispatch([review])
+    assert calls == ["broken resync", ("all", [review])]
@@ -0,0 +1,39 @@
+import pytest
+
+import distances
+from distances import distance_matrix, nearest_per_row
+from spatial_index import geodesic_distance
+
+POINTS = [(59.91, 10.75), (48.8566, 2.3522), (-33.8688, 151.2093), (0.0, 0.0), (0.1, 179.7)]
+
+
+def test_numpy_matrix_matches_scalar_vincenty():
+    pytest.importorskip("numpy")
+    matrix = distance_matrix(POINTS, method="numpy")
+    for i, (lat1, lon1) in enumerate(POINTS):
+        for j, (lat2, lon2) in enumerate(POINTS):
+            assert matrix[i][j] == pytest.approx(geodesic_distance(lon1, lat1, lon2, lat2), abs=1e-3)
+
+
+def test_matrix_with_separate_destinations():
+    pytest.importorskip("numpy")
+    matrix = distance_matrix(POINTS[:2], POINTS[2:], method="numpy")
+    assert len(matrix) == 2 and all(len(row) == 3 for row in matrix)
+
+
+def test_matrix_size_limit(monkeypatch):
+    monkeypatch.setattr(distances, "MAX_MATRIX_CELLS", 4)
+    with pytest.raises(ValueError):
+        distance_matrix(POINTS[:3], method="numpy")
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        distance_matrix(POINTS[:1], method="abacus")
+
+
+def test_nearest_per_row():
+    matrix = [[0.0, 5.0, 1.0, None],
+              [5.0, 0.0, 2.0, 3.0]]
+    assert nearest_per_row(matrix, 2) == [[(0, 0.0), (2, 1.0)], [(1, 0.0), (2, 2.0)]]
+    assert nearest_per_row(matrix, 2, skip_diagonal=True) == [[(2, 1.0), (1, 5.0)], [(2, 2.0), (3, 3.0)]]
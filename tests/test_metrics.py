@@ -0,0 +1,29 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    calls = []
+    monkeypatch.setattr(metrics, "record_query", lambda query, seconds, rows: calls.append((query, seconds, rows)))
+    monkeypatch.setattr(metrics, "inc", lambda metric, query: calls.append((metric, query)))
+    monkeypatch.setattr(metrics, "is_slow", lambda seconds: False)
+    return calls
+
+
+def test_timed_records_rows_and_leaves_out_paused_time(recorded, monkeypatch):
+    clock = iter([0.0, 1.0, 5.0, 6.0])
+    monkeypatch.setattr(metrics.time, "perf_counter", lambda: next(clock))
+    with metrics.timed("q", "SELECT 1", ()) as timing:
+        with timing.paused():
+            pass
+        timing.rows = 3
+    assert recorded == [("q", 2.0, 3)]
+
+
+def test_timed_counts_errors_without_recording_a_duration(recorded):
+    with pytest.raises(RuntimeError):
+        with metrics.timed("q", "SELECT 1", ()):
+            raise RuntimeError
+    assert recorded == [("spatial_query_errors_total", "q")]
@@ -0,0 +1,37 @@
+import hashlib
+
+from migrations import MIGRATIONS
+from schema import expected_indexes
+
+# SHA-256 of each shipped migration's SQL. A migration that has shipped is
+# never edited, so these only ever gain entries.
+SHIPPED = {
+    1: "8fdcaea12074ae26f8746e35fe25d96d2af8d0d3220556c02ac739f0d79e3190",
+    2: "e62612e50c5f69c04ca4e99739d278cfd1bbc203f2455e9ac3acdc708f43a540",
+    3: "2eb54a190aff39f58c40942347ed01c8c9d6bd0193495edc0f74398de51a864e",
+    4: "bada523986b78845cce21b25ec76c60a60905bdf52dcf56fb174a0d46831e526",
+    5: "148dbb8c8b73d9deb614a48f004780ca523eb7f5879b84d15cee6344cdacf16d",
+    6: "36b699f12dc7b394ab5a8bb7e5f468ee02b5c54563af1353693cd81d8b3443a1",
+    7: "5364e2ea476a692f322f8c0bf8f119393ed441810f0f72a21e4762a123ca903d",
+    8: "f1599b84b1e8183906ed5091e9e794d3b6b0328a9a9640961044c4be65ec352d",
+    9: "128f1066301f187d3e781c2986850c4284d0a883a2d3741431db3a99303ee4b4",
+    10: "1fe86583b709ac92bb6b89a1514b5eff9a38e865967832a8eac4daeca6276683",
+    11: "422b4ec9949ae36012ca9a23ea5670f5b3cfd0444cda5d6c77499487feb9a799",
+}
+
+
+def test_versions_are_consecutive():
+    assert [version for version, _, _ in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+
+def test_shipped_migrations_are_unchanged():
+    for version, _, sql in MIGRATIONS:
+        if version in SHIPPED:
+            assert hashlib.sha256(sql.encode()).hexdigest() == SHIPPED[version], \
+                f"migration {version} was edited after it shipped; add a new migration instead"
+
+
+def test_expected_indexes_come_from_the_migrations():
+    indexes = expected_indexes()
+    assert "landmarks_location_geog_gix" in indexes
+    assert "landmarks_lower_name_idx" in indexes
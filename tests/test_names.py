@@ -0,0 +1,38 @@
+import pytest
+
+import names
+
+
+@pytest.fixture
+def directory(monkeypatch):
+    directory = names.NameDirectory({
+        "landmarks": [(1, "Louvre"), (7, "louvre "), (9, "Eiffel Tower")],
+        "cities": [(3, "Paris")],
+    })
+    monkeypatch.setattr(names, "NAME_CACHE_ENABLED", True)
+    monkeypatch.setattr(names, "get_directory", lambda: directory)
+    return directory
+
+
+def test_resolve_id_matches_case_and_surrounding_space(directory):
+    assert names.resolve_id("landmarks", "EIFFEL TOWER") == 9
+    assert names.resolve_id("cities", " paris") == 3
+
+
+def test_resolve_id_rejects_a_name_shared_by_several_rows(directory):
+    with pytest.raises(ValueError, match=r"\[1, 7\]"):
+        names.resolve_id("landmarks", "Louvre")
+    assert names.ambiguous_names()["landmarks"] == {"louvre": [1, 7]}
+
+
+def test_directory_update_moves_a_renamed_row(directory):
+    directory.update("landmarks", [7], [(7, "Louvre Pyramid")])
+    assert names.resolve_id("landmarks", "louvre") == 1
+    assert names.resolve_id("landmarks", "Louvre Pyramid") == 7
+
+
+def test_resolve_ids_many_pairs_each_name_with_each_of_its_ids(monkeypatch):
+    ids = {"Louvre": [1, 7], "louvre ": [1, 7], "Nowhere": []}
+    monkeypatch.setattr(names, "resolve_ids", lambda table, name: ids[name])
+    assert names.resolve_ids_many("landmarks", ["Louvre", "louvre ", "Nowhere"]) == (
+        ["Louvre", "Louvre", "louvre ", "louvre "], [1, 7, 1, 7])
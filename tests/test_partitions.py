@@ -0,0 +1,32 @@
+from datetime import date
+
+import pytest
+
+from partitions import add_months, partitions
+
+
+@pytest.mark.parametrize("day, months, expected", [
+    (date(2026, 10, 17), 0, date(2026, 10, 1)),
+    (date(2026, 10, 17), 3, date(2027, 1, 1)),
+    (date(2026, 1, 31), -1, date(2025, 12, 1)),
+    (date(2026, 3, 1), -24, date(2024, 3, 1)),
+])
+def test_add_months(day, months, expected):
+    assert add_months(day, months) == expected
+
+
+class FakeCursor:
+    def __init__(self, names):
+        self.names = names
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        return [(name,) for name in self.names]
+
+
+def test_partitions_maps_months_and_skips_the_default():
+    cursor = FakeCursor(["reviews_y2026m09", "reviews_default", "reviews_y2026m10"])
+    assert partitions(cursor, "reviews") == {date(2026, 9, 1): "reviews_y2026m09",
+                                            date(2026, 10, 1): "reviews_y2026m10"}
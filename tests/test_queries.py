@@ -0,0 +1,34 @@
+import pytest
+
+from queries import QUERY_KEYS, decode_cursor, encode_cursor, split_page, to_dollar_params
+
+
+def test_cursor_round_trip():
+    token = encode_cursor([42])
+    assert decode_cursor("landmarks_in_city", token) == [42]
+    assert decode_cursor("nearby_landmarks", encode_cursor([1, 2])) == [1, 2]
+
+
+@pytest.mark.parametrize("values", [["x"], [1.5], [True], [2 ** 31], [1, 2], {"id": 1}])
+def test_cursor_with_wrong_values_is_rejected(values):
+    with pytest.raises(ValueError):
+        decode_cursor("landmarks_in_city", encode_cursor(values) if isinstance(values, list) else "e30=")
+
+
+def test_cursor_that_is_not_base64_json_is_rejected():
+    with pytest.raises(ValueError):
+        decode_cursor("landmarks_in_city", "not a token")
+
+
+def test_split_page_builds_next_cursor_only_for_full_pages():
+    width = len(QUERY_KEYS["landmarks_in_city"])
+    rows = [(1,) * width + ("a",), (5,) * width + ("b",)]
+    page, next_cursor = split_page("landmarks_in_city", rows, 2)
+    assert page == [("a",), ("b",)]
+    assert decode_cursor("landmarks_in_city", next_cursor) == [5] * width
+    assert split_page("landmarks_in_city", rows, 3)[1] is None
+
+
+
+def test_to_dollar_params():
+    assert to_dollar_params("SELECT %s, %s WHERE name LIKE 'a%%'") == "SELECT $1, $2 WHERE name LIKE 'a%'"
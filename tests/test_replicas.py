@@ -0,0 +1,86 @@
+from contextlib import contextmanager
+
+import pytest
+
+import db
+
+
+class FakePool:
+    def __init__(self, name, down=False):
+        self.name = name
+        self.down = down
+        self.checkouts = 0
+
+    def getconn(self):
+        self.checkouts += 1
+        if self.down:
+            raise OSError(f"{self.name} is down")
+        return self.name
+
+    def putconn(self, conn, discard=False):
+        pass
+
+    @contextmanager
+    def lease(self, conn):
+        yield conn
+
+    @contextmanager
+    def connection(self):
+        yield self.name
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(db.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_router(monkeypatch, *hosts, **kwargs):
+    router = db.ReplicaRouter(list(hosts), max_lag=0, **kwargs)
+    for replica in router.replicas:
+        replica._pool = FakePool(replica.name)
+    monkeypatch.setattr(db, "get_pool", lambda: FakePool("primary"))
+    return router
+
+
+def read(router):
+    with router.connection() as conn:
+        return conn
+
+
+def test_reads_go_to_the_replica_with_fewest_requests_in_flight(monkeypatch):
+    router = make_router(monkeypatch, "a", "b")
+    router.replicas[0].outstanding = 1
+    assert read(router) == "b"
+
+
+def test_breaker_opens_after_consecutive_failures_and_closes_after_reset(monkeypatch, clock):
+    router = make_router(monkeypatch, "a", breaker_failures=2, breaker_reset=30)
+    replica = router.replicas[0]
+    replica.pool.down = True
+    assert read(router) == "primary"
+    assert read(router) == "primary"
+    assert router.stats()["replicas"][0]["breaker_open"]
+
+    # Open: the replica is not even tried
+    assert read(router) == "primary"
+    assert replica.pool.checkouts == 2
+    assert router.primary_fallbacks == 3
+
+    clock[0] += 30
+    replica.pool.down = False
+    assert read(router) == "a"
+    assert (replica.failures, replica.reads, replica.errors) == (0, 1, 2)
+
+
+def test_a_success_resets_the_failure_count(monkeypatch):
+    router = make_router(monkeypatch, "a", breaker_failures=2)
+    replica = router.replicas[0]
+    replica.pool.down = True
+    read(router)
+    replica.pool.down = False
+    read(router)
+    replica.pool.down = True
+    read(router)
+    assert replica.open_until == 0.0
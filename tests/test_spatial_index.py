@@ -0,0 +1,80 @@
+import math
+import random
+
+import pytest
+
+from spatial_index import (KDTree, SpatialIndex, _chord_for_distance, _to_unit_vector,
+                           geodesic_distance, haversine_distance)
+
+
+def random_points(count, seed=1):
+    rng = random.Random(seed)
+    return [(rng.uniform(-180, 180), math.degrees(math.asin(rng.uniform(-1, 1)))) for _ in range(count)]
+
+
+def test_geodesic_distance_matches_vincenty_reference():
+    # Flinders Peak to Buninyong, from Vincenty (1975)
+    distance = geodesic_distance(144.42486789, -37.95103342, 143.92649554, -37.65282114)
+    assert distance == pytest.approx(54972.271, abs=0.001)
+
+
+def test_geodesic_distance_along_equator():
+    assert geodesic_distance(0, 0, 1, 0) == pytest.approx(111319.491, abs=0.001)
+    assert geodesic_distance(10, 20, 10, 20) == 0.0
+
+
+def test_geodesic_distance_falls_back_near_antipodes():
+    distance = geodesic_distance(0, 0, 179.7, 0.1)
+    assert math.isfinite(distance)
+    assert distance == pytest.approx(haversine_distance(0, 0, 179.7, 0.1), rel=0.01)
+
+
+def test_kdtree_within_matches_brute_force():
+    points = random_points(500)
+    tree = KDTree((_to_unit_vector(lon, lat), i) for i, (lon, lat) in enumerate(points))
+    for lon, lat in random_points(50, seed=2):
+        chord = _chord_for_distance(1_500_000)
+        center = _to_unit_vector(lon, lat)
+        expected = {i for i, (plon, plat) in enumerate(points)
+                    if math.dist(_to_unit_vector(plon, plat), center) <= chord}
+        assert set(tree.within(center, chord)) == expected
+
+
+def test_kdtree_nearest_matches_brute_force():
+    points = random_points(500)
+    tree = KDTree((_to_unit_vector(lon, lat), i) for i, (lon, lat) in enumerate(points))
+    for lon, lat in random_points(50, seed=3):
+        center = _to_unit_vector(lon, lat)
+        expected = min(range(len(points)), key=lambda i: math.dist(_to_unit_vector(*points[i]), center))
+        assert tree.nearest(center) == expected
+
+
+def test_kdtree_nearest_of_empty_tree():
+    assert KDTree([]).nearest((1.0, 0.0, 0.0)) is None
+
+
+@pytest.fixture
+def index():
+    cities = [(1, "Oslo", 10.75, 59.91), (2, "Tromso", 18.96, 69.65)]
+    rng = random.Random(4)
+    landmarks = []
+    for landmark_id in range(1, 301):
+        city_id, _, lon, lat = cities[landmark_id % 2]
+        landmarks.append((landmark_id, f"landmark {landmark_id}", city_id,
+                          lon + rng.uniform(-0.5, 0.5), lat + rng.uniform(-0.2, 0.2)))
+    return SpatialIndex(landmarks, cities)
+
+
+def test_landmarks_within_radius_matches_brute_force(index):
+    expected = [(row[1],) for row in sorted(index.landmarks.values())
+                if row[2] == 1 and geodesic_distance(10.75, 59.91, row[3], row[4]) <= 10_000]
+    assert index.landmarks_within_radius("Oslo", 10_000) == expected
+    assert index.landmarks_within_radius("Nowhere", 10_000) == []
+
+
+def test_closest_landmark_matches_brute_force(index):
+    for lat, lon in [(59.9, 10.7), (69.7, 19.0), (0.0, 0.0)]:
+        name, distance = index.closest_landmark(lat, lon)
+        best = min(index.landmarks.values(), key=lambda row: geodesic_distance(lon, lat, row[3], row[4]))
+        assert name == best[1]
+        assert distance == pytest.approx(geodesic_distance(lon, lat, best[3], best[4]))
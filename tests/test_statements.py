@@ -0,0 +1,114 @@
+import pytest
+
+import statements
+from statements import prepared_sql
+
+
+class FakeDriver:
+    class Error(Exception):
+        def __init__(self, pgcode=None):
+            super().__init__(pgcode)
+            self.pgcode = pgcode
+
+    class extensions:
+        TRANSACTION_STATUS_IDLE = 0
+        TRANSACTION_STATUS_INTRANS = 2
+
+
+class FakeConnection:
+    def __init__(self, transaction_status=FakeDriver.extensions.TRANSACTION_STATUS_IDLE):
+        self.prepared_statements = set()
+        self.info = type("info", (), {"transaction_status": transaction_status})()
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeCursor:
+    """Records statements; EXECUTE of a name in ``stale`` fails once as a changed plan would."""
+
+    def __init__(self, connection, stale=()):
+        self.connection = connection
+        self.stale = set(stale)
+        self.sent = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.sent.append(sql)
+        name = sql.split()[1] if sql.startswith("EXECUTE") else None
+        if name in self.stale:
+            self.stale.discard(name)
+            raise FakeDriver.Error(statements.STALE_PLAN_SQLSTATE)
+
+
+@pytest.fixture(autouse=True)
+def fake_statements(monkeypatch):
+    monkeypatch.setattr(statements, "driver", lambda: FakeDriver)
+    monkeypatch.setattr(statements, "PREPARE_ENABLED", True)
+    monkeypatch.setitem(statements.STATEMENTS, "positional", "SELECT %s, %s WHERE name LIKE 'a%%'")
+    monkeypatch.setitem(statements.STATEMENTS, "named",
+                        "SELECT %(a)s WHERE x < %(b)s OR x > %(a)s LIMIT %(k)s")
+    prepared_sql.cache_clear()
+    yield
+    prepared_sql.cache_clear()
+
+
+def test_positional_placeholders_are_numbered_in_order():
+    assert prepared_sql("positional") == ("SELECT $1, $2 WHERE name LIKE 'a%'", (0, 1))
+
+
+def test_repeated_named_placeholder_maps_to_one_parameter():
+    assert prepared_sql("named") == ("SELECT $1 WHERE x < $2 OR x > $1 LIMIT $3", ("a", "b", "k"))
+
+
+def test_registered_statements_number_every_name_once():
+    sql, keys = prepared_sql("find_nearest_landmarks")
+    assert "%(" not in sql
+    assert set(keys) == {"lon", "lat", "k", "candidates", "max_distance", "landmark_type"}
+    assert len(keys) == len(set(keys))
+
+
+def test_statement_is_prepared_once_per_connection():
+    conn = FakeConnection()
+    cursor = FakeCursor(conn)
+    statements.execute(cursor, "positional", (1, 2))
+    statements.execute(cursor, "positional", (3, 4))
+    assert [sql for sql in cursor.sent if sql.startswith("PREPARE")] == [
+        "PREPARE stmt_positional AS SELECT $1, $2 WHERE name LIKE 'a%'"]
+    assert cursor.sent.count("EXECUTE stmt_positional (%s, %s)") == 2
+
+
+def test_stale_plan_is_deallocated_and_retried_at_start_of_transaction():
+    conn = FakeConnection()
+    cursor = FakeCursor(conn)
+    statements.execute(cursor, "positional", (1, 2))
+    cursor.stale.add("stmt_positional")
+    statements.execute(cursor, "positional", (1, 2))
+    assert conn.rollbacks == 1
+    assert cursor.sent[-3:] == ["DEALLOCATE ALL",
+                                "PREPARE stmt_positional AS SELECT $1, $2 WHERE name LIKE 'a%'",
+                                "EXECUTE stmt_positional (%s, %s)"]
+
+
+def test_stale_plan_inside_a_transaction_is_raised_and_deallocated_next_time():
+    conn = FakeConnection()
+    cursor = FakeCursor(conn)
+    statements.execute(cursor, "positional", (1, 2))
+    conn.info.transaction_status = FakeDriver.extensions.TRANSACTION_STATUS_INTRANS
+    cursor.stale.add("stmt_positional")
+    with pytest.raises(FakeDriver.Error):
+        statements.execute(cursor, "positional", (1, 2))
+    assert conn.rollbacks == 0
+    statements.execute(cursor, "positional", (1, 2))
+    assert "DEALLOCATE ALL" in cursor.sent
+
+
+def test_reset_prepared_makes_connections_start_afresh():
+    conn = FakeConnection()
+    cursor = FakeCursor(conn)
+    statements.execute(cursor, "positional", (1, 2))
+    statements.reset_prepared()
+    statements.execute(cursor, "positional", (1, 2))
+    assert cursor.sent.count("DEALLOCATE ALL") == 1
+    assert sum(sql.startswith("PREPARE") for sql in cursor.sent) == 2
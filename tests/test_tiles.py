@@ -0,0 +1,29 @@
+import pytest
+
+from tiles import MAX_TILE_ZOOM, TILE_ZOOMS, _cell_params, cell_zoom, valid_tile
+
+
+@pytest.mark.parametrize("zoom, x, y, valid", [
+    (0, 0, 0, True),
+    (0, 1, 0, False),
+    (3, 7, 7, True),
+    (3, 8, 0, False),
+    (3, 0, -1, False),
+    (-1, 0, 0, False),
+    (MAX_TILE_ZOOM, (1 << MAX_TILE_ZOOM) - 1, 0, True),
+    (MAX_TILE_ZOOM + 1, 0, 0, False),
+])
+def test_valid_tile(zoom, x, y, valid):
+    assert valid_tile(zoom, x, y) is valid
+
+
+def test_cell_zoom_is_finer_than_the_tile_up_to_the_finest_stored_zoom():
+    assert cell_zoom(0) == 4
+    assert cell_zoom(5) == 10
+    assert cell_zoom(MAX_TILE_ZOOM) == TILE_ZOOMS[-1]
+
+
+def test_cell_params_cover_the_tile():
+    assert _cell_params(2, 1, 3) == (6, 16, 31, 48, 63)
+    # Finer than any stored zoom: the one enclosing cell
+    assert _cell_params(16, 1000, 2001) == (14, 250, 250, 500, 500)
@@ -0,0 +1,275 @@
+"""Landmark, visit and rating aggregates on a web-map tile grid.
+
+tile_stats holds, for every non-empty Web Mercator tile at each zoom in
+TILE_ZOOMS, the number of landmarks in it and the sums behind their visit
+counts and average rating. It is kept current from landmark_stats:
+
+- visits and reviews change landmark_stats, whose trigger adds the
+  difference to the landmark's cell at every zoom;
+- inserted, moved or deleted landmarks have their old and new cells
+  recomputed, the finest zoom from the base tables and each coarser zoom
+  from the cells of the next finer one.
+
+A map tile is served as the cells TILE_DETAIL zoom levels below it, so the
+response size is bounded however many landmarks the tile covers.
+
+Usage: python tiles.py install   # create the table and triggers, then rebuild
+       python tiles.py rebuild   # recompute every cell from scratch
+"""
+import argparse
+import logging
+import os
+
+from db import get_connection, get_cursor
+from statements import execute
+
+# Zoom levels with precomputed cells
+TILE_ZOOMS = (2, 4, 6, 8, 10, 12, 14)
+# A tile is answered with the cells of the first stored zoom at least this
+# many levels finer, so at least 16 x 16 cells where the grid allows
+TILE_DETAIL = 4
+MAX_TILE_ZOOM = 22
+# Seconds a served tile may be reused, by the server cache and by clients
+TILE_MAX_AGE = int(os.environ.get("SPATIAL_TILE_MAX_AGE", "60"))
+
+_ZOOMS_SQL = "ARRAY[" + ", ".join(str(zoom) for zoom in TILE_ZOOMS) + "]"
+_ZOOMS_FINEST_FIRST_SQL = "ARRAY[" + ", ".join(str(zoom) for zoom in reversed(TILE_ZOOMS)) + "]"
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS tile_stats (
+    zoom smallint NOT NULL,
+    x integer NOT NULL,
+    y integer NOT NULL,
+    landmark_count bigint NOT NULL DEFAULT 0,
+    visit_count bigint NOT NULL DEFAULT 0,
+    rating_sum bigint NOT NULL DEFAULT 0,
+    rating_count bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (zoom, x, y)
+);
+
+CREATE OR REPLACE FUNCTION tile_x(zoom integer, lon double precision) RETURNS integer AS $$
+    SELECT LEAST(GREATEST(floor((lon + 180) / 360 * (1 << zoom))::integer, 0), (1 << zoom) - 1)
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION tile_y(zoom integer, lat double precision) RETURNS integer AS $$
+    SELECT LEAST(GREATEST(floor(
+        (1 - ln(tan(radians(c.lat)) + 1 / cos(radians(c.lat))) / pi()) / 2 * (1 << zoom))::integer, 0),
+        (1 << zoom) - 1)
+    FROM (SELECT LEAST(GREATEST(lat, -85.0511), 85.0511) AS lat) c
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Recompute the cells containing ``points`` at every zoom, finest first
+CREATE OR REPLACE FUNCTION tile_stats_refresh(points geometry[]) RETURNS void AS $$
+DECLARE
+    z integer;
+    finer integer;
+BEGIN
+    FOREACH z IN ARRAY {zooms_finest_first} LOOP
+        DELETE FROM tile_stats t
+        USING (SELECT DISTINCT tile_x(z, ST_X(p)) AS x, tile_y(z, ST_Y(p)) AS y
+               FROM unnest(points) AS p WHERE p IS NOT NULL) c
+        WHERE t.zoom = z AND t.x = c.x AND t.y = c.y;
+        IF finer IS NULL THEN
+            INSERT INTO tile_stats (zoom, x, y, landmark_count, visit_count, rating_sum, rating_count)
+            SELECT z, c.x, c.y, COUNT(*), COALESCE(SUM(s.visit_count), 0),
+                   COALESCE(SUM(s.rating_sum), 0), COALESCE(SUM(s.rating_count), 0)
+            FROM (SELECT DISTINCT tile_x(z, ST_X(p)) AS x, tile_y(z, ST_Y(p)) AS y
+                  FROM unnest(points) AS p WHERE p IS NOT NULL) c
+            JOIN landmarks l
+              ON l.location && ST_Transform(ST_TileEnvelope(z, c.x, c.y), 4326)
+             AND tile_x(z, ST_X(l.location)) = c.x AND tile_y(z, ST_Y(l.location)) = c.y
+            LEFT JOIN landmark_stats s ON s.landmark_id = l.id
+            GROUP BY c.x, c.y;
+        ELSE
+            INSERT INTO tile_stats (zoom, x, y, landmark_count, visit_count, rating_sum, rating_count)
+            SELECT z, c.x, c.y, SUM(t.landmark_count), SUM(t.visit_count),
+                   SUM(t.rating_sum), SUM(t.rating_count)
+            FROM (SELECT DISTINCT tile_x(z, ST_X(p)) AS x, tile_y(z, ST_Y(p)) AS y
+                  FROM unnest(points) AS p WHERE p IS NOT NULL) c
+            JOIN tile_stats t
+              ON t.zoom = finer
+             AND t.x BETWEEN c.x << (finer - z) AND ((c.x + 1) << (finer - z)) - 1
+             AND t.y BETWEEN c.y << (finer - z) AND ((c.y + 1) << (finer - z)) - 1
+            GROUP BY c.x, c.y;
+        END IF;
+        finer := z;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION tile_stats_landmarks() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE tile_stats;
+    ELSIF TG_OP = 'INSERT' THEN
+        PERFORM tile_stats_refresh(ARRAY(SELECT location FROM new_rows));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM tile_stats_refresh(ARRAY(SELECT location FROM old_rows
+                                         UNION ALL SELECT location FROM new_rows));
+    ELSE
+        PERFORM tile_stats_refresh(ARRAY(SELECT location FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Visit and rating changes arrive as landmark_stats changes; add the
+-- difference to the landmark's cell at every zoom.
+CREATE OR REPLACE FUNCTION tile_stats_landmark_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE tile_stats SET visit_count = 0, rating_sum = 0, rating_count = 0;
+    ELSIF TG_OP = 'INSERT' THEN
+        INSERT INTO tile_stats AS t (zoom, x, y, visit_count, rating_sum, rating_count)
+        SELECT z.zoom, tile_x(z.zoom, ST_X(l.location)), tile_y(z.zoom, ST_Y(l.location)),
+               SUM(n.visit_count), SUM(n.rating_sum), SUM(n.rating_count)
+        FROM new_rows n
+        JOIN landmarks l ON l.id = n.landmark_id
+        CROSS JOIN unnest({zooms}) AS z(zoom)
+        WHERE l.location IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (zoom, x, y)
+        DO UPDATE SET visit_count = t.visit_count + EXCLUDED.visit_count,
+                      rating_sum = t.rating_sum + EXCLUDED.rating_sum,
+                      rating_count = t.rating_count + EXCLUDED.rating_count;
+    ELSE
+        INSERT INTO tile_stats AS t (zoom, x, y, visit_count, rating_sum, rating_count)
+        SELECT z.zoom, tile_x(z.zoom, ST_X(l.location)), tile_y(z.zoom, ST_Y(l.location)),
+               SUM(n.visit_count - o.visit_count), SUM(n.rating_sum - o.rating_sum),
+               SUM(n.rating_count - o.rating_count)
+        FROM new_rows n
+        JOIN old_rows o ON o.landmark_id = n.landmark_id
+        JOIN landmarks l ON l.id = n.landmark_id
+        CROSS JOIN unnest({zooms}) AS z(zoom)
+        WHERE l.location IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (zoom, x, y)
+        DO UPDATE SET visit_count = t.visit_count + EXCLUDED.visit_count,
+                      rating_sum = t.rating_sum + EXCLUDED.rating_sum,
+                      rating_count = t.rating_count + EXCLUDED.rating_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS landmarks_tiles_insert ON landmarks;
+DROP TRIGGER IF EXISTS landmarks_tiles_update ON landmarks;
+DROP TRIGGER IF EXISTS landmarks_tiles_delete ON landmarks;
+DROP TRIGGER IF EXISTS landmarks_tiles_truncate ON landmarks;
+CREATE TRIGGER landmarks_tiles_insert AFTER INSERT ON landmarks
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmarks();
+CREATE TRIGGER landmarks_tiles_update AFTER UPDATE ON landmarks
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmarks();
+CREATE TRIGGER landmarks_tiles_delete AFTER DELETE ON landmarks
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmarks();
+CREATE TRIGGER landmarks_tiles_truncate AFTER TRUNCATE ON landmarks
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmarks();
+
+DROP TRIGGER IF EXISTS landmark_stats_tiles_insert ON landmark_stats;
+DROP TRIGGER IF EXISTS landmark_stats_tiles_update ON landmark_stats;
+DROP TRIGGER IF EXISTS landmark_stats_tiles_truncate ON landmark_stats;
+CREATE TRIGGER landmark_stats_tiles_insert AFTER INSERT ON landmark_stats
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmark_stats();
+CREATE TRIGGER landmark_stats_tiles_update AFTER UPDATE ON landmark_stats
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmark_stats();
+CREATE TRIGGER landmark_stats_tiles_truncate AFTER TRUNCATE ON landmark_stats
+    FOR EACH STATEMENT EXECUTE FUNCTION tile_stats_landmark_stats();
+""".format(zooms=_ZOOMS_SQL, zooms_finest_first=_ZOOMS_FINEST_FIRST_SQL)
+
+REBUILD_SQL = """
+LOCK TABLE landmarks, landmark_stats IN SHARE MODE;
+TRUNCATE tile_stats;
+INSERT INTO tile_stats (zoom, x, y, landmark_count, visit_count, rating_sum, rating_count)
+SELECT z.zoom, tile_x(z.zoom, ST_X(l.location)), tile_y(z.zoom, ST_Y(l.location)),
+       COUNT(*), COALESCE(SUM(s.visit_count), 0),
+       COALESCE(SUM(s.rating_sum), 0), COALESCE(SUM(s.rating_count), 0)
+FROM landmarks l
+LEFT JOIN landmark_stats s ON s.landmark_id = l.id
+CROSS JOIN unnest({zooms}) AS z(zoom)
+WHERE l.location IS NOT NULL
+GROUP BY 1, 2, 3;
+""".format(zooms=_ZOOMS_SQL)
+
+
+def cell_zoom(zoom):
+    """Stored zoom whose cells make up a tile at ``zoom``."""
+    wanted = zoom + TILE_DETAIL
+    return next((z for z in TILE_ZOOMS if z >= wanted), TILE_ZOOMS[-1])
+
+
+def valid_tile(zoom, x, y):
+    return 0 <= zoom <= MAX_TILE_ZOOM and 0 <= x < 1 << zoom and 0 <= y < 1 << zoom
+
+
+def _cell_params(zoom, x, y):
+    """(cell zoom, x range, y range) of the cells covering tile zoom/x/y."""
+    cz = cell_zoom(zoom)
+    if cz >= zoom:
+        shift = cz - zoom
+        return cz, x << shift, ((x + 1) << shift) - 1, y << shift, ((y + 1) << shift) - 1
+    # Finer than any stored zoom: the one enclosing cell
+    shift = zoom - cz
+    return cz, x >> shift, x >> shift, y >> shift, y >> shift
+
+
+def tile_cells(zoom, x, y):
+    """Cells of one tile as dicts with x, y (at ``cell_zoom``), landmarks, visits, average_rating.
+
+    Errors propagate to the caller.
+    """
+    cz, x0, x1, y0, y1 = _cell_params(zoom, x, y)
+    with get_cursor(readonly=True) as cursor:
+        execute(cursor, "tile_cells", (cz, x0, x1, y0, y1))
+        return [{"x": cx, "y": cy, "landmarks": landmarks, "visits": visits,
+                 "average_rating": float(rating) if rating is not None else None}
+                for cx, cy, landmarks, visits, rating in cursor.fetchall()]
+
+
+def tile_mvt(zoom, x, y):
+    """The tile as a Mapbox Vector Tile with one "cells" layer; errors propagate."""
+    cz, x0, x1, y0, y1 = _cell_params(zoom, x, y)
+    with get_cursor(readonly=True) as cursor:
+        execute(cursor, "tile_mvt", (zoom, x, y, cz, x0, x1, y0, y1))
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else b""
+
+
+def install_tiles():
+    """Create tile_stats and its triggers, then populate it."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA_SQL)
+            cursor.execute(REBUILD_SQL)
+    logging.info("tile_stats installed and populated.")
+
+
+def rebuild_tiles():
+    """Recompute every cell from landmarks and landmark_stats."""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(REBUILD_SQL)
+            cursor.execute("SELECT COUNT(*) FROM tile_stats;")
+            rows = cursor.fetchone()[0]
+    logging.info(f"tile_stats rebuilt ({rows} cells).")
+    return rows
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Maintain the tile_stats grid aggregates.")
+    parser.add_argument("command", choices=["install", "rebuild"])
+    args = parser.parse_args()
+    if args.command == "install":
+        install_tiles()
+    else:
+        rebuild_tiles()
+
+
+if __name__ == "__main__":
+    main()